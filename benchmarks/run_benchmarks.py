@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+# coding: utf-8
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+REST call benchmark of the dellemc modules against the Unisphere simulator.
+
+Every scenario runs one module in its own process against a freshly
+populated simulated array and records the REST calls served, the wall time
+of the module and its peak RSS. The figures are checked against the budgets
+of benchmarks/budgets.yml, the run fails when a module fails or goes over
+budget, so an N+1 regression shows up as a call count explosion.
+
+    python benchmarks/run_benchmarks.py                   # default sizes
+    python benchmarks/run_benchmarks.py --sizes large --scenarios gather_facts
+    python benchmarks/run_benchmarks.py --record          # rewrite budgets
+
+Requires Ansible and PyU4V installed, like the modules themselves.
+"""
+
+import argparse
+import importlib.util
+import itertools
+import json
+import math
+import os
+import resource
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'simulator'))
+
+import unisphere_simulator  # noqa: E402
+
+BUDGETS_FILE = os.path.join(ROOT, 'benchmarks', 'budgets.yml')
+MODULES_DIR = os.path.join(ROOT, 'dellemc')
+MODULE_UTILS = os.path.join(ROOT, 'module_utils', 'dellemc.py')
+ARRAY_ID = '000197600156'
+RECORD_HEADROOM = 1.25
+
+
+def _sg_layout(array, name):
+    """
+    Rebuild the lun request matching the current content of a SG
+    """
+    requests = {}
+    for volume_id in array.storage_groups[name]['volumes']:
+        volume = array.volumes[volume_id]
+        request = requests.setdefault(int(volume['cap_gb']), {
+            'num_vols': 0, 'cap_gb': int(volume['cap_gb']),
+            'vol_name': volume['label']})
+        request['num_vols'] += 1
+    return list(requests.values())
+
+
+def _expanded_layout(array, name):
+    """
+    Lun request of a SG with two new volume sizes added
+    """
+    return _sg_layout(array, name) + [
+        {'num_vols': 2, 'cap_gb': 7, 'vol_name': 'GROW'},
+        {'num_vols': 1, 'cap_gb': 9, 'vol_name': 'GROW'}]
+
+
+def _scenarios():
+    """
+    Scenario name -> function building (module, args) from the array model.
+    Scenarios run with universion 90 unless their args set another one
+    """
+    create_luns = [{'num_vols': 4, 'cap_gb': 10, 'vol_name': 'DATA'},
+                   {'num_vols': 2, 'cap_gb': 5, 'vol_name': 'REDO'}]
+    return {
+        'storagegroup_steady': lambda a: ('dellemc_pmax_storagegroup', {
+            'sgname': 'SG_0001', 'slo': 'Platinum', 'state': 'present',
+            'luns': _sg_layout(a, 'SG_0001')}),
+        # Volumes of the SG read with the storagegroup bulk endpoint
+        'storagegroup_steady_100': lambda a: ('dellemc_pmax_storagegroup', {
+            'sgname': 'SG_0001', 'slo': 'Platinum', 'state': 'present',
+            'luns': _sg_layout(a, 'SG_0001'), 'universion': 100}),
+        'storagegroup_create': lambda a: ('dellemc_pmax_storagegroup', {
+            'sgname': 'BENCH_SG', 'slo': 'Diamond', 'state': 'present',
+            'compression': True, 'luns': create_luns}),
+        # Every size in a single create call
+        'storagegroup_create_91': lambda a: ('dellemc_pmax_storagegroup', {
+            'sgname': 'BENCH_SG', 'slo': 'Diamond', 'state': 'present',
+            'compression': True, 'luns': create_luns, 'universion': 91}),
+        'storagegroup_expand': lambda a: ('dellemc_pmax_storagegroup', {
+            'sgname': 'SG_0001', 'slo': 'Platinum', 'state': 'present',
+            'luns': _expanded_layout(a, 'SG_0001')}),
+        # Every new size in a single expand call
+        'storagegroup_expand_91': lambda a: ('dellemc_pmax_storagegroup', {
+            'sgname': 'SG_0001', 'slo': 'Platinum', 'state': 'present',
+            'luns': _expanded_layout(a, 'SG_0001'), 'universion': 91}),
+        'volume_in_sg': lambda a: ('dellemc_pmax_volume', {
+            'sgname': ['SG_0002'], 'in_sg': 'present',
+            'volumes': [{'device_id': v} for v in
+                        a.storage_groups['SG_0002']['volumes'][:4]]}),
+        'host_steady': lambda a: ('dellemc_pmax_host', {
+            'host_id': 'HOST_0000', 'host_type': 'default',
+            'initiator_list': a.hosts['HOST_0000']['initiators'],
+            'state': 'present', 'wwn_state': 'present'}),
+        'host_create': lambda a: ('dellemc_pmax_host', {
+            'host_id': 'BENCH_HOST', 'host_type': 'default',
+            'initiator_list': ['10000000c9ffff01', '10000000c9ffff02'],
+            'state': 'present', 'wwn_state': 'present'}),
+        'cluster_steady': lambda a: ('dellemc_pmax_cluster', {
+            'cluster_name': 'HG_0000',
+            'host_list': a.host_groups['HG_0000']['hosts'],
+            'state': 'present', 'host_state': 'in_cluster'}),
+        'cluster_create': lambda a: ('dellemc_pmax_cluster', {
+            'cluster_name': 'BENCH_CL', 'host_list': ['HOST_0000',
+                                                      'HOST_0002'],
+            'state': 'present', 'host_state': 'in_cluster'}),
+        'portgroup_steady': lambda a: ('dellemc_pmax_portgroup', {
+            'portgroup_id': 'PG_0000',
+            'array_ports': a.port_groups['PG_0000']['ports'],
+            'state': 'present', 'port_state': 'in_pg'}),
+        'maskingview_create': lambda a: ('dellemc_pmax_maskingview', {
+            'maskingview_name': 'BENCH_MV', 'sgname': 'SG_0010',
+            'host_or_cluster': 'HOST_0003', 'portgroup_id': 'PG_0000',
+            'state': 'present'}),
+        'cascadedsg_create': lambda a: ('dellemc_pmax_cascadedsg', {
+            'parent_sg': 'BENCH_PARENT', 'child_sg_list': ['SG_0010',
+                                                           'SG_0011'],
+            'parent_state': 'present', 'child_state': 'present'}),
+        'snap_create': lambda a: ('dellemc_pmax_snap', {
+            'sgname': 'SG_0003', 'snapshotname': 'BENCH_SNAP',
+            'time_to_live_hrs': '1', 'action': 'create'}),
+        'snap_link': lambda a: ('dellemc_pmax_snap', {
+            'sgname': 'SG_0000', 'snapshotname': 'SNAP_SG_0000',
+            'target_sgname': 'SG_0012', 'action': 'link'}),
+        'srdf_suspend': lambda a: ('dellemc_pmax_srdf', {
+            'sgname': 'SG_0000', 'action': 'Suspend'}),
+        'movevolumes': lambda a: ('dellemc_pmax_movevolumes', {
+            'sg_source': 'SG_0004', 'sg_target': 'SG_0005',
+            'force': True}),
+        'gather_facts': lambda a: ('dellemc_pmax_gather_facts', {
+            'gather_subset': ['all']}),
+        'gather_facts_bulk': lambda a: ('dellemc_pmax_gather_facts', {
+            'gather_subset': ['all'], 'bulk_volumes': True}),
+        # Written in the working directory of the module process
+        'gather_facts_export': lambda a: ('dellemc_pmax_gather_facts', {
+            'gather_subset': ['all'], 'export_path': 'inventory.jsonl.gz'}),
+    }
+
+
+def _peak_rss_mb():
+    """
+    Peak RSS of the module process. ru_maxrss keeps the peak of the forked
+    benchmark process, simulated array included, across exec on Linux, so
+    the high-water mark of the exec'ed image is read from /proc when
+    available
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_child(spec_file):
+    """
+    Entry point of the module process: load the repository module_utils as
+    ansible.module_utils.dellemc, run the module and write the metrics
+    """
+    with open(spec_file) as f:
+        spec = json.load(f)
+    import ansible.module_utils
+    from ansible.module_utils import basic
+    module_spec = importlib.util.spec_from_file_location(
+        'ansible.module_utils.dellemc', MODULE_UTILS)
+    module_utils = importlib.util.module_from_spec(module_spec)
+    sys.modules['ansible.module_utils.dellemc'] = module_utils
+    module_spec.loader.exec_module(module_utils)
+    ansible.module_utils.dellemc = module_utils
+
+    basic._ANSIBLE_ARGS = json.dumps(
+        {'ANSIBLE_MODULE_ARGS': spec['args']}).encode('utf-8')
+    start = time.time()
+    try:
+        runpy.run_path(spec['module_path'], run_name='__main__')
+    except SystemExit:
+        pass
+    wall = time.time() - start
+    with open(spec['metrics_file'], 'w') as f:
+        json.dump({'seconds': wall, 'rss_mb': _peak_rss_mb()}, f)
+
+
+def run_scenario(name, size, size_spec, certfile, keyfile, latency, workdir):
+    """
+    Run one scenario against a freshly populated simulator
+    :return: (dict) measures of the run
+    """
+    array = unisphere_simulator.ArrayModel(ARRAY_ID)
+    array.populate(snapshots=2, srdf_groups=2, **size_spec)
+    simulator = unisphere_simulator.UnisphereSimulator([array],
+                                                       latency=latency)
+    server = unisphere_simulator.SimulatorServer(
+        simulator, port=0, certfile=certfile, keyfile=keyfile).start()
+    try:
+        module, scenario_args = _scenarios()[name](array)
+        args = dict(unispherehost='127.0.0.1', unisphereport=server.port,
+                    universion=90, verifycert=False, user='smc',
+                    password='smc', array_id=ARRAY_ID,
+                    _ansible_remote_tmp=workdir,
+                    _ansible_keep_remote_files=False)
+        args.update(scenario_args)
+        spec_file = os.path.join(workdir, 'spec.json')
+        metrics_file = os.path.join(workdir, 'metrics.json')
+        with open(spec_file, 'w') as f:
+            json.dump({'module_path': os.path.join(MODULES_DIR,
+                                                   module + '.py'),
+                       'args': args, 'metrics_file': metrics_file}, f)
+        simulator.reset_stats()
+        process = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', spec_file],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=workdir)
+        with open(metrics_file) as f:
+            measures = json.load(f)
+        measures['calls'] = simulator.stats['calls']
+        measures['by_endpoint'] = simulator.stats['by_endpoint']
+        try:
+            result = json.loads(process.stdout.decode('utf-8'))
+        except ValueError:
+            result = {'failed': True,
+                      'msg': process.stderr.decode('utf-8')[-2000:]}
+        measures['failed'] = bool(result.get('failed'))
+        measures['msg'] = result.get('msg')
+    finally:
+        server.stop()
+    return measures
+
+
+def check(measures, budget):
+    """
+    :return: (list) budget violations
+    """
+    errors = []
+    if measures['failed']:
+        errors.append('module failed: {}'.format(measures['msg']))
+    if not budget:
+        errors.append('no budget recorded')
+        return errors
+    for key in ('calls', 'seconds', 'rss_mb'):
+        if key in budget and measures[key] > budget[key]:
+            errors.append('{} {:.1f} over budget {}'.format(
+                key, measures[key], budget[key]))
+    return errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--sizes', nargs='+')
+    parser.add_argument('--scenarios', nargs='+')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added by the simulator to every call')
+    parser.add_argument('--record', action='store_true',
+                        help='write the measures (plus headroom) as budgets')
+    parser.add_argument('--json', help='write the raw measures to this file')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        return run_child(args.child)
+
+    with open(BUDGETS_FILE) as f:
+        lines = f.readlines()
+    config = yaml.safe_load(''.join(lines))
+    # Leading comment of the budgets file, written back by --record
+    header = ''.join(itertools.takewhile(lambda l: l.startswith('#'), lines))
+    sizes = args.sizes or config['default_sizes']
+    scenarios = args.scenarios or sorted(_scenarios())
+    workdir = tempfile.mkdtemp(prefix='pmax_bench_')
+    certfile, keyfile = unisphere_simulator.generate_self_signed_cert(
+        workdir)
+    results = {}
+    failures = 0
+    try:
+        print('{:<22} {:<7} {:>14} {:>16} {:>14}'.format(
+            'scenario', 'size', 'calls', 'seconds', 'rss_mb'))
+        for name in scenarios:
+            for size in sizes:
+                measures = run_scenario(name, size, config['sizes'][size],
+                                        certfile, keyfile, args.latency,
+                                        workdir)
+                results.setdefault(name, {})[size] = measures
+                budget = config['budgets'].get(name, {}).get(size)
+                errors = [] if args.record else check(measures, budget)
+                budget = budget or {}
+                print('{:<22} {:<7} {:>6}/{:<7} {:>7.2f}/{:<8} {:>6.1f}/{:<7}'
+                      ' {}'.format(name, size, measures['calls'],
+                                   budget.get('calls', '-'),
+                                   measures['seconds'],
+                                   budget.get('seconds', '-'),
+                                   measures['rss_mb'],
+                                   budget.get('rss_mb', '-'),
+                                   'FAIL' if errors else 'ok'))
+                for error in errors:
+                    print('    ' + error)
+                if errors:
+                    failures += 1
+                    top = sorted(measures['by_endpoint'].items(),
+                                 key=lambda x: -x[1])[:3]
+                    for endpoint, count in top:
+                        print('    {:>7} {}'.format(count, endpoint))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.record:
+        for name, by_size in results.items():
+            for size, measures in by_size.items():
+                config['budgets'].setdefault(name, {})[size] = {
+                    'calls': int(math.ceil(measures['calls'] *
+                                           RECORD_HEADROOM)),
+                    'seconds': round(max(measures['seconds'] *
+                                         RECORD_HEADROOM * 4, 5), 1),
+                    'rss_mb': int(math.ceil(measures['rss_mb'] *
+                                            RECORD_HEADROOM))}
+        with open(BUDGETS_FILE, 'w') as f:
+            f.write(header)
+            yaml.safe_dump(config, f, default_flow_style=None,
+                           sort_keys=False)
+        return 0
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
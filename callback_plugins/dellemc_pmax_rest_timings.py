@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Callback plugin summarising the PowerMax REST calls of a playbook run from the
+pmax_trace results of the dellemc_pmax modules.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = '''
+    callback: dellemc_pmax_rest_timings
+    type: aggregate
+    short_description: Summary of the PowerMax REST calls of a playbook run
+    description:
+      - Aggregates the REST calls recorded by the dellemc_pmax modules run
+        with trace enabled (PMAX_TRACE=true) per task, per module and per
+        endpoint.
+      - Prints at the end of the run the tasks spending the most time on
+        REST calls, the endpoints with the highest average latency, the most
+        called ones and the time spent waiting on asynchronous jobs.
+    requirements:
+      - whitelist in configuration (callback_whitelist = dellemc_pmax_rest_timings)
+      - trace enabled on the dellemc_pmax tasks
+    options:
+      top:
+        description: Number of entries shown in each ranking.
+        default: 10
+        type: int
+        env:
+          - name: PMAX_TIMINGS_TOP
+        ini:
+          - section: callback_dellemc_pmax_rest_timings
+            key: top
+'''
+
+from ansible.plugins.callback import CallbackBase
+
+# Endpoints polled while an asynchronous job runs
+JOB_URI_PREFIX = '/system/job/'
+
+
+class EndpointTimings(object):
+    """
+    Call count and latencies of one group of REST calls
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.slowest = 0.0
+        self.errors = 0
+
+    def add(self, event):
+        """
+        Account one trace event
+        :param event: (dict) Chrome trace event of pmax_trace
+        :return: None
+        """
+        seconds = event['dur'] / 1e6
+        self.calls += 1
+        self.seconds += seconds
+        self.slowest = max(self.slowest, seconds)
+        status = event['args'].get('status')
+        if status is None or status >= 400:
+            self.errors += 1
+
+    @property
+    def average(self):
+        return self.seconds / self.calls if self.calls else 0.0
+
+
+class TaskTimings(EndpointTimings):
+    """
+    REST calls of one task, across hosts and loop items
+    """
+
+    def __init__(self, name, module):
+        super(TaskTimings, self).__init__()
+        self.name = name
+        self.module = module
+        self.job_wait = 0.0
+
+    def add_trace(self, events):
+        """
+        Account the events of one module run. A job is waited on from the
+        end of the write that submitted it, the job polls coming after the
+        sleep before the first one, to the end of its last poll. The spans of
+        the jobs of the run are merged so concurrent jobs count once
+        :param events: (list) pmax_trace of the result
+        :return: None
+        """
+        spans = []
+        write_end = None
+        for event in sorted(events, key=lambda e: e['ts']):
+            self.add(event)
+            end = event['ts'] + event['dur']
+            if event['args'].get('uri', '').startswith(JOB_URI_PREFIX):
+                start = event['ts'] if write_end is None else write_end
+                spans.append([start, end])
+            elif event['args'].get('method') != 'GET':
+                write_end = end
+        merged = []
+        for start, end in sorted(spans):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self.job_wait += sum(end - start for start, end in merged) / 1e6
+
+
+class CallbackModule(CallbackBase):
+    """
+    Aggregates the pmax_trace results of the run and prints a ranked summary
+    """
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'dellemc_pmax_rest_timings'
+    CALLBACK_NEEDS_WHITELIST = True
+
+    def __init__(self, display=None):
+        super(CallbackModule, self).__init__(display=display)
+        self.top = 10
+        self.tasks = {}
+        self.modules = {}
+        self.endpoints = {}
+
+    def set_options(self, task_keys=None, var_options=None, direct=None):
+        super(CallbackModule, self).set_options(task_keys=task_keys,
+                                                var_options=var_options,
+                                                direct=direct)
+        self.top = self.get_option('top')
+
+    @staticmethod
+    def _traces(result):
+        """
+        pmax_trace lists of a result, one per loop item
+        :param result: (dict) task result
+        :return: (list) lists of trace events
+        """
+        traces = []
+        if result.get('pmax_trace'):
+            traces.append(result['pmax_trace'])
+        for item in result.get('results') or []:
+            if isinstance(item, dict) and item.get('pmax_trace'):
+                traces.append(item['pmax_trace'])
+        return traces
+
+    def _record(self, result):
+        traces = self._traces(result._result)
+        if not traces:
+            return
+        task = result._task
+        module = task.action
+        timings = self.tasks.get(task._uuid)
+        if timings is None:
+            timings = self.tasks[task._uuid] = TaskTimings(
+                task.get_name(), module)
+        module_timings = self.modules.setdefault(module, EndpointTimings())
+        for events in traces:
+            timings.add_trace(events)
+            for event in events:
+                module_timings.add(event)
+                self.endpoints.setdefault(
+                    event['name'], EndpointTimings()).add(event)
+
+    def v2_runner_on_ok(self, result):
+        self._record(result)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._record(result)
+
+    def _ranking(self, title, entries, key, line):
+        self._display.banner(title)
+        for name, timings in sorted(entries, key=key, reverse=True)[:self.top]:
+            self._display.display(line(name, timings))
+
+    def v2_playbook_on_stats(self, stats):
+        if not self.tasks:
+            return
+        self._ranking(
+            'PMAX REST TIME PER TASK',
+            [(task.name, task) for task in self.tasks.values()],
+            lambda entry: entry[1].seconds,
+            lambda name, task: '{} ({}): {} calls, {:.2f}s REST, '
+                               '{:.2f}s waiting on jobs'.format(
+                                   name, task.module, task.calls,
+                                   task.seconds, task.job_wait))
+        self._ranking(
+            'PMAX REST TIME PER MODULE', self.modules.items(),
+            lambda entry: entry[1].seconds,
+            lambda name, module: '{}: {} calls, {:.2f}s'.format(
+                name, module.calls, module.seconds))
+        endpoint_line = (lambda name, endpoint:
+                         '{}: {} calls, {:.2f}s total, {:.3f}s avg, '
+                         '{:.3f}s max, {} errors'.format(
+                             name, endpoint.calls, endpoint.seconds,
+                             endpoint.average, endpoint.slowest,
+                             endpoint.errors))
+        self._ranking('PMAX SLOWEST ENDPOINTS', self.endpoints.items(),
+                      lambda entry: entry[1].average, endpoint_line)
+        self._ranking('PMAX MOST CALLED ENDPOINTS', self.endpoints.items(),
+                      lambda entry: entry[1].calls, endpoint_line)
+        job_wait = sum(task.job_wait for task in self.tasks.values())
+        rest = sum(task.seconds for task in self.tasks.values())
+        self._display.banner('PMAX REST TOTAL')
+        self._display.display(
+            '{} calls, {:.2f}s REST, {:.2f}s waiting on jobs'.format(
+                sum(task.calls for task in self.tasks.values()), rest,
+                job_wait))
@@ -28,11 +28,32 @@ requirements:
   - "Unisphere for PowerMax version 9.0 or higher."
   - "VMAX All Flash, VMAX3, or PowerMax storage Array."
   - "PyU4V version 3.0.0.9 or higher using PIP python -m pip install PyU4V"
+  - "futures package on Python 2.7 for concurrent gathering, without it
+    objects are gathered one at a time."
 options:
   array_id:
     description:
-      - "Integer 12 Digit Serial Number of PowerMAX or VMAX array."
-    required: true
+      - "Integer 12 Digit Serial Number of PowerMAX or VMAX array, or a list
+      of serial numbers of arrays managed by the same Unisphere. With a
+      list the arrays are gathered concurrently over a shared Unisphere
+      session and the facts are keyed by serial number. Required unless
+      all_local_arrays is set."
+    required: false
+  all_local_arrays:
+    description:
+      - "Boolean, gather the facts of every array local to the Unisphere
+      instance, keyed by serial number like a list of array_id."
+    type: bool
+    default: false
+    required: false
+  array_workers:
+    description:
+      - "Integer, number of arrays gathered concurrently. Connections to
+      Unisphere are shared by all the arrays and bounded by pool_maxsize,
+      detail calls share the max_concurrency cap."
+    type: int
+    default: 4
+    required: false
   unispherehost:
     description:
       - "Fully Qualified Domain Name or IP address of Unisphere for PowerMax
@@ -47,16 +68,282 @@ options:
       - "Boolean, security check on ssl certificates"
     type: bool
     required: true
+  user:
+    description:
+      - "Unisphere username"
+    required: true
+  password:
+    description:
+      - "password for Unisphere user"
+    required: true
+  unisphereport:
+    description:
+      - "Integer, port of the Unisphere REST API."
+    type: int
+    default: 8443
+    required: false
+  pool_maxsize:
+    description:
+      - "Integer, connections kept open to the Unisphere host for the
+      module run, threads needing more wait for a free one."
+    type: int
+    default: 10
+    required: false
+  keep_alive:
+    description:
+      - "Boolean, keep the connections open between calls, false closes
+      the connection after each call."
+    type: bool
+    default: true
+    required: false
+  connect_timeout:
+    description:
+      - "Float, seconds to wait for a connection to Unisphere, PyU4V
+      default when not set."
+    type: float
+    required: false
+  read_timeout:
+    description:
+      - "Float, seconds to wait for a Unisphere answer, PyU4V default when
+      not set."
+    type: float
+    required: false
+  memoize_reads:
+    description:
+      - "Boolean, answer identical reads of the module run from memory and
+      coalesce concurrent ones, writes drop the reads they make stale. Can
+      also be set with the PMAX_MEMOIZE_READS environment variable."
+    type: bool
+    default: true
+    required: false
+  retries:
+    description:
+      - "Integer, attempts made on top of the first one for calls
+      throttled by Unisphere (429, 503), rejected on a lock or, for reads,
+      failing on a connection error. 0 disables retries. Can also be set
+      with the PMAX_RETRIES environment variable."
+    type: int
+    default: 5
+    required: false
+  retry_backoff:
+    description:
+      - "Float, first delay in seconds of the exponential backoff between
+      attempts, a Retry-After asked by Unisphere takes precedence."
+    type: float
+    default: 1.0
+    required: false
+  retry_budget:
+    description:
+      - "Float, total seconds the module may wait between attempts before
+      giving up. Can also be set with the PMAX_RETRY_BUDGET environment
+      variable."
+    type: float
+    default: 300
+    required: false
+  session_cache:
+    description:
+      - "Boolean, keep the Unisphere session cookie on the controller and
+      reuse it in the next tasks instead of authenticating again. Can also
+      be set with the PMAX_SESSION_CACHE environment variable."
+    type: bool
+    default: false
+    required: false
+  session_cache_ttl:
+    description:
+      - "Integer, seconds a cached session is reused. Can also be set with
+      the PMAX_SESSION_CACHE_TTL environment variable."
+    type: int
+    default: 600
+    required: false
+  session_cache_dir:
+    description:
+      - "Directory of the cached sessions, created with owner only
+      permissions. Can also be set with the PMAX_SESSION_CACHE_DIR
+      environment variable."
+    type: path
+    default: "~/.ansible/pmax_sessions"
+    required: false
+  rate_limit:
+    description:
+      - "Float, calls per second sent to the Unisphere host by all the
+      module processes of the controller together, no limit when not set.
+      Can also be set with the PMAX_RATE_LIMIT environment variable."
+    type: float
+    required: false
+  rate_burst:
+    description:
+      - "Integer, calls that can go at once after an idle period, defaults
+      to rate_limit. Can also be set with the PMAX_RATE_BURST environment
+      variable."
+    type: int
+    required: false
+  rate_limit_dir:
+    description:
+      - "Directory of the rate limit state shared by the module processes.
+      Can also be set with the PMAX_RATE_LIMIT_DIR environment variable."
+    type: path
+    default: "~/.ansible/pmax_rate"
+    required: false
+  trace:
+    description:
+      - "Boolean, return every REST call of the module (method, URI
+      template, status, latency and sizes) in the pmax_trace result. Can
+      also be set with the PMAX_TRACE environment variable."
+    type: bool
+    default: false
+    required: false
+  trace_file:
+    description:
+      - "File the REST calls are appended to in the Chrome trace format.
+      Can also be set with the PMAX_TRACE_FILE environment variable."
+    type: path
+    required: false
   gather_subset:
-    - description:
+    description:
       - "Optional parameter to tell ansible which facts to gather about the
       system. Possible values for this argument include hosts, host_groups,
-      masking_views, port_groups, slo, srp, storage_groups, volumes can
-      specify a list of values to include a larger subset. Values can also
+      masking_views, port_groups, slo, srp, storage_groups, volumes,
+      storage_group_demand and indexes can specify a list of values to
+      include a larger subset. Values can also
       be used with an initial C(M(!)) to specify that a specific subset 
-      should not be collected.
+      should not be collected. indexes maps volumes to storage groups,
+      storage groups, hosts and host groups to masking views, initiators to
+      hosts and ports to port groups, it adds the volumes, storage_groups,
+      hosts, host_groups and port_groups subsets it is built from. indexes
+      is only built when named, all does not include it."
     default: "all"
     required: false
+  max_workers:
+    description:
+      - "Integer, number of objects whose details are fetched concurrently
+      for a subset, within the max_concurrency cap shared by all subsets
+      and arrays."
+    type: int
+    default: 4
+    required: false
+  bulk_volumes:
+    description:
+      - "Boolean, read the volumes subset from the paged bulk volume
+      endpoint, a few calls per thousand volumes instead of one call per
+      volume. Requires a Unisphere serving the /systems bulk endpoints
+      (universion 100 or later)."
+    type: bool
+    default: false
+    required: false
+  max_concurrency:
+    description:
+      - "Integer, maximum number of detail calls in flight across all the
+      subsets and arrays. Subsets are gathered concurrently and share this
+      cap, so gather_subset all takes as long as the slowest subset."
+    type: int
+    default: 8
+    required: false
+  cache_dir:
+    description:
+      - "Directory of the controller side fact cache, one file per array
+      and subset. Caching is disabled when not set. Can also be set with
+      the PMAX_FACT_CACHE_DIR environment variable."
+    type: path
+    required: false
+  cache_ttl:
+    description:
+      - "Integer, seconds the cached facts of a subset are returned instead
+      of reading the array again."
+    type: int
+    default: 300
+    required: false
+  cache_refresh:
+    description:
+      - "Boolean, ignore the cached facts and gather every subset from the
+      array, the cache is refreshed with the new facts."
+    type: bool
+    default: false
+    required: false
+  delta:
+    description:
+      - "Boolean, refresh previously gathered facts instead of gathering
+      every object again. The object lists are compared with the previous
+      facts, new objects are fetched and deleted ones dropped. Objects
+      present in both are fetched again when their summary fields
+      (num_of_vols, cap_gb, num_of_masking_views...) changed, summaries are
+      read from the bulk endpoints of Unisphere 10 (universion 100). On
+      older versions, or when Unisphere does not serve them, they are all
+      fetched again and only the list calls are saved. Masking views are
+      kept as is, they cannot change. Subsets without previous facts, srp
+      and storage_group_demand are always gathered in full."
+    type: bool
+    default: false
+    required: false
+  previous_facts:
+    description:
+      - "Dictionary, dellemc_pmax_facts returned by a previous run, used as
+      the base of delta. Facts of several arrays, keyed by serial number,
+      are matched to their array. Defaults to the fact cache content, even
+      expired, when cache_dir is set."
+    type: dict
+    required: false
+  fields:
+    description:
+      - "Dictionary of subset name to the list of attributes to keep for
+      each object, e.g. volumes: [volumeId, cap_gb, wwn, storageGroupId].
+      Volumes read from the bulk endpoint are projected by Unisphere, other
+      objects as soon as their details are received. Keep the summary
+      fields in the list to benefit from delta."
+    type: dict
+    required: false
+  filters:
+    description:
+      - "Dictionary of subset name to Unisphere list filters, only the
+      matching objects are listed and fetched, e.g. storage_groups:
+      {storageGroupId: '<like>ORA'} or volumes: {storageGroupId: ORA_SG,
+      cap_gb: '>100'}. Supported by hosts, host_groups, masking_views,
+      port_groups, storage_groups and volumes."
+    type: dict
+    required: false
+  format:
+    description:
+      - "Dictionary of subset name to the representation of its objects,
+      dict (default) or columnar. A columnar subset is returned as
+      {format: columnar, ids: [...], columns: {attribute: [...]},
+      dictionaries: {attribute: [...]}}, the values of object ids[i] being
+      columns[attribute][i]. Repeated strings such as labels or storage
+      group names are dictionary encoded, their column holds indexes into
+      dictionaries[attribute]. Supported by every subset but
+      storage_group_demand and indexes, ignored in export mode."
+    type: dict
+    required: false
+  stats:
+    description:
+      - "Boolean, add a _stats entry to the subset_info of every subset
+      gathered: wall time, number of list and detail calls, bytes received,
+      retries and slowest object, to tune the concurrency and filters."
+    type: bool
+    default: false
+    required: false
+  export_path:
+    description:
+      - "Path of a JSON Lines file written on the Ansible controller. When
+      set the objects are streamed to the file as they are fetched, one
+      line per object {subset, id, facts}, and the module only returns a
+      summary of the export instead of dellemc_pmax_facts, so memory use
+      does not grow with the size of the array. The fact cache and delta
+      are not used in this mode. The file is created readable by its owner
+      only."
+    type: path
+    required: false
+  export_compression:
+    description:
+      - "Compression of the export file, defaults to gzip when export_path
+      ends with .gz, none otherwise."
+    choices: [none, gzip]
+    required: false
+  subset_workers:
+    description:
+      - "Dictionary of subset name to number of concurrent detail fetches,
+      overrides max_workers for the given subsets, e.g. volumes: 8 or
+      hosts: 1 to spare Unisphere."
+    type: dict
+    required: false
 '''
 
 EXAMPLES = '''
@@ -85,8 +372,146 @@ EXAMPLES = '''
         - storage_groups
         - masking_views
 
+    - name: "Gather volumes facts with 8 concurrent requests"
+      dellemc_pmax_gather_facts:
+        <<: *uni_connection_vars
+        pool_maxsize: 8
+        gather_subset:
+        - volumes
+        - hosts
+        max_workers: 8
+        max_concurrency: 8
+        subset_workers:
+          hosts: 2
+
+    - name: "Gather facts, reusing the ones gathered in the last 10 minutes"
+      dellemc_pmax_gather_facts:
+        <<: *uni_connection_vars
+        cache_dir: "~/.ansible/pmax_facts"
+        cache_ttl: 600
+
+    - name: "Refresh the cached facts, only fetching the changed objects"
+      dellemc_pmax_gather_facts:
+        <<: *uni_connection_vars
+        universion: 100
+        cache_dir: "~/.ansible/pmax_facts"
+        cache_refresh: true
+        delta: true
+
+    - name: "Only return the attributes needed by the playbook"
+      dellemc_pmax_gather_facts:
+        <<: *uni_connection_vars
+        gather_subset:
+        - volumes
+        - storage_groups
+        fields:
+          volumes: [volumeId, cap_gb, wwn, storageGroupId]
+          storage_groups: [storageGroupId, slo, num_of_vols, cap_gb]
+
+    - name: "Gather the Oracle storage groups and their volumes above 100GB"
+      dellemc_pmax_gather_facts:
+        <<: *uni_connection_vars
+        gather_subset:
+        - volumes
+        - storage_groups
+        filters:
+          storage_groups:
+            storageGroupId: "<like>ORA"
+          volumes:
+            storageGroupId: "ORA_DATA_SG"
+            cap_gb: ">100"
+
+    - name: "Find the storage groups of a volume and the host of a WWN"
+      dellemc_pmax_gather_facts:
+        <<: *uni_connection_vars
+        gather_subset:
+        - indexes
+
+    - debug:
+        msg: "{{ dellemc_pmax_facts.indexes.volume_storage_groups['0012A'] }}
+        {{ dellemc_pmax_facts.indexes.initiator_host['10000000c9873cae'] }}"
+
+    - name: "Gather the volumes in the compact columnar format"
+      dellemc_pmax_gather_facts:
+        <<: *uni_connection_vars
+        gather_subset:
+        - volumes
+        format:
+          volumes: columnar
+
+    - debug:
+        msg: "{{ item }} is {{ dellemc_pmax_facts.volumes.columns.cap_gb[idx] }}GB"
+      loop: "{{ dellemc_pmax_facts.volumes.ids }}"
+      loop_control:
+        index_var: idx
+
+    - name: "Morning inventory of every array of the Unisphere"
+      dellemc_pmax_gather_facts:
+        unispherehost: "{{ unispherehost }}"
+        universion: "{{ universion }}"
+        verifycert: "{{ verifycert }}"
+        user: "{{ user }}"
+        password: "{{ password }}"
+        all_local_arrays: true
+        pool_maxsize: 16
+        max_concurrency: 4
+        gather_subset:
+        - storage_groups
+        - hosts
+
+    - debug:
+        msg: "{{ dellemc_pmax_facts['000197600156'].storage_groups | length }}"
+
+    - name: "Export the whole inventory of the array"
+      dellemc_pmax_gather_facts:
+        <<: *uni_connection_vars
+        export_path: "/var/tmp/{{ array_id }}_inventory.jsonl.gz"
+
 '''
 RETURN = r'''
+export:
+    description: Summary of the export, number of objects written per subset
+      and size of the file written
+    returned: when export_path is set
+    type: dict
+    sample: '{
+        "bytes": 74021,
+        "compression": "gzip",
+        "objects": {
+            "hosts": 12,
+            "volumes": 512
+        },
+        "path": "/var/tmp/000197600156_inventory.jsonl.gz"
+    }'
+subset_info:
+    description: Collection time of every subset gathered, whether its
+      facts come from the fact cache, for delta runs the number of objects
+      added, removed and refreshed since the previous facts and with stats
+      the REST calls made for the subset
+    returned: always
+    type: dict
+    sample: '{
+        "hosts": {
+            "_stats": {
+                "bytes": 10412,
+                "detail_calls": 3,
+                "list_calls": 1,
+                "retries": 0,
+                "seconds": 0.52,
+                "slowest": {
+                    "id": "Ansible_Host",
+                    "seconds": 0.31
+                }
+            },
+            "cached": false,
+            "collected_at": "2019-02-04T10:12:41Z",
+            "delta": {
+                "added": 2,
+                "refreshed": 1,
+                "removed": 0
+            }
+        }
+    }'
 dellemc_pmax_facts:
     description: Returns various information about PowerMAX Array
     returned: always
@@ -103,63 +528,365 @@ dellemc_pmax_facts:
             "volumes": {...}
     }'
 '''
-from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.dellemc import dellemc_pmax_argument_spec, pmaxapi
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+
+from ansible.module_utils.basic import AnsibleModule, env_fallback
+from ansible.module_utils.six import string_types
+from ansible.module_utils.dellemc import dellemc_pmax_argument_spec, pmaxapi, \
+    pmax_rest_get, pmax_iter_objects, pmax_call_stats, PmaxCallStats, \
+    pmax_iter_volumes, PmaxFactCache, BULK_VOLUMES_UNIVERSION, \
+    DEFAULT_FACT_CACHE_TTL, DEFAULT_UNIVERSION, pmax_executor, PmaxRestError
+
+
+class JsonLinesExporter(object):
+    ''' Thread safe writer of the export file, one JSON object per line:
+    {"array": ..., "subset": ..., "id": ..., "facts": ...}. Lines go to a
+    temporary file renamed to path once the export is complete, bytes is
+    then the size of the file on disk. '''
+
+    def __init__(self, path, compression):
+        self.path = os.path.expanduser(path)
+        self.compression = compression
+        if self.compression is None:
+            self.compression = 'gzip' if self.path.endswith('.gz') \
+                else 'none'
+        self.bytes = 0
+        self._lock = threading.Lock()
+        fd, self._tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(self.path) or '.',
+            prefix='.' + os.path.basename(self.path) + '.')
+        self._raw = os.fdopen(fd, 'wb')
+        if self.compression == 'gzip':
+            self._file = gzip.GzipFile(fileobj=self._raw, mode='wb')
+        else:
+            self._file = self._raw
+
+    def write(self, array_id, subset, name, facts):
+        line = (json.dumps({'array': array_id, 'subset': subset, 'id': name,
+                            'facts': facts},
+                           sort_keys=True) + '\n').encode('utf-8')
+        with self._lock:
+            self._file.write(line)
+
+    def _close_files(self):
+        self._file.close()
+        # GzipFile leaves the file object it writes to open
+        self._raw.close()
+
+    def close(self):
+        self._close_files()
+        os.rename(self._tmp_path, self.path)
+        self.bytes = os.path.getsize(self.path)
+
+    def abort(self):
+        self._close_files()
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+
+
+class ColumnarFacts(object):
+    ''' Build the columnar representation of a subset from its objects as
+    they are fetched, and read it back '''
+
+    def __init__(self):
+        self.ids = []
+        self.columns = {}
+        # attribute -> {value: code}, None once the attribute holds values
+        # that cannot be encoded
+        self._codes = {}
+
+    @staticmethod
+    def _encodable(value):
+        if isinstance(value, string_types):
+            return True
+        return isinstance(value, list) and \
+            all(isinstance(v, string_types) for v in value)
+
+    def _encode(self, codes, value):
+        if isinstance(value, list):
+            return [codes.setdefault(v, len(codes)) for v in value]
+        return codes.setdefault(value, len(codes))
+
+    def _decode(self, key):
+        ''' Replace the codes of a column by the values they stand for '''
+        values = dict((c, v) for v, c in self._codes[key].items())
+        self.columns[key] = [
+            None if c is None else
+            [values[i] for i in c] if isinstance(c, list) else values[c]
+            for c in self.columns[key]]
+        self._codes[key] = None
+
+    def add(self, name, facts):
+        row = len(self.ids)
+        self.ids.append(name)
+        for key, value in facts.items():
+            column = self.columns.get(key)
+            if column is None:
+                column = self.columns[key] = [None] * row
+                self._codes[key] = {}
+            if value is not None and self._codes[key] is not None:
+                if self._encodable(value):
+                    value = self._encode(self._codes[key], value)
+                else:
+                    self._decode(key)
+                    column = self.columns[key]
+            column.append(value)
+        for key, column in self.columns.items():
+            if len(column) == row:
+                column.append(None)
+
+    def result(self):
+        ''' Columnar facts, attributes with mostly distinct values such as
+        wwn are not dictionary encoded '''
+        dictionaries = {}
+        for key, codes in self._codes.items():
+            if codes is None:
+                continue
+            if not codes or len(codes) * 2 > len(self.ids):
+                self._decode(key)
+                continue
+            dictionary = [None] * len(codes)
+            for value, code in codes.items():
+                dictionary[code] = value
+            dictionaries[key] = dictionary
+        return {'format': 'columnar', 'ids': self.ids,
+                'columns': self.columns, 'dictionaries': dictionaries}
+
+    @staticmethod
+    def items(facts):
+        ''' Yield (name, object) from dict or columnar facts '''
+        if facts.get('format') != 'columnar' or 'columns' not in facts:
+            for item in facts.items():
+                yield item
+            return
+        columns = facts['columns']
+        dictionaries = facts['dictionaries']
+        for row, name in enumerate(facts['ids']):
+            obj = {}
+            for key, column in columns.items():
+                value = column[row]
+                if value is None:
+                    continue
+                if key in dictionaries:
+                    dictionary = dictionaries[key]
+                    value = [dictionary[c] for c in value] \
+                        if isinstance(value, list) else dictionary[value]
+                obj[key] = value
+            yield name, obj
+
+
+class FactIndexes(object):
+    ''' Relationship maps built in a single pass over the objects of the
+    volumes, storage_groups, hosts, host_groups and port_groups subsets '''
+
+    # Attributes of the objects each subset contributes to the indexes
+    SOURCES = {
+        'volumes': ['storageGroupId'],
+        'storage_groups': ['maskingview'],
+        'hosts': ['maskingview', 'initiator'],
+        'host_groups': ['maskingview'],
+        'port_groups': ['symmetrixPortKey'],
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.indexes = {
+            'volume_storage_groups': {},
+            'storage_group_masking_views': {},
+            'host_masking_views': {},
+            'host_group_masking_views': {},
+            'initiator_host': {},
+            'port_port_groups': {},
+        }
+
+    def add(self, subset, name, facts):
+        ''' Index one object of a subset, other subsets are ignored '''
+        if subset not in self.SOURCES or not isinstance(facts, dict):
+            return
+        with self._lock:
+            if subset == 'volumes':
+                self.indexes['volume_storage_groups'][name] = list(
+                    facts.get('storageGroupId') or [])
+            elif subset == 'storage_groups':
+                self.indexes['storage_group_masking_views'][name] = list(
+                    facts.get('maskingview') or [])
+            elif subset == 'hosts':
+                self.indexes['host_masking_views'][name] = list(
+                    facts.get('maskingview') or [])
+                for wwn in facts.get('initiator') or []:
+                    self.indexes['initiator_host'][wwn] = name
+            elif subset == 'host_groups':
+                self.indexes['host_group_masking_views'][name] = list(
+                    facts.get('maskingview') or [])
+            elif subset == 'port_groups':
+                for port in facts.get('symmetrixPortKey') or []:
+                    # Unisphere 9.0 returns portId as director:port
+                    port_id = port['portId'] if ':' in port['portId'] \
+                        else '{}:{}'.format(port['directorId'],
+                                            port['portId'])
+                    self.indexes['port_port_groups'].setdefault(
+                        port_id, []).append(name)
+
+
+class SubsetStats(object):
+    ''' REST calls made to gather one subset '''
+
+    def __init__(self):
+        # Calls of the coordinator thread: lists, bulk pages, summaries
+        self.list = PmaxCallStats()
+        self.detail = PmaxCallStats()
+        self.seconds = 0
+        self.slowest = (None, 0)
+        self._lock = threading.Lock()
+
+    def object_fetched(self, name, seconds):
+        with self._lock:
+            if seconds > self.slowest[1]:
+                self.slowest = (name, seconds)
+
+    def as_dict(self):
+        return {
+            'seconds': round(self.seconds, 3),
+            'list_calls': self.list.calls,
+            'detail_calls': self.detail.calls,
+            'bytes': self.list.bytes + self.detail.bytes,
+            'retries': self.list.retries + self.detail.retries,
+            'slowest': {'id': self.slowest[0],
+                        'seconds': round(self.slowest[1], 3)},
+        }
+
 
 class Dellpmax_Gather_Facts(object):
-    def __init__(self,module):
+    def __init__(self, module, array_id=None, detail_pool=None):
         self.module = module
-        self.conn = pmaxapi(module)
+        self.array_id = array_id or module.params['array_id']
+        self.conn = pmaxapi(module, self.array_id)
         self.dellemc = self.conn.provisioning
         self.facts = {}
         self.gather_subset = module.params['gather_subset']
+        self.max_workers = module.params['max_workers']
+        self.max_concurrency = module.params['max_concurrency']
+        # Detail pool shared by the subsets, set up by get_data
+        self.pool = None
+        # Detail pool shared with the other arrays gathered, if any
+        self.detail_pool = detail_pool
+        self.stats = module.params['stats']
+        self.subset_stats = {}
+        # Subset gathered by the current coordinator thread
+        self._local = threading.local()
+        self.cache = None
+        if module.params['cache_dir']:
+            self.cache = PmaxFactCache(module.params['cache_dir'],
+                                       module.params['cache_ttl'],
+                                       self.array_id)
+        self.cache_refresh = module.params['cache_refresh']
+        self.delta = module.params['delta']
+        self.previous_facts = module.params['previous_facts']
+        # Index builder fed by export_subset in export mode
+        self.indexes = None
+        self.filters = dict(
+            (subset, dict((k, str(v)) for k, v in (filters or {}).items()))
+            for subset, filters in (module.params['filters'] or {}).items())
+        self.formats = module.params['format'] or {}
+        self.fields = dict(
+            (k, v.split(',') if isinstance(v, str) else list(v))
+            for k, v in (module.params['fields'] or {}).items())
+        self.subset_info = {}
+        self.universion = module.params['universion'] or DEFAULT_UNIVERSION
+        self.bulk_volumes = module.params['bulk_volumes']
+        self.subset_workers = dict(
+            (k, int(v)) for k, v in
+            (module.params['subset_workers'] or {}).items())
         self.fact_subsets = {
             'hosts': {
                 'method': self.generic_get_object_facts,
                 'kwargs': {
                     'name': 'host',
                 },
+                'summary': {
+                    'collection': 'hosts',
+                    'key': 'hostId',
+                    'fields': ['num_of_initiators', 'num_of_host_groups',
+                               'num_of_masking_views'],
+                },
             },
             'host_groups': {
                 'method': self.generic_get_object_facts,
                 'kwargs': {
                     'name': 'hostgroup',
                 },
+                'summary': {
+                    'collection': 'host-groups',
+                    'key': 'hostGroupId',
+                    'fields': ['num_of_hosts', 'num_of_initiators',
+                               'num_of_masking_views'],
+                },
             },
             'masking_views': {
                 'method': self.generic_get_object_facts,
                 'kwargs': {
                     'name': 'masking_view',
                 },
+                # The groups of a masking view cannot be changed
+                'summary': None,
             },
             'port_groups': {
                 'method': self.generic_get_object_facts,
                 'kwargs': {
                     'name': 'portgroup'
                 },
+                'summary': {
+                    'collection': 'port-groups',
+                    'key': 'portGroupId',
+                    'fields': ['num_of_ports', 'num_of_masking_views'],
+                },
             },
             'slo': {
                 'method': self.generic_get_object_facts,
                 'kwargs': {
                     'name': 'slo'
                 },
+                'filters': False,
             },
             'srp': {
                 'method': self.generic_get_object_facts,
                 'kwargs': {
                     'name': 'srp'
                 },
+                # Capacity figures change all the time
+                'delta': False,
+                'filters': False,
             },
             'storage_groups': {
                 'method': self.generic_get_object_facts,
                 'kwargs': {
                     'name': 'storage_group'
                 },
+                'summary': {
+                    'collection': 'storage-groups',
+                    'key': 'storageGroupId',
+                    'fields': ['num_of_vols', 'cap_gb',
+                               'num_of_masking_views', 'num_of_child_sgs',
+                               'slo', 'compression'],
+                },
             },
             'volumes': {
-                'method': self.generic_get_object_facts,
+                'method': self.get_volume_facts,
                 'kwargs': {
-                    'name': 'volume'
+                },
+                'summary': {
+                    'collection': 'volumes',
+                    'key': 'volumeId',
+                    'fields': ['cap_gb', 'num_of_storage_groups',
+                               'volume_identifier'],
                 },
             },
             'storage_group_demand': {
@@ -167,46 +894,375 @@ class Dellpmax_Gather_Facts(object):
                 'kwargs': {
 
                 },
+                'filters': False,
                 },
+            # Built from the other subsets by get_data/export_data
+            'indexes': {
+                'method': None,
+                'kwargs': {
+                },
+                'filters': False,
+            },
             }
 
-    def generic_get_object_facts(self, name):
+        unknown = (set(self.fields) | set(self.filters)) - \
+            set(self.fact_subsets)
+        if unknown:
+            module.fail_json(msg='Unknown subsets in fields or filters: {}'
+                             .format(', '.join(sorted(unknown))))
+        bad_formats = [
+            subset for subset, fmt in self.formats.items()
+            if subset not in self.fact_subsets or
+            fmt not in ('dict', 'columnar') or
+            (fmt == 'columnar' and
+             subset in ('storage_group_demand', 'indexes'))]
+        if bad_formats:
+            module.fail_json(msg='format maps object subsets to dict or '
+                                 'columnar')
+        unfiltered = [subset for subset in self.filters
+                      if not self.fact_subsets.get(subset, {}).get('filters',
+                                                                   True)]
+        if unfiltered:
+            module.fail_json(msg='Subsets not supporting filters: {}'.format(
+                ', '.join(sorted(unfiltered))))
+
+    def generic_get_object_facts(self, name, max_workers=1, previous=None,
+                                 summary=None, fields=None, filters=None):
         ''' Generic Function to gather list of object types and get the details
          and return the dictionary of entries '''
+        return dict(self.iter_object_facts(name, max_workers, previous,
+                                           summary, fields, filters))
+
+    def iter_object_facts(self, name, max_workers=1, previous=None,
+                          summary=None, fields=None, filters=None):
+        ''' Yield (name, details) for every object of a type, in the order of
+         the list call. Up to max_workers details are fetched at once. With
+         previous facts only the new objects and the ones whose summary
+         changed are fetched, all of them when the summaries cannot be read.
+         Entries only keep the given fields, only the objects matching the
+         Unisphere filters are listed '''
         list_func = getattr(self.dellemc, 'get_%s_list' % name)
         get_func = getattr(self.dellemc, 'get_%s' % name)
-        results = {}
-        for i in list_func():
-            tmp_data = get_func(i)
+        object_list = list_func(filters=filters) if filters else list_func()
+        summaries = None
+        if previous is not None and summary:
+            summaries = self.get_summaries(summary, filters)
+            if summaries is None:
+                self.module.warn(
+                    'delta needs the bulk summaries of Unisphere 10 to find '
+                    'the changed {} objects, they are all read '
+                    'again'.format(name))
+        if previous is None or (summary and summaries is None):
+            fetch_list = object_list
+        else:
+            # Objects without summary, like masking views, never change
+            fetch_list = [
+                i for i in object_list if i not in previous or
+                (summaries is not None and
+                 self.summary_changed(previous[i], summaries.get(i)))]
+        fetch_set = set(fetch_list)
+        # fetch_list keeps the order of object_list
+        details = self.fetch_details(get_func, fetch_list, max_workers)
+        for i in object_list:
+            if i not in fetch_set:
+                yield i, self.project(previous[i], fields)
+                continue
+            tmp_data = next(details)
             try:
                 getattr(tmp_data, 'success')
             except AttributeError:
                 # We are on Unisphere 9.x or above. As they don't have an
                 # attribute success
-                results[i] = tmp_data
+                yield i, self.project(tmp_data, fields)
             else:
                 # We are on Unisphere 8.x. They present a sub key with a
                 # list of results.. Which is always 1 item in the list
                 key = [key for key in tmp_data.keys() if key != 'success'][0]
-                results[i] = tmp_data[key]
+                yield i, self.project(tmp_data[key], fields)
+
+    @staticmethod
+    def project(facts, fields):
+        ''' Keep the given fields of the details of an object '''
+        if not fields or not isinstance(facts, dict):
+            return facts
+        return dict((k, facts[k]) for k in fields if k in facts)
+
+    def get_summaries(self, summary, filters=None):
+        ''' Read the summary fields of every object of a collection from the
+        bulk endpoint, None when there is no cheap summary '''
+        if not summary or self.universion < BULK_VOLUMES_UNIVERSION:
+            return None
+        try:
+            return dict(
+                (item[summary['key']], item) for item in pmax_iter_objects(
+                    self.conn, self.array_id, self.universion,
+                    summary['collection'], summary['key'], filters=filters,
+                    attributes=summary['fields']))
+        except PmaxRestError:
+            # Not every Unisphere 10 release serves every bulk collection
+            return None
+
+    @staticmethod
+    def summary_changed(facts, summary):
+        ''' Compare the summary of an object with its previous facts '''
+        if summary is None:
+            return True
+        return any(facts.get(k) != v for k, v in summary.items())
+
+    def fetch_details(self, get_func, object_list, max_workers):
+        ''' Yield get_func(name) for every name of object_list, in order.
+        Calls run on the shared pool when there is one, with at most
+        max_workers of them in flight for this subset '''
+        stats = self.subset_stats.get(getattr(self._local, 'subset', None))
+        if self.pool is None:
+            for name in object_list:
+                yield self.fetch_detail(stats, get_func, name)
+            return
+        pending = deque()
+        for name in object_list:
+            pending.append(self.pool.submit(self.fetch_detail, stats,
+                                            get_func, name))
+            if len(pending) >= max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    @staticmethod
+    def fetch_detail(stats, get_func, name):
+        ''' get_func(name), accounted in the subset stats if any '''
+        if stats is None:
+            return get_func(name)
+        start = time.time()
+        with pmax_call_stats(stats.detail):
+            details = get_func(name)
+        stats.object_fetched(name, time.time() - start)
+        return details
+
+    def get_volume_facts(self, max_workers=1, previous=None, summary=None,
+                         fields=None, filters=None):
+        ''' Gather the volumes details, from the paged bulk endpoint when
+        available, else one call per volume '''
+        return dict(self.iter_volume_facts(max_workers, previous, summary,
+                                           fields, filters))
+
+    def iter_volume_facts(self, max_workers=1, previous=None, summary=None,
+                          fields=None, filters=None):
+        ''' Yield (volume id, details) for every volume, one page of the bulk
+        endpoint in memory at a time when available '''
+        if not self.bulk_volumes:
+            for item in self.iter_object_facts('volume', max_workers,
+                                               previous, summary, fields,
+                                               filters):
+                yield item
+            return
+        for volume in pmax_iter_volumes(self.conn,
+                                        self.array_id,
+                                        self.universion,
+                                        filters=filters,
+                                        attributes=fields):
+            yield volume['volumeId'], self.project(volume, fields)
+
+    def get_subset_facts(self, subset):
+        ''' Gather the facts of one subset, from the fact cache when it
+        holds them and they have not expired '''
+        options = self.subset_options(subset)
+        if self.cache and not self.cache_refresh:
+            cached = self.cache.load(subset, options=options)
+            if cached:
+                facts, collected_at = cached
+                self.set_subset_info(subset, collected_at, True)
+                return facts
+        collected_at = time.time()
+        call = self.fact_subsets[subset]
+        previous = None
+        if self.delta and call.get('delta', True) and \
+                call['method'] in (self.generic_get_object_facts,
+                                   self.get_volume_facts):
+            previous = self.get_previous_facts(subset)
+        kwargs = self.subset_kwargs(subset, previous)
+        if self.formats.get(subset) == 'columnar':
+            columnar = ColumnarFacts()
+            for name, object_facts in self.iter_subset(subset, kwargs):
+                columnar.add(name, object_facts)
+            facts = columnar.result()
+        else:
+            facts = call['method'](**kwargs)
+        if self.cache:
+            self.cache.save(subset, facts, collected_at, options)
+        self.set_subset_info(subset, collected_at, False)
+        if previous is not None:
+            current = dict(ColumnarFacts.items(facts))
+            self.subset_info[subset]['delta'] = {
+                'added': len([i for i in current if i not in previous]),
+                'removed': len([i for i in previous if i not in current]),
+                'refreshed': len([i for i in current if i in previous and
+                                  current[i] != previous[i]]),
+            }
+        return facts
+
+    def iter_subset(self, subset, kwargs):
+        ''' Yield (name, facts) for the objects of a subset as they are
+        fetched, subsets not made of objects yield a single None entry '''
+        call = self.fact_subsets[subset]
+        if call['method'] == self.generic_get_object_facts:
+            return self.iter_object_facts(**kwargs)
+        if call['method'] == self.get_volume_facts:
+            return self.iter_volume_facts(**kwargs)
+        return iter([(None, call['method'](**kwargs))])
+
+    def subset_kwargs(self, subset, previous=None):
+        ''' Arguments of the gathering method of a subset '''
+        call = self.fact_subsets[subset]
+        kwargs = dict(call['kwargs'])
+        if call['method'] in (self.generic_get_object_facts,
+                              self.get_volume_facts):
+            kwargs['max_workers'] = self.subset_workers.get(
+                subset, self.max_workers)
+            kwargs['fields'] = self.fields.get(subset)
+            kwargs['filters'] = self.filters.get(subset)
+            if previous is not None:
+                kwargs['previous'] = previous
+                kwargs['summary'] = call.get('summary')
+        return kwargs
+
+    def export_subset(self, subset, exporter):
+        ''' Write the objects of a subset to the exporter as they are
+        fetched, nothing is kept in memory. The fact cache and delta are
+        not used. '''
+        collected_at = time.time()
+        count = 0
+        for name, facts in self.iter_subset(subset,
+                                            self.subset_kwargs(subset)):
+            exporter.write(self.array_id, subset, name, facts)
+            if 'indexes' in self.run_subset:
+                self.indexes.add(subset, name, facts)
+            count += 1
+        self.set_subset_info(subset, collected_at, False)
+        self.subset_info[subset]['objects'] = count
+        return count
+
+    def subset_options(self, subset):
+        ''' Options changing the facts of a subset, facts cached with other
+        options are not reused '''
+        return {'fields': self.fields.get(subset),
+                'filters': self.filters.get(subset),
+                'format': self.formats.get(subset, 'dict')}
+
+    def get_previous_facts(self, subset):
+        ''' Facts of a subset to refresh in delta mode, from previous_facts
+        or else from the fact cache, None when there are none '''
+        previous = None
+        if self.previous_facts is not None:
+            previous_facts = self.previous_facts
+            if not any(s in previous_facts for s in self.fact_subsets):
+                # dellemc_pmax_facts of several arrays, keyed by serial
+                previous_facts = previous_facts.get(self.array_id) or {}
+            previous = previous_facts.get(subset)
+        elif self.cache:
+            cached = self.cache.load(subset, expired=True,
+                                     options=self.subset_options(subset))
+            if cached:
+                previous = cached[0]
+        if previous is None:
+            return None
+        return dict(ColumnarFacts.items(previous))
+
+    def set_subset_info(self, subset, collected_at, cached):
+        self.subset_info[subset] = {
+            'collected_at': time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                          time.gmtime(collected_at)),
+            'cached': cached,
+        }
+
+    def run_subsets(self, func):
+        ''' Run func(subset) for the subsets concurrently, one coordinator
+        thread per subset lists the objects and queues the detail calls on
+        the pool shared by all of them '''
+        self.run_subset = self.get_subset()
+        if 'indexes' in self.run_subset:
+            self.run_subset.update(FactIndexes.SOURCES)
+            for subset, attributes in FactIndexes.SOURCES.items():
+                if self.fields.get(subset):
+                    self.fields[subset] += [
+                        a for a in attributes
+                        if a not in self.fields[subset]]
+        subsets = [s for s in self.run_subset if s != 'indexes']
+        if not subsets:
+            return {}
+        results = {}
+        pool = self.detail_pool or pmax_executor(self.max_concurrency)
+        try:
+            with pmax_executor(len(subsets)) as coordinators:
+                self.pool = pool
+                futures = dict(
+                    (subset, coordinators.submit(self.run_subset_func, func,
+                                                 subset))
+                    for subset in subsets)
+                for subset, future in futures.items():
+                    results[subset] = future.result()
+        finally:
+            self.pool = None
+            if pool is not self.detail_pool:
+                pool.shutdown()
         return results
 
+    def run_subset_func(self, func, subset):
+        ''' Run func(subset) in a coordinator thread, collecting the stats
+        of the subset when asked to '''
+        if not self.stats:
+            return func(subset)
+        stats = self.subset_stats[subset] = SubsetStats()
+        self._local.subset = subset
+        start = time.time()
+        try:
+            with pmax_call_stats(stats.list):
+                result = func(subset)
+        finally:
+            self._local.subset = None
+        stats.seconds = time.time() - start
+        self.subset_info[subset]['_stats'] = stats.as_dict()
+        return result
+
     def get_data(self):
-        self.run_subset = self.get_subset()
-        facts = {}
-        for subset in self.run_subset:
-            call = self.fact_subsets[subset]
-            facts[subset] = call['method'](**call['kwargs'])
+        ''' Gather the facts of the subsets '''
+        facts = self.run_subsets(self.get_subset_facts)
+        if 'indexes' in self.run_subset:
+            collected_at = time.time()
+            indexes = FactIndexes()
+            for subset in FactIndexes.SOURCES:
+                for name, object_facts in ColumnarFacts.items(
+                        facts.get(subset, {})):
+                    indexes.add(subset, name, object_facts)
+            facts['indexes'] = indexes.indexes
+            self.set_subset_info('indexes', collected_at, False)
         return facts
 
+    def export_data(self, exporter):
+        ''' Stream the objects of the subsets to a JSON Lines exporter
+        :return: (dict) number of objects written per subset '''
+        self.indexes = FactIndexes()
+        objects = self.run_subsets(
+            lambda subset: self.export_subset(subset, exporter))
+        if 'indexes' in self.run_subset:
+            collected_at = time.time()
+            for name, index in self.indexes.indexes.items():
+                exporter.write(self.array_id, 'indexes', name, index)
+            objects['indexes'] = len(self.indexes.indexes)
+            self.set_subset_info('indexes', collected_at, False)
+        return objects
+
     def get_subset(self):
         ''' Gathers a list of objects to gather facts on based on the
         module inputs '''
         runable_subsets = set()
         exclude_subsets = set()
+        # indexes adds several subsets, it is only built on demand
+        all_subsets = set(self.fact_subsets.keys()) - set(['indexes'])
         for subset in self.gather_subset:
             if subset == 'all':
-                runable_subsets.update(self.fact_subsets.keys())
+                runable_subsets.update(all_subsets)
+                if 'indexes' in self.gather_subset:
+                    runable_subsets.add('indexes')
                 return runable_subsets
             if subset.startswith('!'):
                 subset = subset[1:]
@@ -216,28 +1272,131 @@ class Dellpmax_Gather_Facts(object):
             else:
                 exclude = False
             if subset not in self.fact_subsets.keys():
-                module.fail_json(msg='Bad subset')
+                self.module.fail_json(msg='Bad subset')
             if exclude:
                 exclude_subsets.add(subset)
             else:
                 runable_subsets.add(subset)
         if not runable_subsets:
-            runable_subsets.update(self.fact_subsets.keys())
+            runable_subsets.update(all_subsets)
         runable_subsets.difference_update(exclude_subsets)
         return runable_subsets
 
+def get_local_arrays(module):
+    ''' Serial numbers of the arrays local to the Unisphere instance '''
+    conn = pmaxapi(module)
+    arrays = pmax_rest_get(
+        conn, '/{}/system/symmetrix'.format(
+            module.params['universion'] or DEFAULT_UNIVERSION),
+        {'local': 'true'})
+    return arrays.get('symmetrixId', [])
+
+
 def main():
     argument_spec = dellemc_pmax_argument_spec()
+    # One array, or several keyed by serial number
+    argument_spec['array_id'] = dict(type='raw', required=False)
     argument_spec.update(dict(
+            all_local_arrays=dict(type='bool', required=False, default=False),
+            array_workers=dict(type='int', default=4),
             gather_subset=dict(default=['all'], type='list'),
+            max_workers=dict(type='int', default=4),
+            max_concurrency=dict(type='int', default=8),
+            bulk_volumes=dict(type='bool', required=False, default=False),
+            subset_workers=dict(type='dict', required=False),
+            cache_dir=dict(type='path', required=False,
+                           fallback=(env_fallback, ['PMAX_FACT_CACHE_DIR'])),
+            cache_ttl=dict(type='int', required=False,
+                           default=DEFAULT_FACT_CACHE_TTL),
+            cache_refresh=dict(type='bool', required=False, default=False),
+            delta=dict(type='bool', required=False, default=False),
+            previous_facts=dict(type='dict', required=False),
+            fields=dict(type='dict', required=False),
+            filters=dict(type='dict', required=False),
+            format=dict(type='dict', required=False),
+            stats=dict(type='bool', required=False, default=False),
+            export_path=dict(type='path', required=False),
+            export_compression=dict(type='str', required=False,
+                                    choices=['none', 'gzip']),
         )
     )
     module = AnsibleModule(argument_spec=argument_spec,
-        supports_check_mode=True)
+        supports_check_mode=True,
+        required_one_of=[['array_id', 'all_local_arrays']],
+        mutually_exclusive=[['array_id', 'all_local_arrays']])
+    try:
+        workers = [module.params['max_workers'],
+                   module.params['max_concurrency'],
+                   module.params['array_workers']] + \
+            [int(w) for w in (module.params['subset_workers'] or {}).values()]
+    except ValueError:
+        workers = [0]
+    if min(workers) < 1:
+        module.fail_json(msg='max_workers, max_concurrency, array_workers and '
+                             'subset_workers values must be integers of at '
+                             'least 1')
+    array_id = module.params['array_id']
+    multi_array = module.params['all_local_arrays'] or \
+        isinstance(array_id, list)
+    if module.params['all_local_arrays']:
+        array_ids = get_local_arrays(module)
+    elif multi_array:
+        array_ids = [str(a) for a in array_id]
+    else:
+        array_ids = [str(array_id)]
+    if not array_ids:
+        module.fail_json(msg='No array to gather facts from')
     ### Get the Subset of objects to collect
-    d = Dellpmax_Gather_Facts(module)
-    facts = d.get_data()
-    result = {'state': 'info', 'changed': False}
+    # Connections are opened here, the first one sets up the REST session
+    # shared by all the arrays
+    # Arrays share the max_concurrency detail calls
+    detail_pool = pmax_executor(module.params['max_concurrency'])
+    gatherers = [Dellpmax_Gather_Facts(module, a, detail_pool)
+                 for a in array_ids]
+    # Fail on bad subsets before any thread is started
+    gatherers[0].get_subset()
+    array_workers = min(module.params['array_workers'], len(gatherers))
+    export_path = module.params['export_path']
+    # Importing Py4UV exception, PyU4V is there once connected
+    from PyU4V.utils.exception import PyU4VException
+    try:
+        with detail_pool, pmax_executor(array_workers) as pool:
+            if export_path:
+                try:
+                    exporter = JsonLinesExporter(
+                        export_path, module.params['export_compression'])
+                    try:
+                        objects = list(pool.map(
+                            lambda d: d.export_data(exporter), gatherers))
+                    except Exception:
+                        exporter.abort()
+                        raise
+                    exporter.close()
+                except (IOError, OSError) as error:
+                    module.fail_json(msg='Cannot write {}: {}'.format(
+                        export_path, error))
+            else:
+                facts = list(pool.map(lambda d: d.get_data(), gatherers))
+    except (PmaxRestError, PyU4VException) as error:
+        module.fail_json(msg='Cannot gather facts: {}'.format(error))
+    subset_info = [d.subset_info for d in gatherers]
+    if multi_array:
+        subset_info = dict(zip(array_ids, subset_info))
+    else:
+        subset_info = subset_info[0]
+    if export_path:
+        export = {'path': exporter.path, 'compression': exporter.compression,
+                  'bytes': exporter.bytes,
+                  'objects': dict(zip(array_ids, objects)) if multi_array
+                  else objects[0]}
+        module.exit_json(state='info', changed=False, export=export,
+                         subset_info=subset_info)
+    if multi_array:
+        facts = dict(zip(array_ids, facts))
+    else:
+        facts = facts[0]
+    result = {'state': 'info', 'changed': False,
+              'subset_info': subset_info}
     module.exit_json(ansible_facts={'dellemc_pmax_facts': facts}, **result)
 
 
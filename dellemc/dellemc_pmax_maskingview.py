@@ -51,6 +51,128 @@ options:
   password:
     description:
       - "password for Unisphere user"
+  unisphereport:
+    description:
+      - "Integer, port of the Unisphere REST API."
+    type: int
+    default: 8443
+    required: false
+  pool_maxsize:
+    description:
+      - "Integer, connections kept open to the Unisphere host for the
+      module run, threads needing more wait for a free one."
+    type: int
+    default: 10
+    required: false
+  keep_alive:
+    description:
+      - "Boolean, keep the connections open between calls, false closes
+      the connection after each call."
+    type: bool
+    default: true
+    required: false
+  connect_timeout:
+    description:
+      - "Float, seconds to wait for a connection to Unisphere, PyU4V
+      default when not set."
+    type: float
+    required: false
+  read_timeout:
+    description:
+      - "Float, seconds to wait for a Unisphere answer, PyU4V default when
+      not set."
+    type: float
+    required: false
+  memoize_reads:
+    description:
+      - "Boolean, answer identical reads of the module run from memory and
+      coalesce concurrent ones, writes drop the reads they make stale. Can
+      also be set with the PMAX_MEMOIZE_READS environment variable."
+    type: bool
+    default: true
+    required: false
+  retries:
+    description:
+      - "Integer, attempts made on top of the first one for calls
+      throttled by Unisphere (429, 503), rejected on a lock or, for reads,
+      failing on a connection error. 0 disables retries. Can also be set
+      with the PMAX_RETRIES environment variable."
+    type: int
+    default: 5
+    required: false
+  retry_backoff:
+    description:
+      - "Float, first delay in seconds of the exponential backoff between
+      attempts, a Retry-After asked by Unisphere takes precedence."
+    type: float
+    default: 1.0
+    required: false
+  retry_budget:
+    description:
+      - "Float, total seconds the module may wait between attempts before
+      giving up. Can also be set with the PMAX_RETRY_BUDGET environment
+      variable."
+    type: float
+    default: 300
+    required: false
+  session_cache:
+    description:
+      - "Boolean, keep the Unisphere session cookie on the controller and
+      reuse it in the next tasks instead of authenticating again. Can also
+      be set with the PMAX_SESSION_CACHE environment variable."
+    type: bool
+    default: false
+    required: false
+  session_cache_ttl:
+    description:
+      - "Integer, seconds a cached session is reused. Can also be set with
+      the PMAX_SESSION_CACHE_TTL environment variable."
+    type: int
+    default: 600
+    required: false
+  session_cache_dir:
+    description:
+      - "Directory of the cached sessions, created with owner only
+      permissions. Can also be set with the PMAX_SESSION_CACHE_DIR
+      environment variable."
+    type: path
+    default: "~/.ansible/pmax_sessions"
+    required: false
+  rate_limit:
+    description:
+      - "Float, calls per second sent to the Unisphere host by all the
+      module processes of the controller together, no limit when not set.
+      Can also be set with the PMAX_RATE_LIMIT environment variable."
+    type: float
+    required: false
+  rate_burst:
+    description:
+      - "Integer, calls that can go at once after an idle period, defaults
+      to rate_limit. Can also be set with the PMAX_RATE_BURST environment
+      variable."
+    type: int
+    required: false
+  rate_limit_dir:
+    description:
+      - "Directory of the rate limit state shared by the module processes.
+      Can also be set with the PMAX_RATE_LIMIT_DIR environment variable."
+    type: path
+    default: "~/.ansible/pmax_rate"
+    required: false
+  trace:
+    description:
+      - "Boolean, return every REST call of the module (method, URI
+      template, status, latency and sizes) in the pmax_trace result. Can
+      also be set with the PMAX_TRACE environment variable."
+    type: bool
+    default: false
+    required: false
+  trace_file:
+    description:
+      - "File the REST calls are appended to in the Chrome trace format.
+      Can also be set with the PMAX_TRACE_FILE environment variable."
+    type: path
+    required: false
   portgroup_id:
     description:
       - "32 Character string no special character permitted except for
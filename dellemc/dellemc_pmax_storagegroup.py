@@ -7,6 +7,7 @@
 # or https://www.gnu.org/licenses/gpl-3.0.txt)
 
 from __future__ import absolute_import, division, print_function
+import threading
 from itertools import groupby
 
 __metaclass__ = type
@@ -35,6 +36,11 @@ description:
   - "This module has been tested against UNI 9.0 with VMAX3, VMAX All Flash 
   and PowerMAX. Every effort has been made to verify the scripts run with 
   valid input. These modules are a tech preview."
+  - "The changes are planned from a single read of the storage group before
+  any write and returned in the plan fact. Check mode returns the plan
+  without applying it, --diff shows the storage group before and after the
+  plan. A new storage group is created with its volumes in one call and the
+  volumes of every size are added to an existing one in one call."
 
 module: dellemc_pmax_storagegroup
 options:
@@ -45,8 +51,8 @@ options:
   sgname:
     description:
       - "Storage Group name 32 Characters no special characters other than
-      underscore."
-    required: true
+      underscore. Either sgname or storage_groups is required."
+    required: false
   new_sgname:
     description:
       - "New Storage Group name 32 Characters no special characters other than
@@ -81,6 +87,128 @@ options:
   password:
     description:
       - "password for Unisphere user"
+  unisphereport:
+    description:
+      - "Integer, port of the Unisphere REST API."
+    type: int
+    default: 8443
+    required: false
+  pool_maxsize:
+    description:
+      - "Integer, connections kept open to the Unisphere host for the
+      module run, threads needing more wait for a free one."
+    type: int
+    default: 10
+    required: false
+  keep_alive:
+    description:
+      - "Boolean, keep the connections open between calls, false closes
+      the connection after each call."
+    type: bool
+    default: true
+    required: false
+  connect_timeout:
+    description:
+      - "Float, seconds to wait for a connection to Unisphere, PyU4V
+      default when not set."
+    type: float
+    required: false
+  read_timeout:
+    description:
+      - "Float, seconds to wait for a Unisphere answer, PyU4V default when
+      not set."
+    type: float
+    required: false
+  memoize_reads:
+    description:
+      - "Boolean, answer identical reads of the module run from memory and
+      coalesce concurrent ones, writes drop the reads they make stale. Can
+      also be set with the PMAX_MEMOIZE_READS environment variable."
+    type: bool
+    default: true
+    required: false
+  retries:
+    description:
+      - "Integer, attempts made on top of the first one for calls
+      throttled by Unisphere (429, 503), rejected on a lock or, for reads,
+      failing on a connection error. 0 disables retries. Can also be set
+      with the PMAX_RETRIES environment variable."
+    type: int
+    default: 5
+    required: false
+  retry_backoff:
+    description:
+      - "Float, first delay in seconds of the exponential backoff between
+      attempts, a Retry-After asked by Unisphere takes precedence."
+    type: float
+    default: 1.0
+    required: false
+  retry_budget:
+    description:
+      - "Float, total seconds the module may wait between attempts before
+      giving up. Can also be set with the PMAX_RETRY_BUDGET environment
+      variable."
+    type: float
+    default: 300
+    required: false
+  session_cache:
+    description:
+      - "Boolean, keep the Unisphere session cookie on the controller and
+      reuse it in the next tasks instead of authenticating again. Can also
+      be set with the PMAX_SESSION_CACHE environment variable."
+    type: bool
+    default: false
+    required: false
+  session_cache_ttl:
+    description:
+      - "Integer, seconds a cached session is reused. Can also be set with
+      the PMAX_SESSION_CACHE_TTL environment variable."
+    type: int
+    default: 600
+    required: false
+  session_cache_dir:
+    description:
+      - "Directory of the cached sessions, created with owner only
+      permissions. Can also be set with the PMAX_SESSION_CACHE_DIR
+      environment variable."
+    type: path
+    default: "~/.ansible/pmax_sessions"
+    required: false
+  rate_limit:
+    description:
+      - "Float, calls per second sent to the Unisphere host by all the
+      module processes of the controller together, no limit when not set.
+      Can also be set with the PMAX_RATE_LIMIT environment variable."
+    type: float
+    required: false
+  rate_burst:
+    description:
+      - "Integer, calls that can go at once after an idle period, defaults
+      to rate_limit. Can also be set with the PMAX_RATE_BURST environment
+      variable."
+    type: int
+    required: false
+  rate_limit_dir:
+    description:
+      - "Directory of the rate limit state shared by the module processes.
+      Can also be set with the PMAX_RATE_LIMIT_DIR environment variable."
+    type: path
+    default: "~/.ansible/pmax_rate"
+    required: false
+  trace:
+    description:
+      - "Boolean, return every REST call of the module (method, URI
+      template, status, latency and sizes) in the pmax_trace result. Can
+      also be set with the PMAX_TRACE environment variable."
+    type: bool
+    default: false
+    required: false
+  trace_file:
+    description:
+      - "File the REST calls are appended to in the Chrome trace format.
+      Can also be set with the PMAX_TRACE_FILE environment variable."
+    type: path
+    required: false
   luns:
     description:
       - "List of volume requests to be added or already in storage group. 
@@ -98,12 +226,40 @@ options:
       delete"
     type: string
     required: true
+  storage_groups:
+    description:
+      - "List of storage groups to reconcile in a single task instead of
+      sgname, each item takes sgname, slo, compression, luns and state
+      (module state by default) with the same meaning as the module options,
+      the module level slo, luns, compression and new_sgname cannot be set
+      with it. Renaming is not supported in a batch. Storage groups are
+      reconciled in parallel and share a single listing of the storage
+      groups of the array, a failing storage group does not stop the
+      others."
+    type: list
+    required: false
+  sg_workers:
+    description:
+      - "Number of storage groups of storage_groups reconciled in parallel"
+    type: int
+    required: false
+    default: 4
+  job_timeout:
+    description:
+      - "Seconds to wait for the asynchronous job creating the volumes of
+      a storage group. The module fails with the job id and status when the
+      job failed or was still running at the timeout."
+    type: int
+    required: false
+    default: 900
 
 requirements:
   - Ansible
   - "Unisphere for PowerMax version 9.0 or higher."
   - "VMAX All Flash, VMAX3, or PowerMax storage Array."
   - "PyU4V version 3.0.0.10 or higher using PIP python -m pip install PyU4V"
+  - "futures package on Python 2.7 to reconcile storage_groups in
+    parallel, without it they are reconciled one at a time."
 '''
 EXAMPLES = '''
 #!/usr/bin/env ansible-playbook
@@ -201,6 +357,24 @@ EXAMPLES = '''
       slo: "Diamond"
       luns: "{{ lun_request }}"
       state: absent
+  - name: "Provision the storage groups of a database in one task"
+    dellemc_pmax_storagegroup:
+      <<: *uni_connection_vars
+      state: present
+      storage_groups:
+        - sgname: "Ora_DATA_SG"
+          slo: "Diamond"
+          luns:
+            - num_vols: 4
+              cap_gb: 10
+              vol_name: "DATA"
+        - sgname: "Ora_REDO_SG"
+          slo: "Diamond"
+          compression: false
+          luns:
+            - num_vols: 2
+              cap_gb: 5
+              vol_name: "REDO"
 
 '''
 RETURN = r'''
@@ -253,12 +427,59 @@ ok: [localhost] => {
                 "wwn": "60000970000297800941533030304530"
             }
         ],
+        "plan": [
+            {
+                "action": "add_volumes",
+                "cap_gb": 1,
+                "num_vols": 1,
+                "sgname": "Ansible_SG",
+                "vol_name": "REDO"
+            }
+        ],
         "storagegroup_name": "Ansible_SG"
     }
 }
+# plan actions are create_sg, set_compression, set_slo, add_volumes,
+# rename_sg and delete_sg.
+# With storage_groups, one storagegroup_detail per requested storage group in
+# the storagegroup_details list, in the requested order. When storage groups
+# fail, failed_storage_groups maps their names to the error.
+ok: [localhost] => {
+    "storagegroup_details": [
+        {
+            "lun_request": [{"cap_gb": 10, "num_vols": 4}],
+            "message": ["Storage Group Ora_DATA_SG Created",
+                        "4 volume(s) of 10 GB added"],
+            "plan": [...],
+            "sg_volumes": [...],
+            "storagegroup_name": "Ora_DATA_SG"
+        },
+        ...
+    ]
+}
 '''
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.dellemc import dellemc_pmax_argument_spec, pmaxapi
+from ansible.module_utils.dellemc import dellemc_pmax_argument_spec, pmaxapi, \
+    pmax_iter_volumes, pmax_rest_write, pmax_wait_for_jobs, PmaxRestError, \
+    pmax_executor, BULK_VOLUMES_UNIVERSION, DEFAULT_UNIVERSION
+
+# Volume attributes read for the storage group facts
+SG_VOLUME_ATTRIBUTES = ['cap_gb', 'effective_wwn', 'volume_identifier']
+# First Unisphere version taking a volumeAttributes list, 9.0 creates the
+# volumes of a single size per param
+VOLUME_ATTRIBUTES_UNIVERSION = 91
+SLO_CHOICES = ['Diamond', 'Platinum', 'Gold', 'Silver', 'Bronze']
+
+
+class StorageGroupError(Exception):
+    """
+    Failure reconciling a storage group, reported with fail_json by the
+    module
+    """
+
+    def __init__(self, msg):
+        super(StorageGroupError, self).__init__(msg)
+        self.msg = msg
 
 
 def unique_and_count(lst):
@@ -282,41 +503,103 @@ class DellEmcStorageGroup(object):
     Manipulating a Storage Group (creating, deleting, or modifying)
     """
 
-    def __init__(self):
-        self._argument_spec = dellemc_pmax_argument_spec()
-        self._argument_spec.update(dict(
-            sgname=dict(type='str', required=True),
-            new_sgname=dict(type='str', required=False),
-            slo=dict(type='str',
-                     choices=['Diamond', 'Platinum', 'Gold',
-                              'Silver', 'Bronze'],
-                     required=False,
-                     default=None),
-            luns=dict(type='list', required=False),
-            state=dict(type='str',
-                       choices=['present', 'absent'],
-                       required=True),
-            compression=dict(type='bool', required=False)
-        ))
-
-        self._module = AnsibleModule(argument_spec=self._argument_spec)
-        self._conn = pmaxapi(self._module)
+    def __init__(self, module=None, conn=None, params=None, sg_list=None):
+        """
+        :param module: Ansible module, created from the task when not given
+        :param conn: PyU4V connection of the module
+        :param params: (dict) spec of the SG to reconcile, the module
+                       parameters by default
+        :param sg_list: (list) storage groups of the array, shared by the
+                        SGs of a batch, read when needed by default
+        """
+        if module is None:
+            self._argument_spec = dellemc_pmax_argument_spec()
+            self._argument_spec.update(dict(
+                sgname=dict(type='str', required=False),
+                new_sgname=dict(type='str', required=False),
+                slo=dict(type='str',
+                         choices=SLO_CHOICES,
+                         required=False,
+                         default=None),
+                luns=dict(type='list', required=False),
+                state=dict(type='str',
+                           choices=['present', 'absent'],
+                           required=True),
+                compression=dict(type='bool', required=False),
+                storage_groups=dict(type='list', elements='dict',
+                                    required=False, options=dict(
+                                        sgname=dict(type='str',
+                                                    required=True),
+                                        slo=dict(type='str',
+                                                 choices=SLO_CHOICES),
+                                        luns=dict(type='list'),
+                                        compression=dict(type='bool'),
+                                        state=dict(type='str',
+                                                   choices=['present',
+                                                            'absent']))),
+                sg_workers=dict(type='int', required=False, default=4),
+                job_timeout=dict(type='int', required=False, default=900)
+            ))
+
+            module = AnsibleModule(
+                argument_spec=self._argument_spec,
+                mutually_exclusive=[['sgname', 'storage_groups'],
+                                    ['new_sgname', 'storage_groups'],
+                                    ['slo', 'storage_groups'],
+                                    ['luns', 'storage_groups'],
+                                    ['compression', 'storage_groups']],
+                required_one_of=[['sgname', 'storage_groups']],
+                supports_check_mode=True)
+            conn = pmaxapi(module)
+        self._module = module
+        self._conn = conn
+        self._params = params or module.params
+        self._sg_list = sg_list
+        self._sg_list_lock = threading.Lock()
+        self._universion = int(module.params['universion'] or
+                               DEFAULT_UNIVERSION)
         self._changed = False
+        # State read by plan and expected after the plan, see reconcile
+        self._before = {}
+        self.diff = None
+        # Snapshot of the volumes of the SG, None until read or once stale
+        self._sg_volumes = None
         self._lun_request = []
         self._message = []
-        self._sg_name = self._module.params['sgname']
+        self._sg_name = self._params['sgname']
 
         # Parsing the lun_request if exists
-        if self._module.params['luns']:
+        if self._params.get('luns'):
             self._parsing_lun_request()
 
+    def _fail(self, msg):
+        """
+        Abort the reconciliation of the SG, raising so that a SG of a batch
+        fails alone
+        :param msg: error message
+        :return: None
+        """
+        raise StorageGroupError(msg)
+
+    def _get_storage_group_list(self):
+        """
+        Storage groups of the array, listed once and kept up to date with
+        the SGs created, renamed or deleted
+        :return: (list) storage group names
+        """
+        with self._sg_list_lock:
+            if self._sg_list is None:
+                self._sg_list = \
+                    self._conn.provisioning.get_storage_group_list()
+            return self._sg_list
+
     def _parsing_lun_request(self):
         """
         Parsing the lun_request structure, aggregate duplicates if found
         :return: None
         """
         mapping = {}  # Will contains cap size as key (details as values)
-        for g in self._module.params['luns']:
+        for g in self._params['luns']:
             # ignore input if num_vols or cap_gb is equal to zero
             if int(g['num_vols']) <= 0 or int(g['cap_gb']) <= 0:
                 continue
@@ -339,28 +622,54 @@ class DellEmcStorageGroup(object):
                                       'cap_gb': lun_size,
                                       'vol_name': mapping[lun_size]['name']})
 
+    def _iter_sg_volume_details(self):
+        """
+        Details of the volumes in the storage group, paged from the bulk
+        volume endpoint with Unisphere 10, one GET per volume before or when
+        Unisphere does not serve the bulk endpoint
+        :return: generator of volume detail dicts
+        """
+        filters = {'storageGroupId': self._sg_name}
+        if self._universion >= BULK_VOLUMES_UNIVERSION:
+            yielded = False
+            try:
+                for lun_details in pmax_iter_volumes(
+                        self._conn, self._module.params['array_id'],
+                        self._universion, filters=filters,
+                        attributes=SG_VOLUME_ATTRIBUTES):
+                    yielded = True
+                    yield lun_details
+                return
+            except PmaxRestError:
+                # Not every Unisphere 10 release serves the bulk endpoints
+                if yielded:
+                    raise
+        sg_lunlist = self._conn.provisioning.get_volume_list(filters=filters)
+        for lun in sg_lunlist or []:
+            yield self._conn.provisioning.get_volume(lun)
+
     def _get_sg_lun_list(self):
         """
-        Get a list of volumes/luns in the storage group and return a list
+        Get a list of volumes/luns in the storage group and return a list,
+        read once and reused until the SG is changed
         :return: formatted list of luns currently in the storage group
         """
-        sg_lunlist = self._conn.provisioning.\
-            get_volume_list(filters={'storageGroupId': self._sg_name})
+        if self._sg_volumes is not None:
+            return self._sg_volumes
 
         result = []
-        if sg_lunlist:
-            for lun in sg_lunlist:
-                lun_details = self._conn.provisioning.get_volume(lun)
-                sg_lun = {'volumeId': lun_details['volumeId'],
-                          'cap_gb': lun_details['cap_gb'],
-                          'wwn': lun_details['effective_wwn']}
-                if 'volume_identifier' in lun_details:
-                    sg_lun['vol_name'] = lun_details['volume_identifier']
+        for lun_details in self._iter_sg_volume_details():
+            sg_lun = {'volumeId': lun_details['volumeId'],
+                      'cap_gb': lun_details['cap_gb'],
+                      'wwn': lun_details['effective_wwn']}
+            if 'volume_identifier' in lun_details:
+                sg_lun['vol_name'] = lun_details['volume_identifier']
 
-                else:
-                    sg_lun['vol_name'] = "NO_LABEL"
-                result.append(sg_lun)
+            else:
+                sg_lun['vol_name'] = "NO_LABEL"
+            result.append(sg_lun)
 
+        self._sg_volumes = result
         return result
 
     def _current_sg_config(self):
@@ -370,10 +679,8 @@ class DellEmcStorageGroup(object):
         :return: list of volume requests in SG in similar format to playbook
         input
         """
-        lun_summary = []
-        for lun in self._get_sg_lun_list():
-            lun_details = self._conn.provisioning.get_volume(lun['volumeId'])
-            lun_summary.append({'cap_gb': int(lun_details['cap_gb'])})
+        lun_summary = [{'cap_gb': int(lun['cap_gb'])}
+                       for lun in self._get_sg_lun_list()]
 
         current_config = unique_and_count(lun_summary)
         for i in current_config:
@@ -381,245 +688,590 @@ class DellEmcStorageGroup(object):
 
         return current_config
 
-    def _change_compression(self):
+    def _volume_attributes(self, additions):
+        """
+        Unisphere volume attributes creating the volumes of several add
+        actions in a single call, from Unisphere 9.1
+        :param additions: (list) add_volumes actions
+        :return: (list) volumeAttributes entries
         """
-        Change compression on existing Storage Group if needed
+        attributes = []
+        for action in additions:
+            attribute = {'num_of_vols': action['num_vols'],
+                         'volume_size': str(action['cap_gb']),
+                         'capacityUnit': 'GB'}
+            if action['vol_name']:
+                attribute['volumeIdentifier'] = {
+                    'identifier_name': action['vol_name'],
+                    'volumeIdentifierChoice': 'identifier_name'}
+            attributes.append(attribute)
+        return attributes
+
+    @staticmethod
+    def _volume_param_90(addition):
+        """
+        Unisphere 9.0 parameters creating the volumes of one add action
+        :param addition: (dict) add_volumes action
+        :return: (dict) num_of_vols, volumeAttribute and volumeIdentifier
+        """
+        param = {'num_of_vols': addition['num_vols'],
+                 'volumeAttribute': {'volume_size': str(addition['cap_gb']),
+                                     'capacityUnit': 'GB'}}
+        if addition['vol_name']:
+            param['volumeIdentifier'] = {
+                'identifier_name': addition['vol_name'],
+                'volumeIdentifierChoice': 'identifier_name'}
+        return param
+
+    def _sg_uri(self, sg_name=None):
+        """
+        URI of the storage groups of the array, or of one storage group
+        """
+        uri = '/{}/sloprovisioning/symmetrix/{}/storagegroup'.format(
+            self._universion, self._module.params['array_id'])
+        return '{}/{}'.format(uri, sg_name) if sg_name else uri
+
+    def _wait_for_job(self, job, description):
+        """
+        Wait for the job of an asynchronous write, failing the SG when it
+        did not succeed
+        :param job: (dict) job returned by the write
+        :param description: (str) change made by the job, for the error
         :return: None
         """
-        # In case of compressed SG requested, we put the compression flag
-        # at ON. Warning: slo must be present for that option can works (cf. PyU4V)
+        failure = self._wait_for_jobs([(job, description)])[0]
+        if failure:
+            self._message.append(failure)
+            self._fail(msg=failure)
+
+    def _wait_for_jobs(self, submitted):
+        """
+        Wait for the jobs of asynchronous writes submitted together
+        :param submitted: (list) (job returned by the write, change made by
+        the job) pairs
+        :return: (list) error of each job, None for the jobs that succeeded
+        """
+        jobs = [job for job, _ in submitted]
         try:
-            if self._module.params['compression'] is not None:
-                sg_detail = self._conn.provisioning.get_storage_group(storage_group_name=self._sg_name)
-                if sg_detail['compression'] != self._module.params['compression']:
-                    payload = {
-                        "editStorageGroupActionParam": {
-                            "editCompressionParam": {
-                                "compression": self._module.params['compression']
-                            }
-                        }
-                    }
+            results = pmax_wait_for_jobs(
+                self._conn, self._universion, jobs,
+                timeout=self._module.params['job_timeout'])
+        except Exception as error:
+            self._fail(msg="{} failed, unable to read job(s) {} ({})".format(
+                ", ".join(description for _, description in submitted),
+                ", ".join(str((job or {}).get('jobId')) for job in jobs),
+                error))
+        failures = []
+        for job, description in submitted:
+            job = results.get((job or {}).get('jobId'), job) or {}
+            # a job less answer means the write was applied synchronously
+            if job.get('status', 'SUCCEEDED') != 'SUCCEEDED':
+                failures.append("{} failed, job {} {} ({})".format(
+                    description, job.get('jobId'), job.get('status'),
+                    job.get('result')))
+            else:
+                failures.append(None)
+        return failures
+
+    def _plan_volumes(self, sg_detail):
+        """
+        Volumes to add so that the SG holds the lun request
+        :param sg_detail: (dict) current SG details, empty for a new SG
+        :return: (list) add_volumes actions
+        """
+        # First, we extract the current config of the related SG (same format as lun_request)
+        current_config = self._current_sg_config()
+
+        if len(current_config) > len(self._lun_request):
+            message = "Volume requests must contain current config plus " \
+                      "additional requests, operations on a subset of " \
+                      "volumes not supported with this module."
+            self._fail(msg=message)
+
+        # Adding Volumes into a Parent SG is not supported
+        if sg_detail.get('type') == 'Parent':
+            self._fail(msg="{} is a parent SG and it's not possible "
+                           "to add volume in a parent SG".
+                       format(self._sg_name))
+
+        additions = []
+        for group in self._lun_request:
+            lun_to_create = group['num_vols']
+
+            # Let's determine if we need to add more volumes into the
+            # SG or not
+            for in_sg in current_config:
+                # Loop until finding group of TDEVs with the same size as
+                # requested
+                if in_sg['cap_gb'] != int(group['cap_gb']):
+                    continue
+
+                if in_sg['num_vols'] > group['num_vols']:
+                    msg = "There is {} vols of {} GB in {} actually. You " \
+                          "asked {} vols in your requests. This module " \
+                          "doesn't support volumes deletion (Backlog: {})".\
+                          format(in_sg['num_vols'],
+                                 in_sg['cap_gb'],
+                                 self._sg_name,
+                                 group['num_vols'],
+                                 ", ".join(self._message))
+                    self._fail(msg=msg)
+
+                # Computing the exact number of LUNs to create (difference
+                # between the request and existing)
+                lun_to_create = group['num_vols'] - in_sg['num_vols']
+
+            if lun_to_create > 0:
+                additions.append({'action': 'add_volumes',
+                                  'sgname': self._sg_name,
+                                  'num_vols': lun_to_create,
+                                  'cap_gb': int(group['cap_gb']),
+                                  'vol_name': group['vol_name']})
+        return additions
+
+    def plan(self):
+        """
+        Compute the changes bringing the SG to the requested state from a
+        single read of its current state, nothing is written. The state
+        read is kept in self._before for the diff.
+        :return: (list) planned actions, dicts with an action key
+        """
+        sg_list = self._get_storage_group_list()
+        exists = self._sg_name in sg_list
+        self._before = {'storagegroup_name': self._sg_name, 'exists': exists}
+
+        # Storage Group deletion
+        if self._params['state'] == 'absent':
+            # SG must exists before go ahead (obviously...)
+            if not exists:
+                self._fail(msg="SG {} doesn't exists".format(self._sg_name))
+
+            masking_view = self._conn.provisioning.\
+                get_masking_views_from_storage_group(storagegroup=self._sg_name)
+
+            if masking_view:
+                self._message.append("Storage Group {} is Part of a Masking View".
+                                     format(self._sg_name))
+                self._fail(msg=self._message)
+            return [{'action': 'delete_sg', 'sgname': self._sg_name}]
+
+        # If we want to rename SG, this operation will done in first
+        # place and will be exclusive
+        if self._params.get('new_sgname'):
+            if not exists:
+                self._fail(msg="SG {} doesn't exists".format(self._sg_name))
 
-                    self._conn.provisioning. \
-                        modify_storage_group(storagegroup=self._sg_name,
-                                             payload=payload)
-                    self._changed = True
-                    self._message.append("Set compression at {} on {}".
-                                         format(self._module.params['compression'],
-                                                self._sg_name))
+            if self._params['new_sgname'] in sg_list:
+                self._fail(msg="Target SG name {} already exists".
+                           format(self._params['new_sgname']))
+            return [{'action': 'rename_sg', 'sgname': self._sg_name,
+                     'new_sgname': self._params['new_sgname']}]
+
+        plan = []
+        slo = self._params['slo']
+        compression = self._params['compression']
+        if not exists:
+            plan.append({'action': 'create_sg', 'sgname': self._sg_name,
+                         'slo': slo, 'compression': compression})
+            sg_detail = {}
+            self._sg_volumes = []
+        else:
+            self._message.append("SG {} already exists".format(self._sg_name))
+            try:
+                sg_detail = self._conn.provisioning.\
+                    get_storage_group(storage_group_name=self._sg_name)
+            except Exception as error:
+                self._fail(msg="Unable to read SG {} ({})".format(
+                    self._sg_name, error))
+            self._before.update(slo=sg_detail.get('slo'),
+                                compression=sg_detail.get('compression'),
+                                lun_request=self._current_sg_config())
+            if compression is not None:
+                if sg_detail.get('compression') != compression:
+                    plan.append({'action': 'set_compression',
+                                 'sgname': self._sg_name,
+                                 'compression': compression})
                 else:
                     self._message.append("Compression on SG {} already set at {}".
-                                         format(self._sg_name,
-                                                self._module.params['compression']))
-        except Exception as error:
-            self._module.fail_json(msg="Unable to modify compression for {} ({})".
-                                   format(self._sg_name, error))
+                                         format(self._sg_name, compression))
+            if slo:
+                if sg_detail.get('slo') != slo:
+                    plan.append({'action': 'set_slo',
+                                 'sgname': self._sg_name, 'slo': slo})
+                else:
+                    self._message.append("SLO of SG {} already {}".
+                                         format(self._sg_name, slo))
+
+        if self._lun_request:
+            plan.extend(self._plan_volumes(sg_detail))
+        return plan
 
-    def _change_service_level(self):
+    def _expected_state(self, plan):
         """
-        Change Service Level on existing Storage Group
+        State of the SG once the plan is applied, the after of the diff
+        :param plan: (list) planned actions
+        :return: (dict)
+        """
+        after = dict(self._before)
+        additions = {}
+        for action in plan:
+            if action['action'] == 'delete_sg':
+                return {'storagegroup_name': self._sg_name, 'exists': False}
+            if action['action'] == 'rename_sg':
+                after['storagegroup_name'] = action['new_sgname']
+            elif action['action'] == 'create_sg':
+                after.update(exists=True, slo=action['slo'],
+                             compression=action['compression'] is not False,
+                             lun_request=[])
+            elif action['action'] == 'set_compression':
+                after['compression'] = action['compression']
+            elif action['action'] == 'set_slo':
+                after['slo'] = action['slo']
+            elif action['action'] == 'add_volumes':
+                additions[action['cap_gb']] = action['num_vols']
+        if additions:
+            counts = dict((i['cap_gb'], i['num_vols'])
+                          for i in after.get('lun_request') or [])
+            for cap_gb, num_vols in additions.items():
+                counts[cap_gb] = counts.get(cap_gb, 0) + num_vols
+            after['lun_request'] = [{'cap_gb': cap_gb, 'num_vols': num_vols}
+                                    for cap_gb, num_vols in sorted(counts.items())]
+        return after
+
+    def _create_sg(self, action, additions):
+        """
+        Create the SG with its compression setting and its volumes in a
+        single call
+        :param action: (dict) create_sg action
+        :param additions: (list) add_volumes actions of the SG
         :return: None
         """
+        slo_param = {
+            "sloId": action['slo'] or "None",
+            "workloadSelection": "None",
+            "noCompression": action['compression'] is False
+        }
+        if self._universion >= VOLUME_ATTRIBUTES_UNIVERSION:
+            slo_params = [dict(slo_param, volumeAttributes=(
+                self._volume_attributes(additions) or [
+                    {"num_of_vols": 0, "volume_size": "0",
+                     "capacityUnit": "GB"}]))]
+        else:
+            slo_params = [dict(slo_param, **self._volume_param_90(addition))
+                          for addition in additions] or [
+                dict(slo_param, num_of_vols=0, volumeAttribute={
+                    "volume_size": "0", "capacityUnit": "GB"})]
+        payload = {
+            "srpId": "SRP_1",
+            "storageGroupId": self._sg_name,
+            "emulation": "FBA",
+            "sloBasedStorageGroupParam": slo_params,
+            "executionOption": "ASYNCHRONOUS"
+        }
+        try:
+            job = pmax_rest_write(self._conn, self._sg_uri(), 'POST', payload)
+        except PmaxRestError as error:
+            self._fail(msg="Unable to create SG {} ({})".format(self._sg_name,
+                                                                error))
+        self._get_storage_group_list().append(self._sg_name)
+        self._changed = True
+        self._sg_volumes = None
+        self._wait_for_job(job, "Creation of SG {}".format(self._sg_name))
+        self._message.append("Storage Group {} Created".format(self._sg_name))
+        for addition in additions:
+            self._message.append("{} volume(s) of {} GB added".
+                                 format(addition['num_vols'],
+                                        addition['cap_gb']))
+
+    def _change_compression(self, compression):
+        """
+        Change compression on existing Storage Group
+        :param compression: (bool) compression requested
+        :return: None
+        """
+        # In case of compressed SG requested, we put the compression flag
+        # at ON. Warning: slo must be present for that option can works (cf. PyU4V)
         payload = {
             "editStorageGroupActionParam": {
-                "editStorageGroupSLOParam": {
-                    "sloId": self._module.params['slo']
+                "editCompressionParam": {
+                    "compression": compression
                 }
             }
         }
         try:
-            if self._module.params['slo']:
-                sg_detail = self._conn.provisioning.get_storage_group(storage_group_name=self._sg_name)
-                if sg_detail['slo'] != self._module.params['slo']:
-
-                    self._conn.provisioning.\
-                        modify_storage_group(storagegroup=self._sg_name,
-                                             payload=payload)
-                    self._changed = True
-                    self._message.append("Applied {} SLO to {}".format(self._module.params['slo'],
-                                                                       self._sg_name))
-                else:
-                    self._message.append("SLO of SG {} already {}".
-                                         format(self._sg_name,
-                                                self._module.params['slo']))
-
+            self._conn.provisioning. \
+                modify_storage_group(storagegroup=self._sg_name,
+                                     payload=payload)
+            self._changed = True
+            self._message.append("Set compression at {} on {}".
+                                 format(compression, self._sg_name))
         except Exception as error:
-            self._module.fail_json(msg="Unable to modify SLO for {} ({})".
-                                       format(self._sg_name, error))
+            self._fail(msg="Unable to modify compression for {} ({})".
+                       format(self._sg_name, error))
 
-    def _create_sg(self):
+    def _change_service_level(self, slo):
         """
-        Create SG if needed and exit module gracefully with changes
+        Change Service Level on existing Storage Group
+        :param slo: (str) service level requested
         :return: None
         """
-        if self._sg_name not in self._conn.provisioning.get_storage_group_list():
-            srp = "None" if self._module.params['slo'] == "None" else "SRP_1"
-            self._conn.provisioning.create_storage_group(srp_id=srp,
-                                                         sg_id=self._sg_name,
-                                                         slo=self._module.params['slo'])
-
+        payload = {
+            "editStorageGroupActionParam": {
+                "editStorageGroupSLOParam": {
+                    "sloId": slo
+                }
+            }
+        }
+        try:
+            self._conn.provisioning.\
+                modify_storage_group(storagegroup=self._sg_name,
+                                     payload=payload)
             self._changed = True
-            self._message.append("Empty Storage Group {} Created".format(self._sg_name))
-        else:
-            self._message.append("SG {} already exists".format(self._sg_name))
+            self._message.append("Applied {} SLO to {}".format(slo,
+                                                               self._sg_name))
+        except Exception as error:
+            self._fail(msg="Unable to modify SLO for {} ({})".
+                       format(self._sg_name, error))
 
     def _delete_sg(self):
         """
         Delete Storage Group
         :return: None
         """
-        # SG must exists before go ahead (obviously...)
-        if self._sg_name not in self._conn.provisioning.get_storage_group_list():
-            self._module.fail_json(msg="SG {} doesn't exists".format(self._sg_name))
-
-        masking_view = self._conn.provisioning.\
-            get_masking_views_from_storage_group(storagegroup=self._sg_name)
-
-        if masking_view:
-            self._message.append("Storage Group {} is Part of a Masking View".
-                                 format(self._sg_name))
-            self._module.fail_json(msg=self._message)
-
         self._conn.provisioning.delete_storagegroup(storagegroup_id=self._sg_name)
+        self._get_storage_group_list().remove(self._sg_name)
         self._changed = True
         self._message.append("SG {} has been deleted".format(self._sg_name))
 
-    def _modify_sg(self):
+    def _add_volumes(self, additions):
         """
-        Modify a Storage Group (meaning adding volumes if needed)
+        Add the volumes of every requested size to the SG in a single
+        asynchronous call. Unisphere 9.0 takes one call per size, they are
+        all submitted before waiting for their jobs together
+        :param additions: (list) add_volumes actions
         :return: None
         """
-        # First, we extract the current config of the related SG (same format as lun_request)
-        current_config = self._current_sg_config()
-
-        if len(current_config) > len(self._lun_request):
-            message = "Volume requests must contain current config plus " \
-                      "additional requests, operations on a subset of " \
-                      "volumes not supported with this module."
-            self._module.fail_json(msg=message)
-
-        # Adding Volumes into a Parent SG is not supported
-        sg_details = self._conn.provisioning.get_storage_group(storage_group_name=self._sg_name)
-        if sg_details['type'] == 'Parent':
-            self._module.fail_json(msg="{} is a parent SG and it's not possible "
-                                       "to add volume in a parent SG".
-                                       format(self._sg_name))
-
-        # If the SG is empty, we add the whole lun_request inside it
-        elif sg_details['num_of_vols'] == 0:
-            for group in self._lun_request:
-                self._conn.provisioning. \
-                    add_new_vol_to_storagegroup(sg_id=self._sg_name,
-                                                cap_unit="GB",
-                                                num_vols=group['num_vols'],
-                                                vol_size=group['cap_gb'],
-                                                vol_name=group['vol_name'])
+        if self._universion >= VOLUME_ATTRIBUTES_UNIVERSION:
+            batches = [additions]
+        else:
+            batches = [[addition] for addition in additions]
+        submitted = []
+        errors = []
+        for batch in batches:
+            description = ", ".join("{} volume(s) of {} GB".format(
+                addition['num_vols'], addition['cap_gb'])
+                for addition in batch)
+            try:
+                job = self._submit_expansion(batch)
+            except PmaxRestError as error:
+                # The sizes already submitted are still waited for
+                errors.append("Unable to add {} to {} ({})".format(
+                    description, self._sg_name, error))
+                break
+            submitted.append((job, "Addition of {}".format(description),
+                              batch))
+        if submitted:
+            self._sg_volumes = None
+        failures = self._wait_for_jobs(
+            [(job, description) for job, description, _ in submitted])
+        for (_, _, batch), failure in zip(submitted, failures):
+            if failure:
+                self._message.append(failure)
+                continue
+            self._changed = True
+            for addition in batch:
                 self._message.append("{} volume(s) of {} GB added".
-                                     format(group['num_vols'], group['cap_gb']))
-                self._changed = True
+                                     format(addition['num_vols'],
+                                            addition['cap_gb']))
+        errors = [f for f in failures if f] + errors
+        if errors:
+            self._fail(msg="; ".join(errors))
 
-        # Here, we assume that's the SG is not empty and we have to
-        # determine how many LUNs to add inside it
+    def _submit_expansion(self, additions):
+        """
+        Create volumes in the SG through one asynchronous call
+        :param additions: (list) add_volumes actions, a single one before
+        Unisphere 9.1
+        :return: (dict) job of the call
+        """
+        add_volume_param = {"emulation": "FBA", "create_new_volumes": True}
+        if self._universion >= VOLUME_ATTRIBUTES_UNIVERSION:
+            add_volume_param['volumeAttributes'] = \
+                self._volume_attributes(additions)
         else:
-            for group in self._lun_request:
-                lun_to_create = group['num_vols']
-
-                # Let's determine if we need to add more volumes into the
-                # SG or not
-                for in_sg in current_config:
-                    # Loop until finding group of TDEVs with the same size as
-                    # requested
-                    if in_sg['cap_gb'] != int(group['cap_gb']):
-                        continue
-
-                    if in_sg['num_vols'] > group['num_vols']:
-                        msg = "There is {} vols of {} GB in {} actually. You " \
-                              "asked {} vols in your requests. This module " \
-                              "doesn't support volumes deletion (Backlog: {})".\
-                              format(in_sg['num_vols'],
-                                     in_sg['cap_gb'],
-                                     self._sg_name,
-                                     group['num_vols'],
-                                     ", ".join(self._message))
-                        self._module.fail_json(msg=msg)
-
-                    # Computing the exact number of LUNs to create (difference
-                    # between the request and existing)
-                    lun_to_create = group['num_vols'] - in_sg['num_vols']
-
-                if lun_to_create > 0:
-                    self._conn.provisioning. \
-                        add_new_vol_to_storagegroup(sg_id=self._sg_name,
-                                                    cap_unit="GB",
-                                                    num_vols=lun_to_create,
-                                                    vol_size=group['cap_gb'],
-                                                    vol_name=group['vol_name'])
-
-                    self._message.append("{} volume(s) of {} GB added".
-                                         format(lun_to_create, group['cap_gb']))
-                    self._changed = True
-
-    def _rename_sg(self):
+            add_volume_param.update(self._volume_param_90(additions[0]))
+        payload = {
+            "editStorageGroupActionParam": {
+                "expandStorageGroupParam": {
+                    "addVolumeParam": add_volume_param
+                }
+            },
+            "executionOption": "ASYNCHRONOUS"
+        }
+        return pmax_rest_write(self._conn, self._sg_uri(self._sg_name),
+                               'PUT', payload)
+
+    def _rename_sg(self, new_sgname):
         """
         Renaming an existing StorageGroup
+        :param new_sgname: (str) new name of the SG
         :return: None
         """
         try:
-            sg_list = self._conn.provisioning.get_storage_group_list()
-            if self._sg_name not in sg_list:
-                self._module.fail_json(msg="SG {} doesn't exists".format(self._sg_name))
-
-            if self._module.params['new_sgname'] in sg_list:
-                self._module.fail_json(msg="Target SG name {} already exists".
-                                       format(self._module.params['new_sgname']))
-
             rename = {
                 "editStorageGroupActionParam": {
                     "renameStorageGroupParam": {
-                        "new_storage_Group_name": self._module.params['new_sgname']
+                        "new_storage_Group_name": new_sgname
                     }
                 }
             }
             self._conn.provisioning.modify_storage_group(storagegroup=self._sg_name,
                                                          payload=rename)
             self._changed = True
+            sg_list = self._get_storage_group_list()
+            sg_list.remove(self._sg_name)
+            sg_list.append(new_sgname)
             # Updating sg_name to be consistent with the next facts gathering
-            self._sg_name = self._module.params['new_sgname']
+            self._sg_name = new_sgname
+            self._sg_volumes = None
             self._message.append("SG renamed to {}".format(self._sg_name))
 
         except Exception as error:
-            self._module.fail_json(msg="Unable to rename SG({})".format(error))
+            self._fail(msg="Unable to rename SG({})".format(error))
 
-    def apply_module(self):
+    def apply(self, plan):
         """
-        Main function for that object
+        Apply a plan with as few calls as possible: a new SG is created with
+        its volumes, the volumes of every size are added to an existing SG
+        by a single call (one per size with Unisphere 9.0)
+        :param plan: (list) planned actions
         :return: None
         """
-        facts = {}
-
-        # Storage Group deletion
-        if self._module.params['state'] == 'absent':
-            self._delete_sg()
+        additions = [action for action in plan
+                     if action['action'] == 'add_volumes']
+        for action in plan:
+            if action['action'] == 'create_sg':
+                self._create_sg(action, additions)
+                additions = []
+            elif action['action'] == 'set_compression':
+                self._change_compression(action['compression'])
+            elif action['action'] == 'set_slo':
+                self._change_service_level(action['slo'])
+            elif action['action'] == 'rename_sg':
+                self._rename_sg(action['new_sgname'])
+            elif action['action'] == 'delete_sg':
+                self._delete_sg()
+        if additions:
+            self._add_volumes(additions)
 
-        # Storage Group creation and/or alteration
-        elif self._module.params['state'] == 'present':
-            # If we want to rename SG, this operation will done in first
-            # place and will be exclusive
-            if self._module.params['new_sgname']:
-                self._rename_sg()
+    def reconcile(self):
+        """
+        Bring the SG to the requested state, or only plan the changes in
+        check mode
+        :return: (dict) storage group facts
+        """
+        facts = {}
+        plan = self.plan()
+        self.diff = {'before': self._before,
+                     'after': self._expected_state(plan)}
+        if self._module.check_mode:
+            self._changed = bool(plan)
+            for action in plan:
+                self._message.append("Check mode, {} planned on SG {}".
+                                     format(action['action'], self._sg_name))
+        else:
+            self.apply(plan)
 
-            else:
-                self._create_sg()
-                self._change_compression()
-                self._change_service_level()
-                if self._lun_request:
-                    self._modify_sg()
+        if self._params['state'] == 'present':
             facts['sg_volumes'] = self._get_sg_lun_list()
             facts['lun_request'] = self._current_sg_config()
 
+        facts['plan'] = plan
         facts['message'] = self._message
         facts['storagegroup_name'] = self._sg_name
-        result = {'state': 'info', 'changed': self._changed}
+        return facts
+
+    def _reconcile_batch(self):
+        """
+        Reconcile every SG of storage_groups, sg_workers at a time, sharing
+        the connection and a single listing of the storage groups of the
+        array
+        :return: None
+        """
+        specs = self._module.params['storage_groups']
+        names = [spec['sgname'] for spec in specs]
+        duplicates = sorted(set(name for name in names
+                                if names.count(name) > 1))
+        if duplicates:
+            self._module.fail_json(msg="Storage groups requested more than "
+                                       "once: {}".format(", ".join(duplicates)))
+        if self._module.params['sg_workers'] < 1:
+            self._module.fail_json(msg="sg_workers must be at least 1")
+
+        sg_list = self._get_storage_group_list()
+        groups = []
+        for spec in specs:
+            params = dict(spec, new_sgname=None,
+                          state=spec['state'] or self._module.params['state'])
+            group = DellEmcStorageGroup(self._module, self._conn, params,
+                                        sg_list)
+            group._sg_list_lock = self._sg_list_lock
+            groups.append(group)
+
+        def reconcile(group):
+            try:
+                return group.reconcile(), None
+            except StorageGroupError as error:
+                if isinstance(error.msg, list):
+                    return None, "; ".join(error.msg)
+                return None, error.msg
+            except Exception as error:
+                return None, "Unable to reconcile SG {} ({})".format(
+                    group._sg_name, error)
+
+        with pmax_executor(self._module.params['sg_workers']) as pool:
+            outcomes = list(pool.map(reconcile, groups))
+
+        details = []
+        failed = {}
+        for group, (facts, error) in zip(groups, outcomes):
+            if error is not None:
+                failed[group._sg_name] = error
+                facts = {'storagegroup_name': group._sg_name,
+                         'message': group._message,
+                         'failed': True, 'msg': error}
+            details.append(facts)
+        changed = any(group._changed for group in groups)
+        diff = [group.diff for group in groups if group.diff]
+        if failed:
+            self._module.fail_json(msg="Unable to reconcile storage "
+                                       "group(s) {}".format(
+                                           ", ".join(sorted(failed))),
+                                   failed_storage_groups=failed,
+                                   storagegroup_details=details,
+                                   changed=changed)
+        self._module.exit_json(
+            ansible_facts={'storagegroup_details': details},
+            state='info', changed=changed, diff=diff)
+
+    def apply_module(self):
+        """
+        Main function for that object
+        :return: None
+        """
+        if self._module.params['storage_groups']:
+            self._reconcile_batch()
+            return
+
+        try:
+            facts = self.reconcile()
+        except StorageGroupError as error:
+            self._module.fail_json(msg=error.msg)
+        except Exception as error:
+            self._module.fail_json(msg="Unable to reconcile SG {} ({})".format(
+                self._sg_name, error))
+        result = {'state': 'info', 'changed': self._changed,
+                  'diff': self.diff}
         self._module.exit_json(ansible_facts={'storagegroup_detail': facts}, **result)
 
 
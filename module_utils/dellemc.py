@@ -1,8 +1,91 @@
 # -*- coding: utf-8 -*-
 # Copyright: (c) 2018, Paul Martin <paule.martin@dell.com>
 # Simplified BSD License (see licenses/simplified_bsd.txt or https://opensource.org/licenses/BSD-2-Clause)
+import copy
+import fcntl
+import hashlib
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from email.utils import mktime_tz, parsedate_tz
+
+from ansible.module_utils.basic import env_fallback
+
+try:
+    import requests
+    HAS_REQUESTS = True
+except ImportError:
+    HAS_REQUESTS = False
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+    HAS_FUTURES = True
+except ImportError:
+    # Python 2 without the futures backport, see pmax_executor
+    HAS_FUTURES = False
+
 VERSION = 1.1
 USER_AGENT_BASE = 'Ansible'
+DEFAULT_UNIVERSION = 90
+# First Unisphere version serving the bulk object endpoints
+BULK_VOLUMES_UNIVERSION = 100
+DEFAULT_SESSION_CACHE_DIR = '~/.ansible/pmax_sessions'
+DEFAULT_FACT_CACHE_TTL = 300
+DEFAULT_RATE_LIMIT_DIR = '~/.ansible/pmax_rate'
+
+# Connections already built by this process, keyed by
+# unispherehost/array_id/user
+_CONNECTIONS = {}
+# Per thread state of the transport, see pmax_call_stats
+_THREAD_STATE = threading.local()
+# Answers of a busy Unisphere, retried for every method
+RETRY_STATUSES = frozenset([429, 503])
+# Longest wait between two attempts of a call, Retry-After aside
+MAX_RETRY_DELAY = 30
+# Unisphere error messages of a request rejected on a lock held by another
+# request, nothing having been changed the request can be sent again
+_LOCK_ERROR = re.compile(r'\block(ed)?\b', re.IGNORECASE)
+# Methods retried whatever the error, reads being idempotent
+_IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+# Categories of objects whose cached reads a write to a category makes
+# stale, writes to other categories drop every read of the array
+_MEMO_RELATED = {
+    'storagegroup': frozenset(['storagegroup', 'volume', 'maskingview',
+                               'srp']),
+    'volume': frozenset(['volume', 'storagegroup', 'srp']),
+    'maskingview': frozenset(['maskingview', 'storagegroup', 'host',
+                              'hostgroup', 'portgroup', 'initiator']),
+    'host': frozenset(['host', 'hostgroup', 'maskingview', 'initiator']),
+    'hostgroup': frozenset(['hostgroup', 'host', 'maskingview']),
+    'portgroup': frozenset(['portgroup', 'maskingview', 'port',
+                            'director']),
+}
+# Unisphere 10 bulk collections, by category of their objects
+_BULK_CATEGORIES = {
+    'volumes': 'volume', 'storage-groups': 'storagegroup',
+    'hosts': 'host', 'host-groups': 'hostgroup',
+    'port-groups': 'portgroup', 'masking-views': 'maskingview',
+}
+# Status of the jobs still running, see PmaxReadCache.job_polled
+_JOB_RUNNING = frozenset(['CREATED', 'SCHEDULED', 'VALIDATING',
+                          'VALIDATED', 'RUNNING'])
+# Path segments followed by an object name, collapsed in URI templates
+_URI_COLLECTIONS = frozenset([
+    'symmetrix', 'systems', 'volume', 'volumes', 'storagegroup', 'host',
+    'hostgroup', 'portgroup', 'maskingview', 'initiator', 'slo', 'srp',
+    'director', 'port', 'job', 'Iterator', 'snapshot', 'generation',
+    'rdf_group', 'volume_pair'])
 
 
 def dellemc_pmax_argument_spec():
@@ -13,9 +96,1145 @@ def dellemc_pmax_argument_spec():
         user=dict(type='str', required=True),
         password=dict(type='str', required=True, no_log=True),
         array_id=dict(type='str', required=True),
+        unisphereport=dict(type='int', required=False, default=8443),
+        pool_maxsize=dict(type='int', required=False, default=10),
+        keep_alive=dict(type='bool', required=False, default=True),
+        connect_timeout=dict(type='float', required=False),
+        read_timeout=dict(type='float', required=False),
+        memoize_reads=dict(type='bool', required=False, default=True,
+                           fallback=(env_fallback, ['PMAX_MEMOIZE_READS'])),
+        retries=dict(type='int', required=False, default=5,
+                     fallback=(env_fallback, ['PMAX_RETRIES'])),
+        retry_backoff=dict(type='float', required=False, default=1.0),
+        retry_budget=dict(type='float', required=False, default=300,
+                          fallback=(env_fallback, ['PMAX_RETRY_BUDGET'])),
+        session_cache=dict(type='bool', required=False, default=False,
+                           fallback=(env_fallback, ['PMAX_SESSION_CACHE'])),
+        session_cache_ttl=dict(type='int', required=False, default=600,
+                               fallback=(env_fallback,
+                                         ['PMAX_SESSION_CACHE_TTL'])),
+        session_cache_dir=dict(type='path', required=False,
+                               default=DEFAULT_SESSION_CACHE_DIR,
+                               fallback=(env_fallback,
+                                         ['PMAX_SESSION_CACHE_DIR'])),
+        rate_limit=dict(type='float', required=False,
+                        fallback=(env_fallback, ['PMAX_RATE_LIMIT'])),
+        rate_burst=dict(type='int', required=False,
+                        fallback=(env_fallback, ['PMAX_RATE_BURST'])),
+        rate_limit_dir=dict(type='path', required=False,
+                            default=DEFAULT_RATE_LIMIT_DIR,
+                            fallback=(env_fallback,
+                                      ['PMAX_RATE_LIMIT_DIR'])),
+        trace=dict(type='bool', required=False, default=False,
+                   fallback=(env_fallback, ['PMAX_TRACE'])),
+        trace_file=dict(type='path', required=False,
+                        fallback=(env_fallback, ['PMAX_TRACE_FILE'])),
     )
 
-def pmaxapi(module):
+
+def _write_json_atomic(cache_dir, path, data):
+    """
+    Write data as json to path through a temporary file so that readers
+    never see a partial file. The directory is only accessible by its owner.
+    :param cache_dir: (str) directory of path
+    :param path: (str) destination file
+    :param data: json serialisable data
+    :return: (bool) True when the file was written
+    """
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0o700)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(fd, 'w') as cache_file:
+            json.dump(data, cache_file)
+        os.rename(tmp_path, path)
+    except (IOError, OSError, TypeError, ValueError):
+        # A cache we cannot write is only a missed optimisation
+        return False
+    return True
+
+
+class PmaxSessionCache(object):
+    """
+    Controller side store for the Unisphere session cookies. One file is
+    kept per unispherehost/array_id/user so that every task of a playbook
+    can reuse the session authenticated by the previous one instead of
+    authenticating again.
+    """
+
+    def __init__(self, cache_dir, ttl, unispherehost, array_id, user):
+        """
+        :param cache_dir: (str) directory holding the cache files
+        :param ttl: (int) seconds a cached session is trusted
+        :param unispherehost: (str) Unisphere server
+        :param array_id: (str) array serial number
+        :param user: (str) Unisphere user
+        """
+        self._ttl = ttl
+        self._cache_dir = os.path.expanduser(cache_dir)
+        key = '{}/{}/{}'.format(unispherehost, array_id, user)
+        self._path = os.path.join(
+            self._cache_dir,
+            hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
+
+    def load(self):
+        """
+        Read the cached cookies if they have not expired
+        :return: (dict) cookies or None
+        """
+        try:
+            with open(self._path) as cache_file:
+                entry = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return None
+        if time.time() - entry.get('created', 0) > self._ttl:
+            self.invalidate()
+            return None
+        return entry.get('cookies') or None
+
+    def save(self, cookies):
+        """
+        Persist the cookies, the file is only readable by its owner
+        :param cookies: (dict) cookie name/value pairs
+        :return: None
+        """
+        if not cookies:
+            return
+        _write_json_atomic(self._cache_dir, self._path,
+                           {'created': time.time(), 'cookies': cookies})
+
+    def invalidate(self):
+        """
+        Forget the cached session
+        :return: None
+        """
+        try:
+            os.remove(self._path)
+        except OSError:
+            pass
+
+
+class PmaxFactCache(object):
+    """
+    Controller side store for gathered facts, one file per array and
+    subset under cache_dir/array_id, so that playbooks run within cache_ttl
+    of each other reuse the facts instead of reading the array again.
+    """
+
+    def __init__(self, cache_dir, ttl, array_id):
+        """
+        :param cache_dir: (str) directory holding the cache files
+        :param ttl: (int) seconds cached facts are trusted
+        :param array_id: (str) array serial number
+        """
+        self._ttl = ttl
+        self._array_dir = os.path.join(os.path.expanduser(cache_dir),
+                                       array_id)
+
+    def _path(self, subset):
+        return os.path.join(self._array_dir, subset + '.json')
+
+    def load(self, subset, expired=False, options=None):
+        """
+        Read the cached facts of a subset if they have not expired
+        :param subset: (str) subset name
+        :param expired: (bool) return the facts even when they have expired
+        :param options: (dict) options the facts were gathered with, facts
+        gathered with other options are not returned
+        :return: (tuple) facts and collection time, None when not cached
+        """
+        try:
+            with open(self._path(subset)) as cache_file:
+                entry = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return None
+        created = entry.get('created', 0)
+        if 'facts' not in entry or entry.get('options') != options or \
+                (not expired and time.time() - created > self._ttl):
+            return None
+        return entry['facts'], created
+
+    def save(self, subset, facts, created=None, options=None):
+        """
+        Persist the facts of a subset
+        :param subset: (str) subset name
+        :param facts: (dict) facts of the subset
+        :param created: (float) collection time, defaults to now
+        :param options: (dict) options the facts were gathered with
+        :return: (float) collection time
+        """
+        created = created or time.time()
+        _write_json_atomic(self._array_dir, self._path(subset),
+                           {'created': created, 'facts': facts,
+                            'options': options})
+        return created
+
+
+class PmaxRateLimiter(object):
+    """
+    Token bucket shared by every module process of the controller calling
+    the same Unisphere host. The bucket lives in a state file locked with
+    flock, each call takes a token and waits for the bucket to refill when
+    it is empty, so that all the forks of a playbook together stay below
+    rate calls per second.
+    """
+
+    def __init__(self, state_dir, unispherehost, rate, burst=None):
+        """
+        :param state_dir: (str) directory holding the bucket files
+        :param unispherehost: (str) Unisphere server, one bucket per server
+        :param rate: (float) calls per second
+        :param burst: (int) calls allowed at once after an idle period,
+                      rate by default
+        """
+        self.rate = rate
+        self.burst = max(1, burst or int(rate))
+        self.waits = 0
+        self.waited = 0.0
+        self._lock = threading.Lock()
+        self._state_dir = os.path.expanduser(state_dir)
+        self._path = os.path.join(
+            self._state_dir,
+            hashlib.sha256(unispherehost.encode('utf-8')).hexdigest())
+
+    def _take(self):
+        """
+        Take a token from the bucket
+        :return: (float) 0 when a token was taken, else seconds until one is
+                 available
+        """
+        if not os.path.isdir(self._state_dir):
+            os.makedirs(self._state_dir, 0o700)
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            now = time.time()
+            try:
+                tokens, updated = [float(value) for value in
+                                   os.read(fd, 64).decode().split()]
+            except ValueError:
+                tokens, updated = self.burst, now
+            tokens = min(self.burst,
+                         tokens + max(0.0, now - updated) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, '{} {}'.format(tokens, now).encode())
+            return wait
+        finally:
+            os.close(fd)
+
+    def acquire(self):
+        """
+        Block until the call can be sent
+        :return: (float) seconds waited
+        """
+        waited = 0.0
+        wait = self._take()
+        while wait:
+            time.sleep(wait)
+            waited += wait
+            wait = self._take()
+        if waited:
+            with self._lock:
+                self.waits += 1
+                self.waited += waited
+        return waited
+
+    def as_dict(self):
+        """
+        Counters returned in the pmax_rate_limit result
+        :return: (dict)
+        """
+        return {'rate': self.rate, 'burst': self.burst,
+                'throttled_calls': self.waits,
+                'seconds': round(self.waited, 3)}
+
+
+class PmaxCallStats(object):
+    """
+    Counters of the REST calls sent by the threads it is active on, see
+    pmax_call_stats
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.bytes = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def record(self, received, retries=0):
+        """
+        Account for one REST call
+        :param received: (int) bytes of the response body
+        :param retries: (int) attempts made on top of the first one
+        :return: None
+        """
+        with self._lock:
+            self.calls += 1
+            self.bytes += received
+            self.retries += retries
+
+
+@contextmanager
+def pmax_call_stats(stats):
+    """
+    Account the REST calls sent by the current thread in stats while the
+    context is active
+    :param stats: PmaxCallStats
+    """
+    previous = getattr(_THREAD_STATE, 'stats', None)
+    _THREAD_STATE.stats = stats
+    try:
+        yield stats
+    finally:
+        _THREAD_STATE.stats = previous
+
+
+class _PmaxDoneFuture(object):
+    """
+    Outcome of a call run by PmaxSerialExecutor
+    """
+
+    def __init__(self, result=None, error=None):
+        self._result = result
+        self._error = error
+
+    def result(self):
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class PmaxSerialExecutor(object):
+    """
+    Stand-in for ThreadPoolExecutor when concurrent.futures is missing,
+    every call runs in the calling thread as it is submitted
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def submit(self, fn, *args, **kwargs):
+        try:
+            return _PmaxDoneFuture(result=fn(*args, **kwargs))
+        except Exception as error:
+            return _PmaxDoneFuture(error=error)
+
+    def map(self, fn, *iterables):
+        return [fn(*args) for args in zip(*iterables)]
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def pmax_executor(max_workers):
+    """
+    Thread pool running up to max_workers calls concurrently, or a serial
+    executor on Pythons without concurrent.futures
+    :param max_workers: (int) number of threads
+    :return: ThreadPoolExecutor or PmaxSerialExecutor
+    """
+    if HAS_FUTURES:
+        return ThreadPoolExecutor(max_workers=max_workers)
+    return PmaxSerialExecutor()
+
+
+def pmax_uri_template(url):
+    """
+    URI of a REST call with the version, array and object names collapsed,
+    e.g. /sloprovisioning/symmetrix/{array}/storagegroup/{id}
+    :param url: (str) URL or path of the call
+    :return: (str) URI template
+    """
+    path = urlsplit(url).path
+    if path.startswith('/univmax/restapi'):
+        path = path[len('/univmax/restapi'):]
+    path = re.sub(r'^/\d+(?=/)', '', path)
+    parts = path.strip('/').split('/')
+    for i in range(1, len(parts)):
+        if parts[i - 1] in _URI_COLLECTIONS:
+            parts[i] = '{array}' if parts[i - 1] in ('symmetrix', 'systems') \
+                else '{id}'
+    return '/' + '/'.join(parts)
+
+
+class PmaxTracer(object):
+    """
+    Records the REST calls of a module as Chrome trace events (chrome://
+    tracing, Perfetto), one complete event per call
+    """
+
+    def __init__(self, module_name):
+        """
+        :param module_name: (str) name of the module, category of the events
+        """
+        self.module_name = module_name
+        self.events = []
+        self._lock = threading.Lock()
+
+    def record(self, method, url, status, start, end, request_bytes=0,
+               response_bytes=0):
+        """
+        Add the event of one REST call
+        :param method: (str) HTTP method
+        :param url: (str) URL of the call
+        :param status: (int) HTTP status, None when no answer was received
+        :param start: (float) epoch time the call was sent
+        :param end: (float) epoch time the answer was received
+        :param request_bytes: (int) size of the payload sent
+        :param response_bytes: (int) size of the body received
+        :return: None
+        """
+        uri = pmax_uri_template(url)
+        event = {
+            'name': '{} {}'.format(method, uri),
+            'cat': self.module_name,
+            'ph': 'X',
+            'ts': int(start * 1e6),
+            'dur': int((end - start) * 1e6),
+            'pid': os.getpid(),
+            'tid': threading.current_thread().ident,
+            'args': {
+                'method': method,
+                'uri': uri,
+                'status': status,
+                'latency_ms': round((end - start) * 1000, 3),
+                'request_bytes': request_bytes,
+                'response_bytes': response_bytes,
+            },
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def write(self, path):
+        """
+        Append the events to a trace file in the JSON array format, the
+        closing bracket being optional the file stays loadable while every
+        task of a playbook appends to it
+        :param path: (str) trace file
+        :return: None
+        """
+        path = os.path.expanduser(path)
+        with open(path, 'a') as trace_file:
+            fcntl.flock(trace_file, fcntl.LOCK_EX)
+            try:
+                if trace_file.tell() == 0:
+                    trace_file.write('[\n')
+                for event in self.events:
+                    trace_file.write(json.dumps(event) + ',\n')
+            finally:
+                fcntl.flock(trace_file, fcntl.LOCK_UN)
+
+
+class PmaxRetryPolicy(object):
+    """
+    Retries of the REST calls of a module run. Throttled (429, 503) and lock
+    rejected calls are sent again for every method, connection failures for
+    reads only. Attempts are spaced by an exponential backoff with full
+    jitter, or by the Retry-After of the answer, and stop once the module has
+    slept for budget seconds in total.
+    """
+
+    def __init__(self, retries=5, backoff=1.0, budget=300):
+        """
+        :param retries: (int) attempts of a call on top of the first one
+        :param backoff: (float) base delay in seconds, doubled at each attempt
+        :param budget: (float) seconds of sleep allowed for the module run
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.budget = budget
+        self.attempts = 0
+        self.slept = 0.0
+        self.exhausted = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def retryable(method, response=None, error=None):
+        """
+        Whether a call can be sent again
+        :param method: (str) HTTP method of the call
+        :param response: requests response, None when the call raised
+        :param error: exception raised by the transport
+        :return: (bool)
+        """
+        if error is not None:
+            if isinstance(error, requests.exceptions.ConnectTimeout):
+                return True
+            return method in _IDEMPOTENT_METHODS and isinstance(
+                error, (requests.exceptions.ConnectionError,
+                        requests.exceptions.Timeout))
+        if response.status_code in RETRY_STATUSES:
+            return True
+        if response.status_code in (400, 409, 500):
+            return bool(_LOCK_ERROR.search(response.text or ''))
+        return False
+
+    @staticmethod
+    def retry_after(response):
+        """
+        Delay asked by the Retry-After header of an answer
+        :param response: requests response or None
+        :return: (float) seconds, None without a valid header
+        """
+        value = response.headers.get('Retry-After') \
+            if response is not None else None
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            date = parsedate_tz(value)
+            if date is None:
+                return None
+            return max(0.0, mktime_tz(date) - time.time())
+
+    def delay(self, attempt, response=None):
+        """
+        Reserve the wait before the next attempt of a call
+        :param attempt: (int) attempts already retried for the call
+        :param response: requests response of the last attempt or None
+        :return: (float) seconds to sleep, None when no retry is left
+        """
+        if attempt >= self.retries:
+            return None
+        delay = self.retry_after(response)
+        if delay is None:
+            delay = random.uniform(
+                0, min(MAX_RETRY_DELAY, self.backoff * 2 ** attempt))
+        with self._lock:
+            if self.slept + delay > self.budget:
+                self.exhausted = True
+                return None
+            self.slept += delay
+            self.attempts += 1
+        return delay
+
+    def as_dict(self):
+        """
+        Counters returned in the pmax_retries result
+        :return: (dict)
+        """
+        return {'retries': self.attempts,
+                'seconds': round(self.slept, 3),
+                'budget_exhausted': self.exhausted}
+
+
+def _resource_category(url):
+    """
+    Array and category of the objects a REST call is about, e.g.
+    ('000197600156', 'storagegroup') for
+    /sloprovisioning/symmetrix/000197600156/storagegroup/SG_1/...
+    :param url: (str) URL of the call
+    :return: (tuple) array serial and category, None when not found
+    """
+    parts = urlsplit(url).path.strip('/').split('/')
+    for i, part in enumerate(parts[:-1]):
+        if part in ('symmetrix', 'systems'):
+            category = parts[i + 2] if len(parts) > i + 2 else None
+            return parts[i + 1], _BULK_CATEGORIES.get(category, category)
+    return None, None
+
+
+class PmaxReadCache(object):
+    """
+    Read-through memoization of the GET calls of a module run. Identical
+    reads are answered from an LRU cache, concurrent ones are coalesced into
+    a single call. Writes drop the cached reads of the array they may have
+    changed, finished jobs drop the whole cache. Job and iterator calls are
+    never cached.
+    """
+
+    def __init__(self, max_entries=512, max_bytes=64 * 1024 * 1024):
+        """
+        :param max_entries: (int) responses kept
+        :param max_bytes: (int) total size of the bodies kept
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cacheable(request):
+        """
+        Whether the answer to a request can be memoized
+        :param request: requests prepared request
+        :return: (bool)
+        """
+        if request.method != 'GET':
+            return False
+        path = urlsplit(request.url).path
+        return '/system/job' not in path and '/common/Iterator' not in path
+
+    def get(self, request, send):
+        """
+        Answer a read from the cache, or through send, coalesced with the
+        same read of other threads
+        :param request: requests prepared request
+        :param send: callable sending the request, returns the response
+        :return: requests response
+        """
+        key = request.url
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = self._entries.pop(key)
+                self.hits += 1
+                return copy.copy(entry[0])
+            pending = self._pending.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._pending[key] = threading.Event()
+                self.misses += 1
+        if not leader:
+            pending.wait()
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self.coalesced += 1
+                    return copy.copy(entry[0])
+            # the leading call was not cacheable, send our own
+            return send()
+        try:
+            response = send()
+            self._store(key, response)
+            return response
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.set()
+
+    def _store(self, key, response):
+        """
+        Keep a successful answer, iterator pages excepted as the iterator
+        is released once read
+        """
+        if response.status_code != 200:
+            return
+        content = response.content or b''
+        if len(content) > self.max_bytes or b'"resultList"' in content:
+            return
+        with self._lock:
+            self._entries[key] = (copy.copy(response),
+                                  _resource_category(key), len(content))
+            self._bytes += len(content)
+            while len(self._entries) > self.max_entries or \
+                    self._bytes > self.max_bytes:
+                self._bytes -= self._entries.popitem(last=False)[1][2]
+
+    def invalidate(self, url):
+        """
+        Drop the cached reads a write to url may have made stale, writes
+        not about an array such as iterator deletes leave them all
+        :param url: (str) URL of the write
+        :return: None
+        """
+        array, category = _resource_category(url)
+        if array is None:
+            return
+        related = _MEMO_RELATED.get(category)
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                cached_array, cached_category = entry[1]
+                if cached_array in (array, None) and (
+                        related is None or cached_category in related):
+                    self._bytes -= entry[2]
+                    del self._entries[key]
+
+    def job_polled(self, response):
+        """
+        Drop the whole cache once a job has finished, its changes are not
+        known
+        :param response: requests response of a job read
+        :return: None
+        """
+        try:
+            status = response.json().get('status')
+        except (ValueError, AttributeError):
+            return
+        if status not in _JOB_RUNNING:
+            with self._lock:
+                self._entries.clear()
+                self._bytes = 0
+
+    def as_dict(self):
+        """
+        Counters returned in the pmax_read_cache result
+        :return: (dict)
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'coalesced': self.coalesced}
+
+
+def _add_exit_hook(module, hook):
+    """
+    Call hook with the result of the module, success or failure, before it
+    exits
+    :param module: Ansible module
+    :param hook: callable updating the result keyword arguments
+    :return: None
+    """
+    hooks = getattr(module, '_pmax_exit_hooks', None)
+    if hooks is None:
+        hooks = module._pmax_exit_hooks = []
+        exit_json = module.exit_json
+        fail_json = module.fail_json
+
+        def hooked_exit_json(**kwargs):
+            for func in hooks:
+                func(kwargs)
+            exit_json(**kwargs)
+
+        def hooked_fail_json(**kwargs):
+            for func in hooks:
+                func(kwargs)
+            fail_json(**kwargs)
+
+        module.exit_json = hooked_exit_json
+        module.fail_json = hooked_fail_json
+    hooks.append(hook)
+
+
+def _enable_trace(module, adapter):
+    """
+    Record the REST calls sent through the adapter and hand them over when
+    the module exits: pmax_trace result with trace, events appended to
+    trace_file with trace_file
+    :param module: Ansible module
+    :param adapter: PmaxHTTPAdapter
+    :return: None
+    """
+    tracer = PmaxTracer(getattr(module, '_name', 'dellemc_pmax'))
+    adapter.tracer = tracer
+
+    def _hand_over(kwargs):
+        if module.params['trace_file']:
+            try:
+                tracer.write(module.params['trace_file'])
+            except (IOError, OSError) as error:
+                module.warn('Cannot write trace file {}: {}'.format(
+                    module.params['trace_file'], error))
+        if module.params['trace']:
+            kwargs['pmax_trace'] = list(tracer.events)
+
+    _add_exit_hook(module, _hand_over)
+
+
+if HAS_REQUESTS:
+    class PmaxSessionAuth(requests.auth.AuthBase):
+        """
+        requests authentication handler reusing a cached Unisphere session.
+        Basic credentials are only sent when no session cookie is known,
+        a 401 answer to a cookie only request invalidates the cache and
+        replays the request with the credentials.
+        """
+
+        def __init__(self, username, password, cache, cookies=None):
+            self._basic = requests.auth.HTTPBasicAuth(username, password)
+            self._cache = cache
+            self._cookies = dict(cookies or {})
+
+        def __call__(self, request):
+            if not self._cookies or 'Cookie' not in request.headers:
+                self._basic(request)
+            request.register_hook('response', self._handle_response)
+            return request
+
+        def _handle_response(self, response, **kwargs):
+            if response.status_code == 401 and \
+                    'Authorization' not in response.request.headers:
+                self._cache.invalidate()
+                self._cookies = {}
+                # Consume the content so the connection can be released
+                response.content
+                response.close()
+                retry = response.request.copy()
+                retry.headers.pop('Cookie', None)
+                self._basic(retry)
+                new_response = response.connection.send(retry, **kwargs)
+                new_response.history.append(response)
+                new_response.request = retry
+                response = new_response
+
+            if response.cookies:
+                cookies = dict(self._cookies)
+                cookies.update(response.cookies.get_dict())
+                if cookies != self._cookies:
+                    self._cookies = cookies
+                    self._cache.save(cookies)
+            return response
+
+    class PmaxHTTPAdapter(requests.adapters.HTTPAdapter):
+        """
+        Pooled transport used by every request sent to Unisphere. Up to
+        pool_maxsize connections are kept open per host, threads asking for
+        more wait for a free connection rather than opening throw-away
+        sockets. Calls are retried following the retry policy and paced by
+        the rate limiter when one is set, reads are memoized in the read
+        cache when one is set.
+        """
+
+        def __init__(self, pool_maxsize=10, keep_alive=True,
+                     connect_timeout=None, read_timeout=None, retry=None,
+                     limiter=None, read_cache=None):
+            self._keep_alive = keep_alive
+            self._connect_timeout = connect_timeout
+            self._read_timeout = read_timeout
+            self.retry = retry or PmaxRetryPolicy(retries=0)
+            self.limiter = limiter
+            self.read_cache = read_cache
+            # PmaxTracer recording the calls, see _enable_trace
+            self.tracer = None
+            super(PmaxHTTPAdapter, self).__init__(pool_connections=1,
+                                                  pool_maxsize=pool_maxsize,
+                                                  pool_block=True)
+
+        def send(self, request, **kwargs):
+            if self._connect_timeout or self._read_timeout:
+                timeout = kwargs.get('timeout')
+                if isinstance(timeout, tuple):
+                    connect, read = timeout
+                else:
+                    connect = read = timeout
+                kwargs['timeout'] = (self._connect_timeout or connect,
+                                     self._read_timeout or read)
+            if not self._keep_alive:
+                request.headers['Connection'] = 'close'
+            if self.read_cache is None:
+                return self._send_retrying(request, **kwargs)
+            if self.read_cache.cacheable(request):
+                return self.read_cache.get(
+                    request, lambda: self._send_retrying(request, **kwargs))
+            if request.method == 'GET':
+                response = self._send_retrying(request, **kwargs)
+                if '/system/job' in request.url:
+                    self.read_cache.job_polled(response)
+                return response
+            try:
+                return self._send_retrying(request, **kwargs)
+            finally:
+                # A write that timed out may still be applied by Unisphere
+                self.read_cache.invalidate(request.url)
+
+        def _send_retrying(self, request, **kwargs):
+            """
+            Send a call, retried following the retry policy
+            """
+            attempt = 0
+            while True:
+                try:
+                    response = self._send(request, **kwargs)
+                except Exception as error:
+                    if not self.retry.retryable(request.method,
+                                                error=error):
+                        raise
+                    delay = self.retry.delay(attempt)
+                    if delay is None:
+                        raise
+                else:
+                    if not self.retry.retryable(request.method, response):
+                        break
+                    delay = self.retry.delay(attempt, response)
+                    if delay is None:
+                        break
+                    response.close()
+                time.sleep(delay)
+                attempt += 1
+            stats = getattr(_THREAD_STATE, 'stats', None)
+            if stats is not None:
+                stats.record(len(response.content or b''), retries=attempt)
+            return response
+
+        def _send(self, request, **kwargs):
+            """
+            Send one attempt of a call, traced when a tracer is set
+            """
+            if self.limiter is not None:
+                self.limiter.acquire()
+            start = time.time()
+            try:
+                response = super(PmaxHTTPAdapter, self).send(request,
+                                                             **kwargs)
+            except Exception:
+                if self.tracer is not None:
+                    self.tracer.record(request.method, request.url, None,
+                                       start, time.time(),
+                                       len(request.body or b''))
+                raise
+            if self.tracer is not None:
+                self.tracer.record(request.method, request.url,
+                                   response.status_code, start, time.time(),
+                                   len(request.body or b''),
+                                   len(response.content or b''))
+            return response
+
+
+def _mount_transport(module, conn):
+    """
+    Replace the default requests transport of the PyU4V REST session by
+    the pooled one configured from the module parameters
+    :param module: Ansible module
+    :param conn: PyU4V connection
+    :return: None
+    """
+    params = module.params
+    retry = PmaxRetryPolicy(retries=params['retries'],
+                            backoff=params['retry_backoff'],
+                            budget=params['retry_budget'])
+    read_cache = PmaxReadCache() if params['memoize_reads'] else None
+    limiter = None
+    if params['rate_limit']:
+        limiter = PmaxRateLimiter(params['rate_limit_dir'],
+                                  '{}:{}'.format(params['unispherehost'],
+                                                 params['unisphereport']),
+                                  params['rate_limit'], params['rate_burst'])
+    adapter = PmaxHTTPAdapter(pool_maxsize=params['pool_maxsize'],
+                              keep_alive=params['keep_alive'],
+                              connect_timeout=params['connect_timeout'],
+                              read_timeout=params['read_timeout'],
+                              retry=retry, limiter=limiter,
+                              read_cache=read_cache)
+    conn.rest_client.session.mount('https://', adapter)
+    conn.rest_client.session.mount('http://', adapter)
+    _add_exit_hook(module, lambda kwargs: kwargs.update(
+        pmax_retries=retry.as_dict()))
+    if limiter is not None:
+        _add_exit_hook(module, lambda kwargs: kwargs.update(
+            pmax_rate_limit=limiter.as_dict()))
+    if read_cache is not None:
+        _add_exit_hook(module, lambda kwargs: kwargs.update(
+            pmax_read_cache=read_cache.as_dict()))
+    if params['trace'] or params['trace_file']:
+        _enable_trace(module, adapter)
+
+
+def _enable_session_cache(module, conn, array_id):
+    """
+    Plug the controller side session cache into the PyU4V REST session
+    :param module: Ansible module
+    :param conn: PyU4V connection
+    :param array_id: (str) array serial number of the connection
+    :return: None
+    """
+    params = module.params
+    cache = PmaxSessionCache(params['session_cache_dir'],
+                             params['session_cache_ttl'],
+                             params['unispherehost'],
+                             array_id,
+                             params['user'])
+    cookies = cache.load()
+    session = conn.rest_client.session
+    if cookies:
+        requests.utils.add_dict_to_cookiejar(session.cookies, cookies)
+    session.auth = PmaxSessionAuth(params['user'], params['password'],
+                                   cache, cookies)
+
+
+class PmaxRestError(Exception):
+    """
+    Raised when Unisphere answers a raw REST call with an error status
+    """
+    pass
+
+
+def pmax_rest_get(conn, target_uri, params=None):
+    """
+    GET a Unisphere resource through the PyU4V REST session
+    :param conn: PyU4V connection
+    :param target_uri: (str) URI relative to /univmax/restapi
+    :param params: (dict) query parameters
+    :return: (dict) decoded response
+    """
+    response, status_code = conn.rest_client.rest_request(
+        target_uri, 'GET', params=params)
+    if status_code != 200:
+        raise PmaxRestError('GET {} returned {}: {}'.format(
+            target_uri, status_code, response))
+    return response or {}
+
+
+def pmax_rest_write(conn, target_uri, method, payload):
+    """
+    Send a write (POST, PUT) through the PyU4V REST session, for payloads
+    PyU4V has no method for
+    :param conn: PyU4V connection
+    :param target_uri: (str) URI relative to /univmax/restapi
+    :param method: (str) HTTP method
+    :param payload: (dict) request body
+    :return: (dict) decoded response, the job of an asynchronous write
+    """
+    response, status_code = conn.rest_client.rest_request(
+        target_uri, method, request_object=payload)
+    if status_code not in (200, 201, 202, 204):
+        raise PmaxRestError('{} {} returned {}: {}'.format(
+            method, target_uri, status_code, response))
+    return response or {}
+
+
+def pmax_wait_for_jobs(conn, universion, jobs, timeout=900, interval=0.5,
+                       max_interval=10):
+    """
+    Poll several asynchronous Unisphere jobs together until they have all
+    ended. The polling interval grows while jobs keep running so that long
+    jobs are not polled at the rate of short ones.
+    :param conn: PyU4V connection
+    :param universion: (int) Unisphere version
+    :param jobs: (list) job dicts returned when the jobs were submitted
+    :param timeout: (int) seconds to wait for the jobs
+    :param interval: (float) seconds before the first poll
+    :param max_interval: (float) longest interval between two polls
+    :return: (dict) job id -> last job details, status TIMEOUT for the jobs
+    still running at the timeout
+    """
+    done = {}
+    pending = {}
+    for job in jobs:
+        if not job or 'jobId' not in job:
+            continue
+        if job.get('status') in _JOB_RUNNING:
+            pending[job['jobId']] = job
+        else:
+            done[job['jobId']] = job
+    deadline = time.time() + timeout
+    while pending:
+        time.sleep(max(0, min(interval, deadline - time.time())))
+        for job_id in list(pending):
+            job = pmax_rest_get(conn, '/{}/system/job/{}'.format(universion,
+                                                                 job_id))
+            if job.get('status') not in _JOB_RUNNING:
+                done[job_id] = job
+                del pending[job_id]
+        if pending and time.time() >= deadline:
+            for job_id, job in pending.items():
+                done[job_id] = dict(job, status='TIMEOUT')
+            break
+        interval = min(max_interval, interval * 1.5)
+    return done
+
+
+def pmax_iterate(conn, target_uri, params=None):
+    """
+    Yield the items of a paged Unisphere list. Pages are read one at a time
+    through the iterator returned by the first call, so only one page is
+    held in memory, and the iterator is released at the end.
+    :param conn: PyU4V connection
+    :param target_uri: (str) URI of the list
+    :param params: (dict) query parameters (filters, select...)
+    :return: generator of the result items
+    """
+    response = pmax_rest_get(conn, target_uri, params)
+    count = int(response.get('count') or 0)
+    if not count:
+        return
+    iterator_id = response.get('id')
+    page_size = int(response.get('maxPageSize') or 1000)
+    page = response.get('resultList', {}).get('result', [])
+    del response
+    start = len(page) + 1
+    try:
+        while page:
+            for item in page:
+                yield item
+            if start > count or not iterator_id:
+                break
+            end = min(start + page_size - 1, count)
+            page = pmax_rest_get(
+                conn, '/common/Iterator/{}/page'.format(iterator_id),
+                {'from': start, 'to': end}).get('result', [])
+            start = end + 1
+    finally:
+        if iterator_id:
+            try:
+                conn.rest_client.rest_request(
+                    '/common/Iterator/{}'.format(iterator_id), 'DELETE')
+            except Exception:
+                # Iterators expire on their own on Unisphere side
+                pass
+
+
+def pmax_iter_objects(conn, array_id, universion, collection, key,
+                      filters=None, attributes=None):
+    """
+    Stream the details of the objects of a collection of an array from the
+    bulk endpoint, e.g. /systems/{array}/storage-groups
+    :param conn: PyU4V connection
+    :param array_id: (str) array serial number
+    :param universion: (int) Unisphere version, BULK_VOLUMES_UNIVERSION or
+    later
+    :param collection: (str) volumes, storage-groups, hosts, host-groups,
+    port-groups or masking-views
+    :param key: (str) identifier attribute of the objects, always returned
+    :param filters: (dict) Unisphere filters
+    :param attributes: (list) attributes to return, all when not set
+    :return: generator of detail dicts
+    """
+    params = dict(filters or {})
+    if attributes:
+        params['select'] = ','.join(
+            [key] + [a for a in attributes if a != key])
+    return pmax_iterate(
+        conn, '/{}/systems/{}/{}'.format(universion, array_id, collection),
+        params)
+
+
+def pmax_iter_volumes(conn, array_id, universion, filters=None,
+                      attributes=None):
+    """
+    Stream the details of the volumes of an array from the bulk volume
+    endpoint, tens of calls for an array of 64k volumes instead of one GET
+    per volume.
+    :param conn: PyU4V connection
+    :param array_id: (str) array serial number
+    :param universion: (int) Unisphere version, BULK_VOLUMES_UNIVERSION or
+    later
+    :param filters: (dict) Unisphere filters, e.g. {'storageGroupId': 'SG'}
+    :param attributes: (list) attributes to return, all when not set
+    :return: generator of volume detail dicts
+    """
+    return pmax_iter_objects(conn, array_id, universion, 'volumes',
+                             'volumeId', filters, attributes)
+
+
+def _shared_session(module):
+    """
+    REST session of a connection already opened by this process to the same
+    Unisphere host with the same user, if any
+    :param module: Ansible module
+    :return: requests session or None
+    """
+    for (host, array_id, user), conn in _CONNECTIONS.items():
+        if host == module.params['unispherehost'] and \
+                user == module.params['user']:
+            return conn.rest_client.session
+    return None
+
+
+def pmaxapi(module, array_id=None):
+    """
+    PyU4V connection to an array, connections to several arrays of the same
+    Unisphere share a single REST session, so its connection pool and its
+    authentication
+    :param module: Ansible module
+    :param array_id: (str) array serial number, defaults to the array_id
+    parameter
+    :return: PyU4V connection
+    """
+    if array_id is None:
+        array_id = module.params['array_id']
     try:
         import PyU4V
         HAS_PyU4V = True
@@ -26,11 +1245,23 @@ def pmaxapi(module):
         module.fail_json(msg='PyU4V 3.0.0.9 or higher is required for this '
                              'module')
     else:
+        key = (module.params['unispherehost'], array_id,
+               module.params['user'])
+        if key in _CONNECTIONS:
+            return _CONNECTIONS[key]
         conn = PyU4V.U4VConn(server_ip=module.params['unispherehost'],
-                             port=8443,
-                             array_id=module.params['array_id'],
+                             port=module.params['unisphereport'],
+                             array_id=array_id,
                              verify=module.params['verifycert'],
                              username=module.params['user'],
                              password=module.params['password'],
                              u4v_version=module.params['universion'])
+        session = _shared_session(module)
+        if session is not None:
+            conn.rest_client.session = session
+        elif HAS_REQUESTS:
+            _mount_transport(module, conn)
+            if module.params['session_cache']:
+                _enable_session_cache(module, conn, array_id)
+        _CONNECTIONS[key] = conn
     return conn
@@ -0,0 +1,1526 @@
+#!/usr/bin/env python
+# coding: utf-8
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Local stand-in for the Unisphere for PowerMax REST API.
+
+The simulator keeps an in-memory model of one or more arrays (storage
+groups, volumes, hosts, host groups, port groups, masking views, snapshots
+and RDF groups) and answers the REST calls issued by PyU4V, so that every
+module of this repository can be run, benchmarked and regression tested
+without a real array.
+
+    python simulator/unisphere_simulator.py --port 8443 --volumes 65536 \\
+        --storage-groups 512 --latency 0.02
+
+Point the playbooks at it with unispherehost 127.0.0.1, unisphereport 8443
+and verifycert false (see simulator/vars.yml). A self signed certificate
+is generated with the openssl command unless --certfile/--keyfile are given.
+
+Two extra endpoints, outside of the Unisphere API, expose the calls served:
+GET /simulator/stats and POST /simulator/reset.
+"""
+
+import argparse
+import base64
+import itertools
+import json
+import os
+import re
+import shutil
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qsl, unquote
+
+API_ROOT = '/univmax/restapi'
+MAX_PAGE_SIZE = 1000
+SLOS = ['Diamond', 'Platinum', 'Gold', 'Silver', 'Bronze', 'Optimized']
+CAPACITY_UNITS = {'MB': 1.0 / 1024, 'GB': 1.0, 'TB': 1024.0,
+                  'CYL': 1.875 / 1024}
+SRDF_STATES = {'Establish': 'Synchronized', 'Resume': 'Synchronized',
+               'Suspend': 'Suspended', 'Split': 'Split',
+               'Failover': 'Failed Over', 'Failback': 'Synchronized'}
+
+
+class SimulatorError(Exception):
+    """
+    Error answered to the client with the given HTTP status
+    """
+
+    def __init__(self, status, message):
+        super(SimulatorError, self).__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _match_filter(value, expression):
+    """
+    Evaluate a Unisphere query filter against an attribute value
+    :param value: attribute value (scalar or list)
+    :param expression: (str) filter such as 'SG', '<like>ORA', '>10'
+    :return: (bool) True if the value satisfies the filter
+    """
+    if isinstance(value, list):
+        return any(_match_filter(v, expression) for v in value)
+    if value is None:
+        return False
+    if expression.startswith('<like>'):
+        return expression[6:].lower() in str(value).lower()
+    if expression[:1] in ('>', '<') and not isinstance(value, str):
+        try:
+            threshold = float(expression[1:])
+        except ValueError:
+            return False
+        if expression[0] == '>':
+            return float(value) > threshold
+        return float(value) < threshold
+    if isinstance(value, bool):
+        return str(value).lower() == expression.lower()
+    return str(value) == expression
+
+
+def _filter_items(items, filters):
+    """
+    Keep the detail dicts matching every filter
+    :param items: iterable of detail dicts
+    :param filters: (dict) Unisphere query filters
+    :return: (list) matching detail dicts
+    """
+    return [i for i in items
+            if all(_match_filter(i.get(k), v) for k, v in filters.items())]
+
+
+def _volume_requests(param):
+    """
+    Extract the new volume requests from the different payload layouts
+    used by the Unisphere versions (volumeAttribute or volumeAttributes)
+    :param param: (dict) addVolumeParam or sloBasedStorageGroupParam entry
+    :return: (list) of (num_of_vols, cap_gb, label) tuples
+    """
+    attributes = param.get('volumeAttributes')
+    if not attributes:
+        attributes = [dict(param.get('volumeAttribute') or {},
+                           num_of_vols=param.get('num_of_vols', 0),
+                           volumeIdentifier=param.get('volumeIdentifier'))]
+    requests = []
+    for attribute in attributes:
+        num = int(attribute.get('num_of_vols', 0) or 0)
+        if not num:
+            continue
+        unit = attribute.get('capacityUnit', 'GB')
+        cap_gb = float(attribute.get('volume_size', 0)) * \
+            CAPACITY_UNITS.get(unit, 1.0)
+        identifier = attribute.get('volumeIdentifier') or \
+            param.get('volumeIdentifier') or {}
+        requests.append((num, cap_gb, identifier.get('identifier_name')))
+    return requests
+
+
+class ArrayModel(object):
+    """
+    In-memory model of one PowerMax array
+    """
+
+    def __init__(self, array_id, srp='SRP_1'):
+        self.array_id = array_id
+        self.srp = srp
+        self.volumes = {}
+        self.storage_groups = {}
+        self.hosts = {}
+        self.host_groups = {}
+        self.port_groups = {}
+        self.masking_views = {}
+        self.snapshots = {}
+        self.rdf_groups = {}
+        self.ports = ['FA-{}D:{}'.format(d, p) for d in (1, 2, 3, 4)
+                      for p in (4, 5, 6, 7)]
+        self._next_volume = 1
+
+    # Volumes -----------------------------------------------------------
+
+    def new_volume(self, cap_gb, label=None):
+        volume_id = '{:05X}'.format(self._next_volume)
+        self._next_volume += 1
+        self.volumes[volume_id] = {'cap_gb': float(cap_gb), 'label': label,
+                                   'sgs': [], 'allocated': 0.0, 'rdf': []}
+        return volume_id
+
+    def volume_detail(self, volume_id):
+        vol = self._get(self.volumes, volume_id, 'Volume')
+        wwn = '60000970000{}5330{}'.format(self.array_id[-7:],
+                                           volume_id.encode('utf-8').hex()
+                                           .upper())[:32]
+        detail = {
+            'volumeId': volume_id,
+            'type': 'TDEV',
+            'emulation': 'FBA',
+            'ssid': 'FFFFFFFF',
+            'allocated_percent': vol['allocated'],
+            'cap_gb': round(vol['cap_gb'], 2),
+            'cap_mb': round(vol['cap_gb'] * 1024, 2),
+            'cap_cyl': int(vol['cap_gb'] * 1024 / 1.875),
+            'status': 'Ready',
+            'reserved': False,
+            'pinned': False,
+            'physical_name': 'Not Visible',
+            'wwn': wwn,
+            'effective_wwn': wwn,
+            'encapsulated': False,
+            'num_of_storage_groups': len(vol['sgs']),
+            'num_of_front_end_paths': 0,
+            'snapvx_source': False,
+            'snapvx_target': False,
+        }
+        if vol['label']:
+            detail['volume_identifier'] = vol['label']
+        if vol['sgs']:
+            detail['storageGroupId'] = list(vol['sgs'])
+        if vol['rdf']:
+            detail['rdfGroupId'] = [{'rdf_group_number': n}
+                                    for n in vol['rdf']]
+        return detail
+
+    def list_volumes(self, filters):
+        filters = dict(filters)
+        sg = filters.pop('storageGroupId', None)
+        if sg is not None and not sg.startswith('<like>'):
+            candidates = self.storage_groups.get(sg, {}).get('volumes', [])
+        else:
+            candidates = sorted(self.volumes)
+            if sg is not None:
+                filters['storageGroupId'] = sg
+        if not filters:
+            return list(candidates)
+        return [v['volumeId'] for v in
+                _filter_items((self.volume_detail(i) for i in candidates),
+                              filters)]
+
+    def modify_volume(self, volume_id, payload):
+        vol = self._get(self.volumes, volume_id, 'Volume')
+        action = payload.get('editVolumeActionParam', {})
+        if 'expandVolumeParam' in action:
+            attribute = action['expandVolumeParam'].get('volumeAttribute', {})
+            new_size = float(attribute.get('volume_size', 0)) * \
+                CAPACITY_UNITS.get(attribute.get('capacityUnit', 'GB'), 1.0)
+            if new_size <= vol['cap_gb']:
+                raise SimulatorError(400, 'New size must be greater than the '
+                                          'current size')
+            vol['cap_gb'] = new_size
+        if 'modifyVolumeIdentifierParam' in action:
+            identifier = action['modifyVolumeIdentifierParam'].get(
+                'volumeIdentifier', {})
+            vol['label'] = identifier.get('identifier_name')
+        if 'freeVolumeParam' in action:
+            if vol['allocated'] == 0.0:
+                raise SimulatorError(400, 'The device is already in the '
+                                          'requested state')
+            vol['allocated'] = 0.0
+        return self.volume_detail(volume_id)
+
+    def delete_volume(self, volume_id):
+        vol = self._get(self.volumes, volume_id, 'Volume')
+        if vol['sgs']:
+            raise SimulatorError(400, 'Volume {} is in storage group(s) {}'
+                                 .format(volume_id, ', '.join(vol['sgs'])))
+        del self.volumes[volume_id]
+
+    # Storage groups ----------------------------------------------------
+
+    def sg_detail(self, name):
+        sg = self._get(self.storage_groups, name, 'Storage Group')
+        volumes = sg['volumes']
+        for child in sg['children']:
+            volumes = volumes + self.storage_groups[child]['volumes']
+        detail = {
+            'storageGroupId': name,
+            'slo': sg['slo'] or 'NONE',
+            'service_level': sg['slo'] or 'NONE',
+            'base_slo_name': sg['slo'] or 'NONE',
+            'srp': sg['srp'] or 'NONE',
+            'compression': sg['compression'],
+            'num_of_vols': len(volumes),
+            'num_of_child_sgs': len(sg['children']),
+            'num_of_parent_sgs': len(sg['parents']),
+            'num_of_masking_views': len(self._sg_masking_views(name)),
+            'num_of_snapshots': len(self.snapshots.get(name, {})),
+            'cap_gb': round(sum(self.volumes[v]['cap_gb']
+                                for v in volumes), 2),
+            'device_emulation': 'FBA',
+            'type': 'Parent' if sg['children'] else
+                    'Child' if sg['parents'] else 'Standalone',
+            'unprotected': not self.snapshots.get(name),
+        }
+        if sg['children']:
+            detail['child_storage_group'] = list(sg['children'])
+        if sg['parents']:
+            detail['parent_storage_group'] = list(sg['parents'])
+        mvs = self._sg_masking_views(name)
+        if mvs:
+            detail['maskingview'] = mvs
+        return detail
+
+    def _sg_masking_views(self, name):
+        names = [name] + self.storage_groups.get(name, {}).get('parents', [])
+        return sorted(mv for mv, d in self.masking_views.items()
+                      if d['storageGroupId'] in names)
+
+    def create_sg(self, payload):
+        name = payload.get('storageGroupId')
+        if not name:
+            raise SimulatorError(400, 'storageGroupId is required')
+        if name in self.storage_groups:
+            raise SimulatorError(409, 'Storage Group {} already exists'
+                                 .format(name))
+        params = payload.get('sloBasedStorageGroupParam') or [{}]
+        slo = params[0].get('sloId')
+        srp = payload.get('srpId')
+        if srp in (None, 'None', 'NONE'):
+            srp, slo = None, None
+        self.storage_groups[name] = {
+            'slo': None if slo in (None, 'None', 'NONE') else slo,
+            'srp': srp,
+            'compression': bool(srp) and not params[0].get('noCompression',
+                                                           False),
+            'volumes': [], 'children': [], 'parents': []}
+        for param in params:
+            for num, cap_gb, label in _volume_requests(param):
+                self._add_new_volumes(name, num, cap_gb, label)
+        return self.sg_detail(name)
+
+    def _add_new_volumes(self, name, num, cap_gb, label):
+        for _ in range(num):
+            volume_id = self.new_volume(cap_gb, label)
+            self._add_volume_to_sg(name, volume_id)
+
+    def _add_volume_to_sg(self, name, volume_id):
+        vol = self._get(self.volumes, volume_id, 'Volume')
+        sg = self.storage_groups[name]
+        if name not in vol['sgs']:
+            vol['sgs'].append(name)
+            sg['volumes'].append(volume_id)
+
+    def _remove_volume_from_sg(self, name, volume_id):
+        vol = self._get(self.volumes, volume_id, 'Volume')
+        sg = self.storage_groups[name]
+        if name not in vol['sgs']:
+            raise SimulatorError(400, 'Volume {} is not in {}'
+                                 .format(volume_id, name))
+        vol['sgs'].remove(name)
+        sg['volumes'].remove(volume_id)
+
+    def modify_sg(self, name, payload):
+        sg = self._get(self.storage_groups, name, 'Storage Group')
+        action = payload.get('editStorageGroupActionParam', {})
+        expand = action.get('expandStorageGroupParam', {})
+        if 'addVolumeParam' in expand or 'addSpecificVolumeParam' in expand \
+                or 'addExistingStorageGroupParam' in expand:
+            if sg['children'] and 'addExistingStorageGroupParam' \
+                    not in expand:
+                raise SimulatorError(400, 'Cannot add volumes to parent '
+                                          'storage group {}'.format(name))
+        if 'addVolumeParam' in expand:
+            for num, cap_gb, label in _volume_requests(
+                    expand['addVolumeParam']):
+                self._add_new_volumes(name, num, cap_gb, label)
+        if 'addSpecificVolumeParam' in expand:
+            volume_ids = expand['addSpecificVolumeParam'].get('volumeId', [])
+            if not isinstance(volume_ids, list):
+                volume_ids = [volume_ids]
+            for volume_id in volume_ids:
+                self._add_volume_to_sg(name, volume_id)
+        if 'addExistingStorageGroupParam' in expand:
+            for child in expand['addExistingStorageGroupParam'] \
+                    .get('storageGroupId', []):
+                child_sg = self._get(self.storage_groups, child,
+                                     'Storage Group')
+                if child not in sg['children']:
+                    sg['children'].append(child)
+                    child_sg['parents'].append(name)
+        if 'removeVolumeParam' in action:
+            volume_ids = action['removeVolumeParam'].get('volumeId', [])
+            if not isinstance(volume_ids, list):
+                volume_ids = [volume_ids]
+            for volume_id in volume_ids:
+                self._remove_volume_from_sg(name, volume_id)
+        if 'removeStorageGroupParam' in action:
+            for child in action['removeStorageGroupParam'] \
+                    .get('storageGroupId', []):
+                if child in sg['children']:
+                    sg['children'].remove(child)
+                    self.storage_groups[child]['parents'].remove(name)
+        if 'moveVolumeToStorageGroupParam' in action:
+            move = action['moveVolumeToStorageGroupParam']
+            target = move.get('storageGroupId')
+            self._get(self.storage_groups, target, 'Storage Group')
+            volume_ids = move.get('volumeId', [])
+            if not isinstance(volume_ids, list):
+                volume_ids = [volume_ids]
+            for volume_id in volume_ids:
+                self._remove_volume_from_sg(name, volume_id)
+                self._add_volume_to_sg(target, volume_id)
+        if 'editStorageGroupSLOParam' in action:
+            slo = action['editStorageGroupSLOParam'].get('sloId')
+            if slo not in SLOS + ['NONE', 'None']:
+                raise SimulatorError(400, 'Invalid SLO {}'.format(slo))
+            sg['slo'] = None if slo in ('NONE', 'None') else slo
+        if 'editStorageGroupSRPParam' in action:
+            sg['srp'] = action['editStorageGroupSRPParam'].get('srpId')
+        if 'editCompressionParam' in action:
+            sg['compression'] = bool(
+                action['editCompressionParam'].get('compression'))
+        if 'renameStorageGroupParam' in action:
+            new_name = action['renameStorageGroupParam'] \
+                .get('new_storage_Group_name')
+            if new_name in self.storage_groups:
+                raise SimulatorError(409, 'Storage Group {} already exists'
+                                     .format(new_name))
+            self._rename_sg(name, new_name)
+            name = new_name
+        return self.sg_detail(name)
+
+    def _rename_sg(self, name, new_name):
+        sg = self.storage_groups.pop(name)
+        self.storage_groups[new_name] = sg
+        for volume_id in sg['volumes']:
+            sgs = self.volumes[volume_id]['sgs']
+            sgs[sgs.index(name)] = new_name
+        for other in self.storage_groups.values():
+            for key in ('children', 'parents'):
+                if name in other[key]:
+                    other[key][other[key].index(name)] = new_name
+        for mv in self.masking_views.values():
+            if mv['storageGroupId'] == name:
+                mv['storageGroupId'] = new_name
+        if name in self.snapshots:
+            self.snapshots[new_name] = self.snapshots.pop(name)
+
+    def delete_sg(self, name):
+        sg = self._get(self.storage_groups, name, 'Storage Group')
+        if self._sg_masking_views(name):
+            raise SimulatorError(400, 'Storage Group {} is part of a masking '
+                                      'view'.format(name))
+        for volume_id in list(sg['volumes']):
+            self._remove_volume_from_sg(name, volume_id)
+        for child in sg['children']:
+            self.storage_groups[child]['parents'].remove(name)
+        for parent in sg['parents']:
+            self.storage_groups[parent]['children'].remove(name)
+        del self.storage_groups[name]
+        self.snapshots.pop(name, None)
+
+    # Hosts and host groups ---------------------------------------------
+
+    def host_detail(self, name):
+        host = self._get(self.hosts, name, 'Host')
+        groups = sorted(g for g, d in self.host_groups.items()
+                        if name in d['hosts'])
+        mvs = sorted(mv for mv, d in self.masking_views.items()
+                     if d.get('hostId') == name or
+                     d.get('hostGroupId') in groups)
+        detail = {
+            'hostId': name,
+            'num_of_masking_views': len(mvs),
+            'num_of_initiators': len(host['initiators']),
+            'num_of_host_groups': len(groups),
+            'num_of_powerpath_hosts': 0,
+            'port_flags_override': bool(host['flags']),
+            'consistent_lun': False,
+            'enabled_flags': '',
+            'disabled_flags': '',
+            'type': 'Fibre',
+            'bw_limit': 0,
+        }
+        if host['initiators']:
+            detail['initiator'] = list(host['initiators'])
+        if mvs:
+            detail['maskingview'] = mvs
+        if groups:
+            detail['hostgroup'] = groups
+        return detail
+
+    def create_host(self, payload):
+        name = payload.get('hostId')
+        if name in self.hosts:
+            raise SimulatorError(409, 'Host {} already exists'.format(name))
+        initiators = [i.lower() for i in payload.get('initiatorId', [])]
+        for initiator in initiators:
+            self._check_initiator_free(initiator)
+        self.hosts[name] = {'initiators': initiators,
+                            'flags': payload.get('hostFlags') or {}}
+        return self.host_detail(name)
+
+    def _check_initiator_free(self, initiator):
+        for host, detail in self.hosts.items():
+            if initiator in detail['initiators']:
+                raise SimulatorError(400, 'Initiator {} is already in host {}'
+                                     .format(initiator, host))
+
+    def modify_host(self, name, payload):
+        host = self._get(self.hosts, name, 'Host')
+        action = payload.get('editHostActionParam', {})
+        if 'addInitiatorParam' in action:
+            for initiator in action['addInitiatorParam'].get('initiator', []):
+                self._check_initiator_free(initiator.lower())
+                host['initiators'].append(initiator.lower())
+        if 'removeInitiatorParam' in action:
+            for initiator in action['removeInitiatorParam'] \
+                    .get('initiator', []):
+                if initiator.lower() in host['initiators']:
+                    host['initiators'].remove(initiator.lower())
+        if 'setHostFlagsParam' in action:
+            host['flags'] = action['setHostFlagsParam'].get('hostFlags', {})
+        if 'renameHostParam' in action:
+            new_name = action['renameHostParam'].get('new_host_name')
+            if new_name in self.hosts:
+                raise SimulatorError(409, 'Host {} already exists'
+                                     .format(new_name))
+            self.hosts[new_name] = self.hosts.pop(name)
+            for group in self.host_groups.values():
+                if name in group['hosts']:
+                    group['hosts'][group['hosts'].index(name)] = new_name
+            for mv in self.masking_views.values():
+                if mv.get('hostId') == name:
+                    mv['hostId'] = new_name
+            name = new_name
+        return self.host_detail(name)
+
+    def delete_host(self, name):
+        self._get(self.hosts, name, 'Host')
+        if self.host_detail(name).get('maskingview'):
+            raise SimulatorError(400, 'Host {} is part of a masking view'
+                                 .format(name))
+        for group in self.host_groups.values():
+            if name in group['hosts']:
+                group['hosts'].remove(name)
+        del self.hosts[name]
+
+    def host_group_detail(self, name):
+        group = self._get(self.host_groups, name, 'Host Group')
+        mvs = sorted(mv for mv, d in self.masking_views.items()
+                     if d.get('hostGroupId') == name)
+        detail = {
+            'hostGroupId': name,
+            'num_of_hosts': len(group['hosts']),
+            'num_of_initiators': sum(len(self.hosts[h]['initiators'])
+                                     for h in group['hosts']),
+            'num_of_masking_views': len(mvs),
+            'port_flags_override': False,
+            'consistent_lun': False,
+            'type': 'Fibre',
+            'host': [{'hostId': h,
+                      'initiator': list(self.hosts[h]['initiators'])}
+                     for h in group['hosts']],
+        }
+        if mvs:
+            detail['maskingview'] = mvs
+        return detail
+
+    def create_host_group(self, payload):
+        name = payload.get('hostGroupId')
+        if name in self.host_groups or name in self.hosts:
+            raise SimulatorError(409, 'Host Group {} already exists'
+                                 .format(name))
+        hosts = payload.get('hostId', [])
+        for host in hosts:
+            self._get(self.hosts, host, 'Host')
+        self.host_groups[name] = {'hosts': list(hosts)}
+        return self.host_group_detail(name)
+
+    def modify_host_group(self, name, payload):
+        group = self._get(self.host_groups, name, 'Host Group')
+        action = payload.get('editHostGroupActionParam', {})
+        if 'addHostParam' in action:
+            for host in action['addHostParam'].get('host', []):
+                self._get(self.hosts, host, 'Host')
+                if host not in group['hosts']:
+                    group['hosts'].append(host)
+        if 'removeHostParam' in action:
+            for host in action['removeHostParam'].get('host', []):
+                if host in group['hosts']:
+                    group['hosts'].remove(host)
+        if 'renameHostGroupParam' in action:
+            new_name = action['renameHostGroupParam'] \
+                .get('new_host_group_name')
+            self.host_groups[new_name] = self.host_groups.pop(name)
+            for mv in self.masking_views.values():
+                if mv.get('hostGroupId') == name:
+                    mv['hostGroupId'] = new_name
+            name = new_name
+        return self.host_group_detail(name)
+
+    def delete_host_group(self, name):
+        if self.host_group_detail(name).get('maskingview'):
+            raise SimulatorError(400, 'Host Group {} is part of a masking '
+                                      'view'.format(name))
+        del self.host_groups[name]
+
+    # Port groups -------------------------------------------------------
+
+    def port_group_detail(self, name):
+        group = self._get(self.port_groups, name, 'Port Group')
+        mvs = sorted(mv for mv, d in self.masking_views.items()
+                     if d['portGroupId'] == name)
+        detail = {
+            'portGroupId': name,
+            'num_of_ports': len(group['ports']),
+            'num_of_masking_views': len(mvs),
+            'type': 'Fibre',
+            # Unisphere 9.0 reports the portId of port group members as
+            # FA-1D:4 and not 4, the modules expect that format
+            'symmetrixPortKey': [{'directorId': p.split(':')[0],
+                                  'portId': p} for p in group['ports']],
+        }
+        if mvs:
+            detail['maskingview'] = mvs
+        return detail
+
+    def _port_keys(self, keys):
+        ports = []
+        for key in keys:
+            port = '{}:{}'.format(key.get('directorId'), key.get('portId'))
+            if port not in self.ports:
+                raise SimulatorError(404, 'Port {} not found'.format(port))
+            ports.append(port)
+        return ports
+
+    def create_port_group(self, payload):
+        name = payload.get('portGroupId')
+        if name in self.port_groups:
+            raise SimulatorError(409, 'Port Group {} already exists'
+                                 .format(name))
+        self.port_groups[name] = {
+            'ports': self._port_keys(payload.get('symmetrixPortKey', []))}
+        return self.port_group_detail(name)
+
+    def modify_port_group(self, name, payload):
+        group = self._get(self.port_groups, name, 'Port Group')
+        action = payload.get('editPortGroupActionParam', {})
+        if 'addPortParam' in action:
+            for port in self._port_keys(action['addPortParam']
+                                        .get('port', [])):
+                if port not in group['ports']:
+                    group['ports'].append(port)
+        if 'removePortParam' in action:
+            for port in self._port_keys(action['removePortParam']
+                                        .get('port', [])):
+                if port in group['ports']:
+                    group['ports'].remove(port)
+        if 'renamePortGroupParam' in action:
+            new_name = action['renamePortGroupParam'] \
+                .get('new_port_group_name')
+            self.port_groups[new_name] = self.port_groups.pop(name)
+            for mv in self.masking_views.values():
+                if mv['portGroupId'] == name:
+                    mv['portGroupId'] = new_name
+            name = new_name
+        return self.port_group_detail(name)
+
+    def delete_port_group(self, name):
+        if self.port_group_detail(name).get('maskingview'):
+            raise SimulatorError(400, 'Port Group {} is part of a masking '
+                                      'view'.format(name))
+        del self.port_groups[name]
+
+    def port_detail(self, director, port):
+        key = '{}:{}'.format(director, port)
+        if key not in self.ports:
+            raise SimulatorError(404, 'Port {} not found'.format(key))
+        return {'symmetrixPort': {
+            'symmetrixPortKey': {'directorId': director, 'portId': port},
+            'port_status': 'ON', 'director_status': 'Online',
+            'type': 'FibreChannel (563)', 'num_of_cores': 6,
+            'identifier': '5000097300{:06x}'.format(self.ports.index(key)),
+            'num_of_port_groups': len([g for g in self.port_groups.values()
+                                       if key in g['ports']]),
+            'num_of_masking_views': 0, 'num_of_mapped_vols': 0}}
+
+    # Masking views -----------------------------------------------------
+
+    def masking_view_detail(self, name):
+        return dict(self._get(self.masking_views, name, 'Masking View'),
+                    maskingViewId=name)
+
+    def create_masking_view(self, payload):
+        name = payload.get('maskingViewId')
+        if name in self.masking_views:
+            raise SimulatorError(409, 'Masking View {} already exists'
+                                 .format(name))
+        mv = {}
+        host_selection = payload.get('hostOrHostGroupSelection', {})
+        if 'useExistingHostParam' in host_selection:
+            mv['hostId'] = host_selection['useExistingHostParam']['hostId']
+            self._get(self.hosts, mv['hostId'], 'Host')
+        elif 'useExistingHostGroupParam' in host_selection:
+            mv['hostGroupId'] = host_selection['useExistingHostGroupParam'][
+                'hostGroupId']
+            self._get(self.host_groups, mv['hostGroupId'], 'Host Group')
+        else:
+            raise SimulatorError(400, 'A host or host group is required')
+        mv['portGroupId'] = payload.get('portGroupSelection', {}) \
+            .get('useExistingPortGroupParam', {}).get('portGroupId')
+        self._get(self.port_groups, mv['portGroupId'], 'Port Group')
+        mv['storageGroupId'] = payload.get('storageGroupSelection', {}) \
+            .get('useExistingStorageGroupParam', {}).get('storageGroupId')
+        self._get(self.storage_groups, mv['storageGroupId'],
+                  'Storage Group')
+        self.masking_views[name] = mv
+        return self.masking_view_detail(name)
+
+    def modify_masking_view(self, name, payload):
+        self._get(self.masking_views, name, 'Masking View')
+        rename = payload.get('editMaskingViewActionParam', {}) \
+            .get('renameMaskingViewParam', {})
+        if rename:
+            new_name = rename.get('new_masking_view_name')
+            self.masking_views[new_name] = self.masking_views.pop(name)
+            name = new_name
+        return self.masking_view_detail(name)
+
+    def masking_view_connections(self, name):
+        mv = self._get(self.masking_views, name, 'Masking View')
+        if 'hostId' in mv:
+            initiators = self.hosts[mv['hostId']]['initiators']
+        else:
+            initiators = [i for h in self.host_groups[mv['hostGroupId']]
+                          ['hosts'] for i in self.hosts[h]['initiators']]
+        ports = self.port_groups[mv['portGroupId']]['ports']
+        volumes = self.storage_groups[mv['storageGroupId']]['volumes']
+        return {'maskingViewConnection': [
+            {'volumeId': v, 'host_lun_address': '{:04X}'.format(n),
+             'cap_gb': self.volumes[v]['cap_gb'], 'initiatorId': i,
+             'alias': i, 'dir_port': p, 'logged_in': True, 'on_fabric': True}
+            for n, v in enumerate(volumes) for i in initiators
+            for p in ports]}
+
+    # Snapshots ---------------------------------------------------------
+
+    def create_snapshot(self, sg_name, payload):
+        self._get(self.storage_groups, sg_name, 'Storage Group')
+        name = payload.get('snapshotName')
+        generations = self.snapshots.setdefault(sg_name, {}).setdefault(
+            name, [])
+        for generation in generations:
+            generation['generation'] += 1
+        generations.insert(0, {
+            'generation': 0, 'name': name, 'isLinked': False,
+            'isRestored': False, 'isExpired': False,
+            'timestamp': time.strftime('%H:%M:%S %a, %d %b %Y UTC +0000',
+                                       time.gmtime()),
+            'timeToLive': payload.get('timeToLive', 0),
+            'linkedStorageGroup': [], 'state': ['Established']})
+        return self.snapshot_generation(sg_name, name, 0)
+
+    def snapshot_generation(self, sg_name, name, generation):
+        for entry in self.snapshots.get(sg_name, {}).get(name, []):
+            if entry['generation'] == int(generation):
+                volumes = self.storage_groups[sg_name]['volumes']
+                return dict(entry, numSourceVolumes=len(volumes),
+                            numStorageGroupVolumes=len(volumes),
+                            numSharedTracks=0, numUniqueTracks=0,
+                            sourceVolume=[{'name': v, 'capacity': int(
+                                self.volumes[v]['cap_gb'] * 1024 / 1.875)}
+                                for v in volumes])
+        raise SimulatorError(404, 'Snapshot {} generation {} not found on {}'
+                             .format(name, generation, sg_name))
+
+    def modify_snapshot(self, sg_name, name, generation, payload):
+        self.snapshot_generation(sg_name, name, generation)
+        entry = [e for e in self.snapshots[sg_name][name]
+                 if e['generation'] == int(generation)][0]
+        action = str(payload.get('action', '')).lower()
+        target = None
+        for value in payload.values():
+            if isinstance(value, dict):
+                for key, sub in value.items():
+                    if key.lower().endswith('storagegroupname'):
+                        target = sub
+        if action in ('link', 'relink'):
+            self._get(self.storage_groups, target, 'Storage Group')
+            if action == 'link' and target in [
+                    e['name'] for e in entry['linkedStorageGroup']]:
+                raise SimulatorError(400, 'Target {} already linked'
+                                     .format(target))
+            if action == 'link':
+                entry['linkedStorageGroup'].append({
+                    'name': target, 'percentageCopied': 100,
+                    'linkedCreationTimestamp': entry['timestamp']})
+            entry['isLinked'] = True
+        elif action == 'unlink':
+            entry['linkedStorageGroup'] = [
+                e for e in entry['linkedStorageGroup'] if e['name'] != target]
+            entry['isLinked'] = bool(entry['linkedStorageGroup'])
+        elif action == 'restore':
+            entry['isRestored'] = True
+        elif action == 'rename':
+            new_name = payload.get('rename', {}).get('newSnapshotName')
+            self.snapshots[sg_name][new_name] = \
+                self.snapshots[sg_name].pop(name)
+            for e in self.snapshots[sg_name][new_name]:
+                e['name'] = new_name
+            name = new_name
+        else:
+            raise SimulatorError(400, 'Unsupported snapshot action {}'
+                                 .format(payload.get('action')))
+        return self.snapshot_generation(sg_name, name, generation)
+
+    def delete_snapshot(self, sg_name, name, generation):
+        self.snapshot_generation(sg_name, name, generation)
+        generations = self.snapshots[sg_name][name]
+        generations[:] = [e for e in generations
+                          if e['generation'] != int(generation)]
+        if not generations:
+            del self.snapshots[sg_name][name]
+
+    # SRDF --------------------------------------------------------------
+
+    def sg_rdf_detail(self, sg_name, rdfg):
+        group = self._get(self.rdf_groups, int(rdfg), 'RDF Group')
+        if sg_name not in group['sgs']:
+            raise SimulatorError(404, 'Storage Group {} is not in RDF group '
+                                      '{}'.format(sg_name, rdfg))
+        return {'storageGroupName': sg_name, 'symmetrixId': self.array_id,
+                'rdfGroupNumber': int(rdfg), 'volumeRdfTypes': ['R1'],
+                'states': [group['sgs'][sg_name]], 'modes': [group['mode']],
+                'largerRdfSides': ['Equal'], 'hop2Rdfgs': [],
+                'hop2States': [], 'hop2Modes': [], 'totalTracks': 24585,
+                'localR1InvalidTracksHop1': 0,
+                'localR2InvalidTracksHop1': 0,
+                'remoteR1InvalidTracksHop1': 0,
+                'remoteR2InvalidTracksHop1': 0}
+
+    def modify_sg_rdf(self, sg_name, rdfg, payload):
+        self.sg_rdf_detail(sg_name, rdfg)
+        action = payload.get('action')
+        if action not in SRDF_STATES:
+            raise SimulatorError(400, 'Unsupported SRDF action {}'
+                                 .format(action))
+        group = self.rdf_groups[int(rdfg)]
+        if group['sgs'][sg_name] == SRDF_STATES[action]:
+            raise SimulatorError(400, 'The SRDF pairs are already in the '
+                                      'requested state')
+        group['sgs'][sg_name] = SRDF_STATES[action]
+        return self.sg_rdf_detail(sg_name, rdfg)
+
+    def delete_sg_rdf(self, sg_name, rdfg):
+        self.sg_rdf_detail(sg_name, rdfg)
+        del self.rdf_groups[int(rdfg)]['sgs'][sg_name]
+        for volume_id in self.storage_groups[sg_name]['volumes']:
+            rdf = self.volumes[volume_id]['rdf']
+            if int(rdfg) in rdf:
+                rdf.remove(int(rdfg))
+
+    def rdf_volume_detail(self, rdfg, volume_id):
+        self._get(self.rdf_groups, int(rdfg), 'RDF Group')
+        vol = self._get(self.volumes, volume_id, 'Volume')
+        if int(rdfg) not in vol['rdf']:
+            raise SimulatorError(404, 'Volume {} is not in RDF group {}'
+                                 .format(volume_id, rdfg))
+        group = self.rdf_groups[int(rdfg)]
+        return {'localSymmetrixId': self.array_id,
+                'remoteSymmetrixId': group['remote_array'],
+                'localVolumeName': volume_id, 'remoteVolumeName': volume_id,
+                'localRdfGroupNumber': int(rdfg),
+                'remoteRdfGroupNumber': int(rdfg),
+                'rdfMode': group['mode'], 'localVolumeState': 'Ready',
+                'remoteVolumeState': 'Write Disabled',
+                'volumeConfig': 'RDF1+TDEV'}
+
+    # Helpers -----------------------------------------------------------
+
+    @staticmethod
+    def _get(collection, key, kind):
+        if key not in collection:
+            raise SimulatorError(404, 'Cannot find {} {}'.format(kind, key))
+        return collection[key]
+
+    def populate(self, volumes=0, storage_groups=0, hosts=0, vol_size=10,
+                 snapshots=0, srdf_groups=0):
+        """
+        Build a deterministic array layout
+        :param volumes: (int) number of volumes, spread across the SGs
+        :param storage_groups: (int) number of storage groups
+        :param hosts: (int) number of hosts, paired in host groups
+        :param vol_size: (int) size of the volumes in GB
+        :param snapshots: (int) number of SGs having a snapshot
+        :param srdf_groups: (int) number of SGs protected by SRDF
+        :return: None
+        """
+        sg_names = ['SG_{:04d}'.format(i) for i in range(storage_groups)]
+        for i, name in enumerate(sg_names):
+            self.storage_groups[name] = {
+                'slo': SLOS[i % 5], 'srp': self.srp, 'compression': True,
+                'volumes': [], 'children': [], 'parents': []}
+        for i in range(volumes):
+            volume_id = self.new_volume(vol_size * (1 + i % 4),
+                                        'VOL_{}'.format(i % 8))
+            self.volumes[volume_id]['allocated'] = 10.0
+            if sg_names:
+                self._add_volume_to_sg(sg_names[i % len(sg_names)],
+                                       volume_id)
+        for i in range(hosts):
+            self.hosts['HOST_{:04d}'.format(i)] = {
+                'initiators': ['10000000c9{:06x}'.format(2 * i),
+                               '10000000c9{:06x}'.format(2 * i + 1)],
+                'flags': {}}
+        host_names = sorted(self.hosts)
+        for i in range(0, len(host_names) - 1, 2):
+            self.host_groups['HG_{:04d}'.format(i // 2)] = {
+                'hosts': host_names[i:i + 2]}
+        for i in range(min(len(sg_names), max(len(host_names) // 2, 0))):
+            pg = 'PG_{:04d}'.format(i)
+            self.port_groups[pg] = {'ports': [self.ports[i % 16],
+                                              self.ports[(i + 8) % 16]]}
+            self.masking_views['MV_{:04d}'.format(i)] = {
+                'hostGroupId': 'HG_{:04d}'.format(i), 'portGroupId': pg,
+                'storageGroupId': sg_names[i]}
+        for name in sg_names[:snapshots]:
+            self.create_snapshot(name, {'snapshotName': 'SNAP_' + name})
+        if srdf_groups:
+            self.rdf_groups[1] = {'label': 'RDFG_1', 'mode': 'Synchronous',
+                                  'remote_array': '000197600999', 'sgs': {}}
+            for name in sg_names[:srdf_groups]:
+                self.rdf_groups[1]['sgs'][name] = 'Synchronized'
+                for volume_id in self.storage_groups[name]['volumes']:
+                    self.volumes[volume_id]['rdf'].append(1)
+
+
+class UnisphereSimulator(object):
+    """
+    Routes the Unisphere REST calls to the array models, accounts the calls
+    served and applies the configured latency
+    """
+
+    def __init__(self, arrays, user='smc', password='smc', latency=0.0,
+                 job_duration=0.0, session_timeout=1800):
+        """
+        :param arrays: (list) ArrayModel served
+        :param user: (str) Unisphere user
+        :param password: (str) Unisphere password
+        :param latency: (float) seconds added to every call
+        :param job_duration: (float) seconds an asynchronous job runs
+        :param session_timeout: (int) seconds a session cookie stays valid
+        """
+        self.arrays = dict((a.array_id, a) for a in arrays)
+        self.latency = latency
+        self.job_duration = job_duration
+        self.session_timeout = session_timeout
+        self._credentials = 'Basic ' + base64.b64encode(
+            '{}:{}'.format(user, password).encode('utf-8')).decode('ascii')
+        self._lock = threading.RLock()
+        self._sessions = {}
+        self._jobs = {}
+        self._iterators = {}
+        self._job_ids = itertools.count(1)
+        self.reset_stats()
+        self._routes = [(method, re.compile('^' + pattern + '$'), handler)
+                        for method, pattern, handler in self._route_table()]
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {'calls': 0, 'bytes_sent': 0, 'logins': 0,
+                          'by_endpoint': {}}
+
+    def _route_table(self):
+        array = r'/(?:sloprovisioning|replication)/symmetrix/(?P<array>\w+)'
+        prov = r'/sloprovisioning/symmetrix/(?P<array>\w+)'
+        rep = r'/replication/symmetrix/(?P<array>\w+)'
+        name = r'(?P<name>[^/]+)'
+        return [
+            ('GET', r'/system/version', self._version),
+            ('GET', r'/system/symmetrix', self._array_list),
+            ('GET', r'/system/symmetrix/(?P<array>\w+)', self._array),
+            ('GET', r'/(?:system|common)/job/(?P<job>[^/]+)', self._job),
+            ('GET', r'/common/Iterator/(?P<iterator>[^/]+)/page',
+             self._iterator_page),
+            ('DELETE', r'/common/Iterator/(?P<iterator>[^/]+)',
+             self._iterator_delete),
+            ('GET', r'/sloprovisioning/symmetrix', self._array_list),
+            ('GET', array, self._array),
+            ('GET', prov + r'/volume', self._volume_list),
+            ('GET', r'/systems/(?P<array>\w+)/volumes',
+             self._bulk_volume_list),
+            ('GET', r'/systems/(?P<array>\w+)/storage-groups',
+             self._bulk_factory('storage_groups', 'sg_detail')),
+            ('GET', r'/systems/(?P<array>\w+)/hosts',
+             self._bulk_factory('hosts', 'host_detail')),
+            ('GET', r'/systems/(?P<array>\w+)/host-groups',
+             self._bulk_factory('host_groups', 'host_group_detail')),
+            ('GET', r'/systems/(?P<array>\w+)/port-groups',
+             self._bulk_factory('port_groups', 'port_group_detail')),
+            ('GET', r'/systems/(?P<array>\w+)/masking-views',
+             self._bulk_factory('masking_views', 'masking_view_detail')),
+            ('GET', prov + r'/volume/' + name,
+             lambda a, name, **k: a.volume_detail(name)),
+            ('PUT', prov + r'/volume/' + name,
+             lambda a, name, payload, **k: a.modify_volume(name, payload)),
+            ('DELETE', prov + r'/volume/' + name,
+             lambda a, name, **k: a.delete_volume(name)),
+            ('GET', prov + r'/storagegroup', self._list_factory(
+                'storage_groups', 'sg_detail', 'storageGroupId')),
+            ('POST', prov + r'/storagegroup',
+             lambda a, payload, **k: a.create_sg(payload)),
+            ('GET', prov + r'/storagegroup/' + name,
+             lambda a, name, **k: a.sg_detail(name)),
+            ('PUT', prov + r'/storagegroup/' + name,
+             lambda a, name, payload, **k: a.modify_sg(name, payload)),
+            ('DELETE', prov + r'/storagegroup/' + name,
+             lambda a, name, **k: a.delete_sg(name)),
+            ('GET', prov + r'/host', self._list_factory(
+                'hosts', 'host_detail', 'hostId')),
+            ('POST', prov + r'/host',
+             lambda a, payload, **k: a.create_host(payload)),
+            ('GET', prov + r'/host/' + name,
+             lambda a, name, **k: a.host_detail(name)),
+            ('PUT', prov + r'/host/' + name,
+             lambda a, name, payload, **k: a.modify_host(name, payload)),
+            ('DELETE', prov + r'/host/' + name,
+             lambda a, name, **k: a.delete_host(name)),
+            ('GET', prov + r'/hostgroup', self._list_factory(
+                'host_groups', 'host_group_detail', 'hostGroupId')),
+            ('POST', prov + r'/hostgroup',
+             lambda a, payload, **k: a.create_host_group(payload)),
+            ('GET', prov + r'/hostgroup/' + name,
+             lambda a, name, **k: a.host_group_detail(name)),
+            ('PUT', prov + r'/hostgroup/' + name,
+             lambda a, name, payload, **k: a.modify_host_group(name,
+                                                               payload)),
+            ('DELETE', prov + r'/hostgroup/' + name,
+             lambda a, name, **k: a.delete_host_group(name)),
+            ('GET', prov + r'/portgroup', self._list_factory(
+                'port_groups', 'port_group_detail', 'portGroupId')),
+            ('POST', prov + r'/portgroup',
+             lambda a, payload, **k: a.create_port_group(payload)),
+            ('GET', prov + r'/portgroup/' + name,
+             lambda a, name, **k: a.port_group_detail(name)),
+            ('PUT', prov + r'/portgroup/' + name,
+             lambda a, name, payload, **k: a.modify_port_group(name,
+                                                               payload)),
+            ('DELETE', prov + r'/portgroup/' + name,
+             lambda a, name, **k: a.delete_port_group(name)),
+            ('GET', prov + r'/maskingview', self._list_factory(
+                'masking_views', 'masking_view_detail', 'maskingViewId')),
+            ('POST', prov + r'/maskingview',
+             lambda a, payload, **k: a.create_masking_view(payload)),
+            ('GET', prov + r'/maskingview/' + name,
+             lambda a, name, **k: a.masking_view_detail(name)),
+            ('GET', prov + r'/maskingview/' + name + r'/connections',
+             lambda a, name, **k: a.masking_view_connections(name)),
+            ('PUT', prov + r'/maskingview/' + name,
+             lambda a, name, payload, **k: a.modify_masking_view(name,
+                                                                 payload)),
+            ('DELETE', prov + r'/maskingview/' + name,
+             lambda a, name, **k: a.masking_views.pop(
+                 a.masking_view_detail(name)['maskingViewId'])),
+            ('GET', prov + r'/slo',
+             lambda a, **k: {'sloId': list(SLOS)}),
+            ('GET', prov + r'/slo/' + name, self._slo),
+            ('GET', prov + r'/srp', lambda a, **k: {'srpId': [a.srp]}),
+            ('GET', prov + r'/srp/' + name, self._srp),
+            ('GET', prov + r'/srp/' + name +
+             r'/storage_group_demand_report', self._sg_demand),
+            ('GET', prov + r'/port', lambda a, **k: {'symmetrixPortKey': [
+                dict(zip(('directorId', 'portId'), p.split(':')))
+                for p in a.ports]}),
+            ('GET', prov + r'/director/(?P<director>[^/]+)/port',
+             lambda a, director, **k: {'symmetrixPortKey': [
+                 dict(zip(('directorId', 'portId'), p.split(':')))
+                 for p in a.ports if p.startswith(director + ':')]}),
+            ('GET', prov + r'/director/(?P<director>[^/]+)/port/'
+                           r'(?P<port>[^/]+)',
+             lambda a, director, port, **k: a.port_detail(director, port)),
+            ('GET', prov + r'/initiator', lambda a, **k: {'initiatorId': [
+                i for h in a.hosts.values() for i in h['initiators']]}),
+            ('GET', rep + r'/storagegroup', self._rep_sg_list),
+            ('GET', rep + r'/storagegroup/' + name,
+             lambda a, name, **k: {
+                 'name': a.sg_detail(name)['storageGroupId'],
+                 'snapVXSnapshots': sorted(a.snapshots.get(name, {})),
+                 'rdf': any(name in g['sgs']
+                            for g in a.rdf_groups.values())}),
+            ('GET', rep + r'/storagegroup/' + name + r'/snapshot',
+             lambda a, name, **k: {
+                 'name': sorted(a.snapshots.get(
+                     a.sg_detail(name)['storageGroupId'], {}))}),
+            ('POST', rep + r'/storagegroup/' + name + r'/snapshot',
+             lambda a, name, payload, **k: a.create_snapshot(name, payload)),
+            ('GET', rep + r'/storagegroup/' + name +
+             r'/snapshot/(?P<snap>[^/]+)/generation',
+             lambda a, name, snap, **k: {'generation': [
+                 e['generation'] for e in a.snapshots.get(name, {})
+                 .get(snap, [])]}),
+            ('GET', rep + r'/storagegroup/' + name +
+             r'/snapshot/(?P<snap>[^/]+)/generation/(?P<gen>\d+)',
+             lambda a, name, snap, gen, **k: a.snapshot_generation(
+                 name, snap, gen)),
+            ('PUT', rep + r'/storagegroup/' + name +
+             r'/snapshot/(?P<snap>[^/]+)/generation/(?P<gen>\d+)',
+             lambda a, name, snap, gen, payload, **k: a.modify_snapshot(
+                 name, snap, gen, payload)),
+            ('DELETE', rep + r'/storagegroup/' + name +
+             r'/snapshot/(?P<snap>[^/]+)/generation/(?P<gen>\d+)',
+             lambda a, name, snap, gen, **k: a.delete_snapshot(
+                 name, snap, gen)),
+            ('GET', rep + r'/storagegroup/' + name + r'/rdf_group',
+             lambda a, name, **k: {'storageGroupName': name, 'rdfgs': sorted(
+                 n for n, g in a.rdf_groups.items() if name in g['sgs'])}),
+            ('GET', rep + r'/storagegroup/' + name +
+             r'/rdf_group/(?P<rdfg>\d+)',
+             lambda a, name, rdfg, **k: a.sg_rdf_detail(name, rdfg)),
+            ('PUT', rep + r'/storagegroup/' + name +
+             r'/rdf_group/(?P<rdfg>\d+)',
+             lambda a, name, rdfg, payload, **k: a.modify_sg_rdf(
+                 name, rdfg, payload)),
+            ('DELETE', rep + r'/storagegroup/' + name +
+             r'/rdf_group/(?P<rdfg>\d+)',
+             lambda a, name, rdfg, **k: a.delete_sg_rdf(name, rdfg)),
+            ('GET', rep + r'/rdf_group', lambda a, **k: {'rdfGroupID': [
+                {'rdfgNumber': n, 'label': g['label']}
+                for n, g in sorted(a.rdf_groups.items())]}),
+            ('GET', rep + r'/rdf_group/(?P<rdfg>\d+)',
+             lambda a, rdfg, **k: dict(
+                 rdfgNumber=int(rdfg), label=a._get(
+                     a.rdf_groups, int(rdfg), 'RDF Group')['label'],
+                 remoteSymmetrix=a.rdf_groups[int(rdfg)]['remote_array'],
+                 modes=[a.rdf_groups[int(rdfg)]['mode']])),
+            ('GET', rep + r'/rdf_group/(?P<rdfg>\d+)/volume',
+             lambda a, rdfg, **k: {'name': sorted(
+                 v for v, d in a.volumes.items() if int(rdfg) in d['rdf'])}),
+            ('GET', rep + r'/rdf_group/(?P<rdfg>\d+)/volume/'
+                          r'(?P<device>[^/]+)',
+             lambda a, rdfg, device, **k: a.rdf_volume_detail(rdfg,
+                                                               device)),
+        ]
+
+    # Generic handlers --------------------------------------------------
+
+    def _list_factory(self, collection, detail, key):
+        def handler(array, query, **kwargs):
+            names = sorted(getattr(array, collection))
+            if query:
+                names = [d[key] for d in _filter_items(
+                    (getattr(array, detail)(n) for n in names), query)]
+            return {key: names, 'num_of_' + collection: len(names)}
+        return handler
+
+    def _version(self, **kwargs):
+        return {'version': 'V9.0.1.6'}
+
+    def _array_list(self, **kwargs):
+        return {'symmetrixId': sorted(self.arrays)}
+
+    def _array(self, array, **kwargs):
+        return {'symmetrixId': array.array_id, 'local': True,
+                'model': 'PowerMax_2000', 'ucode': '5978.221.221',
+                'device_count': len(array.volumes)}
+
+    def _slo(self, array, name, **kwargs):
+        if name not in SLOS:
+            raise SimulatorError(404, 'Cannot find SLO {}'.format(name))
+        return {'sloId': name, 'num_of_storage_groups': len(
+            [s for s in array.storage_groups.values() if s['slo'] == name])}
+
+    def _srp(self, array, name, **kwargs):
+        if name != array.srp:
+            raise SimulatorError(404, 'Cannot find SRP {}'.format(name))
+        used = sum(v['cap_gb'] for v in array.volumes.values())
+        return {'srpId': name, 'num_of_disk_groups': 1,
+                'emulation': 'FBA', 'reserved_cap_percent': 10,
+                'total_usable_cap_gb': 1024000.0,
+                'total_subscribed_cap_gb': round(used, 2),
+                'total_allocated_cap_gb': round(used / 10, 2)}
+
+    def _sg_demand(self, array, name, **kwargs):
+        return {'storageGroupDemand': [
+            {'storageGroupId': sg, 'subscribed_gb': array.sg_detail(sg)[
+                'cap_gb'], 'emulation': 'FBA', 'compression_ratio': 1.0}
+            for sg in sorted(array.storage_groups)]}
+
+    def _rep_sg_list(self, array, query, **kwargs):
+        names = sorted(array.storage_groups)
+        if str(query.get('hasSrdf', '')).lower() == 'true':
+            names = [n for n in names
+                     if any(n in g['sgs'] for g in array.rdf_groups.values())]
+        if str(query.get('hasSnapshots', '')).lower() == 'true':
+            names = [n for n in names if array.snapshots.get(n)]
+        return {'name': names}
+
+    def _volume_list(self, array, query, **kwargs):
+        return self._iterator(
+            [{'volumeId': v} for v in array.list_volumes(query)])
+
+    @staticmethod
+    def _select(details, select):
+        if not select:
+            return details
+        keys = select.split(',')
+        return [dict((k, d[k]) for k in keys if k in d) for d in details]
+
+    def _bulk_volume_list(self, array, query, **kwargs):
+        """
+        Bulk volume endpoint of Unisphere 10: the volume details are paged
+        by the iterator, select restricts the attributes returned
+        """
+        query = dict(query)
+        select = query.pop('select', None)
+        details = [array.volume_detail(v) for v in array.list_volumes(query)]
+        return self._iterator(self._select(details, select))
+
+    def _bulk_factory(self, collection, detail):
+        def handler(array, query, **kwargs):
+            query = dict(query)
+            select = query.pop('select', None)
+            details = _filter_items(
+                (getattr(array, detail)(n)
+                 for n in sorted(getattr(array, collection))), query)
+            return self._iterator(self._select(list(details), select))
+        return handler
+
+    def _iterator(self, results):
+        """
+        Page a result list the way Unisphere does: the first page is
+        returned with the iterator id, the next ones are read through
+        /common/Iterator/{id}/page
+        """
+        iterator_id = str(uuid.uuid4())
+        with self._lock:
+            self._iterators[iterator_id] = results
+            while len(self._iterators) > 256:
+                self._iterators.pop(next(iter(self._iterators)))
+        count = len(results)
+        return {'id': iterator_id, 'count': count,
+                'expirationTime': int((time.time() + 600) * 1000),
+                'maxPageSize': MAX_PAGE_SIZE,
+                'resultList': {'result': results[:MAX_PAGE_SIZE],
+                               'from': 1 if count else 0,
+                               'to': min(count, MAX_PAGE_SIZE)}}
+
+    def _iterator_page(self, iterator, query, **kwargs):
+        if iterator not in self._iterators:
+            raise SimulatorError(404, 'Iterator {} not found'
+                                 .format(iterator))
+        start = int(query.get('from', 1))
+        end = int(query.get('to', start + MAX_PAGE_SIZE - 1))
+        if end - start + 1 > MAX_PAGE_SIZE:
+            raise SimulatorError(400, 'Page size above {}'
+                                 .format(MAX_PAGE_SIZE))
+        return {'result': self._iterators[iterator][start - 1:end],
+                'from': start, 'to': end}
+
+    def _iterator_delete(self, iterator, **kwargs):
+        self._iterators.pop(iterator, None)
+
+    def _job(self, job, **kwargs):
+        if job not in self._jobs:
+            raise SimulatorError(404, 'Job {} not found'.format(job))
+        detail = dict(self._jobs[job])
+        if detail['status'] == 'RUNNING' and \
+                time.time() >= detail.pop('_done_at'):
+            detail['status'] = detail.pop('_final_status')
+            detail['completed_date_milliseconds'] = int(time.time() * 1000)
+            self._jobs[job] = detail
+        return dict((k, v) for k, v in detail.items()
+                    if not k.startswith('_'))
+
+    def _submit_job(self, method, path, func):
+        """
+        Run a write asynchronously: the change is applied straight away
+        but the job only reports its final status after job_duration
+        """
+        job_id = str(next(self._job_ids))
+        job = {'jobId': job_id, 'name': '{} {}'.format(method, path),
+               'status': 'RUNNING', 'username': 'smc',
+               'last_modified_date': time.strftime('%b-%d-%Y %H:%M:%S'),
+               'last_modified_date_milliseconds': int(time.time() * 1000),
+               'resourceLink': API_ROOT + path,
+               '_done_at': time.time() + self.job_duration}
+        try:
+            func()
+            job['_final_status'] = 'SUCCEEDED'
+            job['result'] = 'Succeeded'
+        except SimulatorError as error:
+            job['_final_status'] = 'FAILED'
+            job['result'] = error.message
+        job['task'] = [{'execution_order': 1,
+                        'description': job['name']}]
+        self._jobs[job_id] = job
+        return self._job(job_id)
+
+    # Request processing ------------------------------------------------
+
+    def authenticate(self, headers):
+        """
+        Check the credentials or the session cookie of a request
+        :param headers: request headers
+        :return: (str) session id to set as cookie, None if already set
+        """
+        cookie = headers.get('Cookie') or ''
+        match = re.search(r'JSESSIONID=([^;\s]+)', cookie)
+        now = time.time()
+        with self._lock:
+            if match and self._sessions.get(match.group(1), 0) > now:
+                return None
+            if headers.get('Authorization') != self._credentials:
+                raise SimulatorError(401, 'Unauthorized')
+            session_id = uuid.uuid4().hex
+            self._sessions[session_id] = now + self.session_timeout
+            self.stats['logins'] += 1
+        return session_id
+
+    def handle(self, method, url, headers, body):
+        """
+        Serve one REST call
+        :return: (tuple) status, response dict, extra headers
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        parsed = urlparse(url)
+        path = unquote(parsed.path)
+        query = dict(parse_qsl(parsed.query))
+        if path.startswith(API_ROOT):
+            path = path[len(API_ROOT):]
+        path = re.sub(r'^/\d+(?=/)', '', path)
+        template = self._template(method, path)
+        with self._lock:
+            self.stats['calls'] += 1
+            self.stats['by_endpoint'][template] = \
+                self.stats['by_endpoint'].get(template, 0) + 1
+        extra_headers = {}
+        try:
+            session_id = self.authenticate(headers)
+            if session_id:
+                extra_headers['Set-Cookie'] = \
+                    'JSESSIONID={}; Path=/univmax; Secure; HttpOnly' \
+                    .format(session_id)
+            payload = json.loads(body.decode('utf-8')) if body else {}
+            status, result = self._dispatch(method, path, query, payload)
+        except SimulatorError as error:
+            status, result = error.status, {'message': error.message}
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            status, result = 400, {'message': 'Bad request: {}'
+                                   .format(error)}
+        return status, result, extra_headers
+
+    def _dispatch(self, method, path, query, payload):
+        route_found = False
+        for route_method, regex, handler in self._routes:
+            match = regex.match(path)
+            if not match:
+                continue
+            route_found = True
+            if route_method != method:
+                continue
+            kwargs = match.groupdict()
+            args = []
+            if 'array' in kwargs:
+                array_id = kwargs.pop('array')
+                if array_id not in self.arrays:
+                    raise SimulatorError(404, 'Cannot find array {}'
+                                         .format(array_id))
+                args.append(self.arrays[array_id])
+            kwargs.update(query=query, payload=payload)
+            with self._lock:
+                if method != 'GET' and \
+                        payload.get('executionOption') == 'ASYNCHRONOUS':
+                    return 202, self._submit_job(
+                        method, path, lambda: handler(*args, **kwargs))
+                result = handler(*args, **kwargs)
+            if method == 'DELETE':
+                return 204, None
+            return (201 if method == 'POST' else 200), result
+        if route_found:
+            raise SimulatorError(405, 'Method {} not allowed on {}'
+                                 .format(method, path))
+        raise SimulatorError(404, 'No resource at {}'.format(path))
+
+    @staticmethod
+    def _template(method, path):
+        """
+        Collapse object names so that calls are accounted per endpoint
+        """
+        parts = path.strip('/').split('/')
+        for i in range(1, len(parts)):
+            if parts[i - 1] in ('symmetrix', 'volume', 'storagegroup', 'host',
+                                'hostgroup', 'portgroup', 'maskingview',
+                                'slo', 'srp', 'director', 'port', 'job',
+                                'Iterator', 'snapshot', 'generation',
+                                'rdf_group', 'systems'):
+                parts[i] = '{id}'
+        return '{} /{}'.format(method, '/'.join(parts))
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    simulator = None
+
+    def setup(self):
+        if hasattr(self.request, 'do_handshake'):
+            self.request.do_handshake()
+        BaseHTTPRequestHandler.setup(self)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _serve(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if self.path.startswith('/simulator/'):
+            status, result, extra_headers = self._serve_control()
+        else:
+            status, result, extra_headers = self.simulator.handle(
+                self.command, self.path, self.headers, body)
+        data = json.dumps(result).encode('utf-8') \
+            if result is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in extra_headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+        with self.simulator._lock:
+            self.simulator.stats['bytes_sent'] += len(data)
+
+    def _serve_control(self):
+        if self.path == '/simulator/stats':
+            with self.simulator._lock:
+                return 200, json.loads(json.dumps(self.simulator.stats)), {}
+        if self.path == '/simulator/reset':
+            self.simulator.reset_stats()
+            return 200, {}, {}
+        return 404, {'message': 'Unknown control endpoint'}, {}
+
+    do_GET = do_POST = do_PUT = do_DELETE = _serve
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    ssl_context = None
+
+    def get_request(self):
+        sock, address = HTTPServer.get_request(self)
+        if self.ssl_context:
+            sock = self.ssl_context.wrap_socket(
+                sock, server_side=True, do_handshake_on_connect=False)
+        return sock, address
+
+
+def generate_self_signed_cert(directory):
+    """
+    Create a throw-away certificate with the openssl command
+    :param directory: (str) where to write cert.pem and key.pem
+    :return: (tuple) certificate and key paths
+    """
+    if not shutil.which('openssl'):
+        raise RuntimeError('openssl command not found, provide --certfile '
+                           'and --keyfile')
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    subprocess.check_call(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+         '-keyout', keyfile, '-out', certfile, '-days', '7',
+         '-subj', '/CN=localhost'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return certfile, keyfile
+
+
+class SimulatorServer(object):
+    """
+    HTTPS front end of the simulator, can run in a background thread
+    """
+
+    def __init__(self, simulator, host='127.0.0.1', port=8443,
+                 certfile=None, keyfile=None, plain_http=False):
+        handler = type('Handler', (_RequestHandler,),
+                       {'simulator': simulator})
+        self.simulator = simulator
+        self.httpd = _ThreadingHTTPServer((host, port), handler)
+        self._tmpdir = None
+        if not plain_http:
+            if not certfile:
+                self._tmpdir = tempfile.mkdtemp(prefix='unisphere_sim_')
+                certfile, keyfile = generate_self_signed_cert(self._tmpdir)
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self.httpd.ssl_context = context
+        self.port = self.httpd.server_address[1]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._tmpdir:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+
+def build_simulator(args):
+    arrays = []
+    for array_id in args.array_id:
+        array = ArrayModel(array_id)
+        array.populate(volumes=args.volumes,
+                       storage_groups=args.storage_groups,
+                       hosts=args.hosts, snapshots=args.snapshots,
+                       srdf_groups=args.srdf_groups)
+        arrays.append(array)
+    return UnisphereSimulator(arrays, user=args.user,
+                              password=args.password, latency=args.latency,
+                              job_duration=args.job_duration)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--array-id', nargs='+', default=['000197600156'],
+                        help='serial numbers of the simulated arrays')
+    parser.add_argument('--user', default='smc')
+    parser.add_argument('--password', default='smc')
+    parser.add_argument('--volumes', type=int, default=1024)
+    parser.add_argument('--storage-groups', type=int, default=64)
+    parser.add_argument('--hosts', type=int, default=32)
+    parser.add_argument('--snapshots', type=int, default=4)
+    parser.add_argument('--srdf-groups', type=int, default=4,
+                        help='number of SGs protected by SRDF')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every REST call')
+    parser.add_argument('--job-duration', type=float, default=0.0,
+                        help='seconds an asynchronous job keeps running')
+    parser.add_argument('--certfile')
+    parser.add_argument('--keyfile')
+    parser.add_argument('--plain-http', action='store_true',
+                        help='serve HTTP instead of HTTPS')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = SimulatorServer(build_simulator(args), args.host, args.port,
+                             args.certfile, args.keyfile, args.plain_http)
+    print('Unisphere simulator for array {} listening on {}://{}:{}'.format(
+        args.array_id, 'http' if args.plain_http else 'https', args.host,
+        server.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()